@@ -0,0 +1,330 @@
+"""
+Benchmark del análisis de archivos (Paso 1 -> Paso 2).
+
+Genera PDFs maestros sintéticos de 1.000, 10.000 y 50.000 páginas a partir de
+una plantilla (la de generador.py si existe, o una página mínima con la
+etiqueta D.N.I.), con su archivo de empleados en CSV y en XLSX, y mide por
+separado la extracción de NIFs, la lectura del archivo de empleados, el
+cruce y la creación del almacén de tareas. Cada caso se ejecuta en un
+proceso aparte para que la memoria máxima (RSS) sea la de ese caso.
+
+Los resultados se guardan en JSON para comparar ejecuciones:
+
+    python benchmark_analisis.py
+    python benchmark_analisis.py --paginas 1000 --modos completo rapido
+    python benchmark_analisis.py --comparar resultados_benchmark/anterior.json
+"""
+import argparse
+import configparser
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import fitz
+
+# --- CONFIGURACIÓN ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROYECTO_DIR = os.path.dirname(SCRIPT_DIR)
+CARPETA_APLICACION = os.path.join(PROYECTO_DIR, "sistema_nominas")
+
+NIF_PLACEHOLDER = "XXXXXXXXL"
+PLANTILLA_BASE = os.path.join(SCRIPT_DIR, "plantillas", "plantilla_nomina.pdf")
+CARPETA_DATOS = os.path.join(SCRIPT_DIR, "datos_benchmark")
+CARPETA_RESULTADOS = os.path.join(SCRIPT_DIR, "resultados_benchmark")
+
+TAMANOS = (1000, 10000, 50000)
+FORMATOS = ("csv", "xlsx")
+
+# Columnas del archivo de empleados sintético y su mapeo
+CABECERAS_EMPLEADOS = ["POS.", "D.N.I.", "NOMBRE", "APELLIDOS", "EMAIL", "DEPARTAMENTO"]
+MAPA_COLUMNAS = {"nif": "D.N.I.", "nombre": "NOMBRE", "apellidos": "APELLIDOS", "email": "EMAIL"}
+
+# Empleados de la plantilla que no tienen nómina ese mes (filas extra del Excel)
+PROPORCION_EMPLEADOS_SIN_NOMINA = 0.1
+
+SEMILLA = 2025
+
+
+# --- GENERACIÓN DE DATOS ---
+
+def generar_nif(aleatorio):
+    """Genera un NIF español falso pero con letra válida."""
+    letras = "TRWAGMYFPDXBNJZSQVHLCKE"
+    numeros = aleatorio.randint(10000000, 99999999)
+    return f"{numeros}{letras[numeros % 23]}"
+
+
+def _plantilla_minima():
+    """Crea en memoria una página de nómina mínima con el placeholder del NIF."""
+    doc = fitz.open()
+    pagina = doc.new_page()
+    pagina.insert_text((50, 60), "EMPRESA DE EJEMPLO S.L.   C.I.F. B12345678", fontsize=9)
+    pagina.insert_text((50, 100), "TRABAJADOR: EMPLEADO DE PRUEBA", fontsize=9)
+    pagina.insert_text((50, 120), "D.N.I.", fontsize=9)
+    pagina.insert_text((90, 120), NIF_PLACEHOLDER, fontsize=9)
+    for linea in range(30):
+        pagina.insert_text(
+            (50, 180 + linea * 15),
+            f"Concepto {linea:02d}   Salario base   1.234,56   Retención IRPF   123,45",
+            fontsize=8)
+    return doc
+
+
+def _cargar_plantilla():
+    """Return (template document, NIF placeholder rect) with the placeholder removed."""
+    if os.path.exists(PLANTILLA_BASE):
+        doc = fitz.open(PLANTILLA_BASE)
+    else:
+        doc = _plantilla_minima()
+    pagina = doc.load_page(0)
+    rectangulos = pagina.search_for(NIF_PLACEHOLDER)
+    if not rectangulos:
+        raise ValueError(f"No se encontró '{NIF_PLACEHOLDER}' en la plantilla.")
+    rect_nif = rectangulos[0]
+    pagina.add_redact_annot(rect_nif, fill=(1, 1, 1))
+    pagina.apply_redactions()
+    return doc, rect_nif
+
+
+def rutas_datos(paginas):
+    """Return the paths of the synthetic master PDF and employee files."""
+    base = os.path.join(CARPETA_DATOS, f"nominas_{paginas}")
+    return {"pdf": base + ".pdf", "csv": base + "_empleados.csv", "xlsx": base + "_empleados.xlsx"}
+
+
+def generar_datos(paginas, regenerar=False):
+    """Genera el PDF maestro y los archivos de empleados de un tamaño.
+
+    Una de cada cien páginas se deja sin NIF y otra lleva un NIF que no está
+    en la lista, para que el cruce también produzca advertencias y errores.
+    """
+    rutas = rutas_datos(paginas)
+    if not regenerar and all(os.path.exists(ruta) for ruta in rutas.values()):
+        return rutas
+
+    os.makedirs(CARPETA_DATOS, exist_ok=True)
+    aleatorio = random.Random(SEMILLA + paginas)
+    print(f"Generando PDF maestro de {paginas} páginas...")
+    inicio = time.perf_counter()
+
+    plantilla, rect_nif = _cargar_plantilla()
+    doc_maestro = fitz.open()
+    nifs = set()
+    empleados = []
+    for i in range(paginas):
+        nif = generar_nif(aleatorio)
+        while nif in nifs:
+            nif = generar_nif(aleatorio)
+        nifs.add(nif)
+
+        doc_maestro.insert_pdf(plantilla)
+        if i % 100 != 50:
+            doc_maestro[-1].insert_text(
+                rect_nif.bottom_left, nif, fontsize=8, fontname="helv", color=(0, 0, 0))
+        if i % 100 != 75:
+            empleados.append(nif)
+    doc_maestro.save(rutas["pdf"], garbage=3, deflate=True)
+    doc_maestro.close()
+    plantilla.close()
+
+    for _ in range(int(paginas * PROPORCION_EMPLEADOS_SIN_NOMINA)):
+        nif = generar_nif(aleatorio)
+        if nif not in nifs:
+            empleados.append(nif)
+    aleatorio.shuffle(empleados)
+    filas = [
+        [posicion, nif, f"Nombre{posicion}", f"Apellido{posicion} Prueba",
+         f"empleado.{posicion}@empresa-ejemplo.com", f"Departamento {posicion % 12}"]
+        for posicion, nif in enumerate(empleados, 1)
+    ]
+
+    with open(rutas["csv"], 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(CABECERAS_EMPLEADOS)
+        writer.writerows(filas)
+
+    from openpyxl import Workbook
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet()
+    hoja.append(CABECERAS_EMPLEADOS)
+    for fila in filas:
+        hoja.append(fila)
+    libro.save(rutas["xlsx"])
+
+    print(f"✅ Datos de {paginas} páginas generados en {time.perf_counter() - inicio:.1f} s")
+    return rutas
+
+
+# --- MEDICIÓN ---
+
+def _rss_pico_mb(quien="propio"):
+    """Return the peak RSS in MB of this process or of its children, None if unknown."""
+    try:
+        import resource
+    except ImportError:
+        resource = None
+
+    if resource is not None:
+        objetivo = resource.RUSAGE_SELF if quien == "propio" else resource.RUSAGE_CHILDREN
+        pico = resource.getrusage(objetivo).ru_maxrss
+        # Linux lo da en KB y macOS en bytes
+        divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return round(pico / divisor, 1)
+
+    if quien != "propio":
+        return None
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+
+def ejecutar_caso(caso):
+    """Mide un caso (tamaño, formato y modo de extracción) en el proceso actual."""
+    sys.path.insert(0, CARPETA_APLICACION)
+    from logic.extraccion_pdf import extraer_nifs_pdf
+    from logic.file_handler import _leer_indice_empleados, unir_nifs_con_empleados
+    from logic.tareas import AlmacenTareas
+
+    config = configparser.ConfigParser()
+    config['PDF'] = {
+        'procesos_extraccion': str(caso["procesos"]),
+        'extraccion_nif': caso["modo"],
+    }
+    config['Cache'] = {'activada': 'false'}
+
+    tiempos = {}
+    inicio = time.perf_counter()
+    nifs_paginas = extraer_nifs_pdf(caso["pdf"], config)
+    tiempos["extraccion"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    indice, duplicados = _leer_indice_empleados(caso["empleados"], MAPA_COLUMNAS)
+    tiempos["lectura_empleados"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    tareas = unir_nifs_con_empleados(nifs_paginas, indice, duplicados)
+    tiempos["cruce"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    almacen = AlmacenTareas(tareas)
+    tiempos["almacen_tareas"] = time.perf_counter() - inicio
+
+    total = sum(tiempos.values())
+    paginas = len(nifs_paginas)
+    return {
+        "paginas": paginas,
+        "formato": caso["formato"],
+        "modo": caso["modo"],
+        "procesos": caso["procesos"],
+        "tiempos_s": {etapa: round(valor, 4) for etapa, valor in tiempos.items()},
+        "total_s": round(total, 4),
+        "paginas_por_segundo": {
+            "extraccion": round(paginas / tiempos["extraccion"], 1) if tiempos["extraccion"] else None,
+            "total": round(paginas / total, 1) if total else None,
+        },
+        "tareas_ok": almacen.contadores["ok"],
+        "rss_pico_mb": _rss_pico_mb("propio"),
+        "rss_pico_hijos_mb": _rss_pico_mb("hijos"),
+    }
+
+
+def medir_en_proceso(caso):
+    """Run a case in a separate Python process so its peak RSS is isolated."""
+    resultado = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--caso", json.dumps(caso)],
+        cwd=CARPETA_DATOS, capture_output=True, text=True)
+    if resultado.returncode != 0:
+        raise RuntimeError(resultado.stderr.strip() or "el caso terminó con error")
+    # La última línea es el JSON; lo anterior son mensajes del logger
+    return json.loads(resultado.stdout.strip().splitlines()[-1])
+
+
+def comparar(anteriores, actuales):
+    """Print the change of each case against a previous run."""
+    por_clave = {
+        (r["paginas"], r["formato"], r["modo"], r["procesos"]): r
+        for r in anteriores["resultados"]
+    }
+    print("\nComparación con la ejecución anterior:")
+    for r in actuales["resultados"]:
+        previo = por_clave.get((r["paginas"], r["formato"], r["modo"], r["procesos"]))
+        if previo is None:
+            continue
+        cambios = ", ".join(
+            f"{etapa} {r['tiempos_s'][etapa] / previo['tiempos_s'][etapa]:.2f}x"
+            for etapa in r["tiempos_s"]
+            if previo["tiempos_s"].get(etapa)
+        )
+        print(f"  {r['paginas']:>6} págs {r['formato']:<4} {r['modo']:<8} {cambios}")
+
+
+# --- SCRIPT PRINCIPAL ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del análisis de archivos")
+    parser.add_argument("--paginas", type=int, nargs="+", default=list(TAMANOS))
+    parser.add_argument("--formatos", nargs="+", choices=FORMATOS, default=list(FORMATOS))
+    parser.add_argument("--modos", nargs="+", default=["completo"],
+                        help="Modos de extracción: completo, region, rapido")
+    parser.add_argument("--procesos", type=int, default=0,
+                        help="Procesos de extracción (0 = uno por núcleo)")
+    parser.add_argument("--regenerar", action="store_true",
+                        help="Volver a generar los datos sintéticos")
+    parser.add_argument("--salida", help="Archivo JSON de resultados")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior")
+    parser.add_argument("--caso", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.caso:
+        print(json.dumps(ejecutar_caso(json.loads(args.caso))))
+        return
+
+    ejecucion = {
+        "fecha": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "procesadores": os.cpu_count(),
+        "pymupdf": fitz.VersionBind,
+        "resultados": [],
+    }
+    for paginas in args.paginas:
+        rutas = generar_datos(paginas, args.regenerar)
+        for formato in args.formatos:
+            for modo in args.modos:
+                caso = {
+                    "pdf": rutas["pdf"], "empleados": rutas[formato], "formato": formato,
+                    "modo": modo, "procesos": args.procesos,
+                }
+                r = medir_en_proceso(caso)
+                ejecucion["resultados"].append(r)
+                t = r["tiempos_s"]
+                print(
+                    f"{r['paginas']:>6} págs {formato:<4} {modo:<8} "
+                    f"extracción {t['extraccion']:.2f}s  lectura {t['lectura_empleados']:.2f}s  "
+                    f"cruce {t['cruce']:.2f}s  tareas {t['almacen_tareas']:.2f}s  "
+                    f"({r['paginas_por_segundo']['total']} págs/s, "
+                    f"RSS {r['rss_pico_mb']} MB)")
+
+    salida = args.salida or os.path.join(
+        CARPETA_RESULTADOS, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(ejecucion, f, indent=2)
+    print(f"\n✅ Resultados guardados en '{salida}'")
+
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            comparar(json.load(f), ejecucion)
+
+
+if __name__ == "__main__":
+    main()
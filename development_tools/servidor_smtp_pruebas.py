@@ -0,0 +1,555 @@
+"""
+Servidor SMTP local de pruebas con inyección de fallos.
+
+Sustituye al relé de correo real para probar el envío (RobustEmailSender y
+el motor asyncio) sin mandar ni un correo: acepta STARTTLS y AUTH (PLAIN y
+LOGIN), guarda cada mensaje recibido en disco (.eml) e inyecta fallos
+programados para ejercitar de forma reproducible los reintentos, las
+reconexiones y el control de ritmo:
+
+- desconexion_data: corta la conexión a mitad de DATA
+- limitacion: responde 421 (y cierra) o 451 al pasar de N mensajes/s
+- rechazo: 550 al destinatario (fallo permanente)
+- temporal: 451 al destinatario (fallo temporal)
+- lento: tarda N segundos en confirmar el mensaje
+- auth: 535 al autenticar
+
+Uso:
+
+    python servidor_smtp_pruebas.py
+    python servidor_smtp_pruebas.py --limitar-ritmo 20 --rechazar "^e13@" --cortar-data-cada 50
+    python servidor_smtp_pruebas.py --guion fallos.json --semilla 7 --no-guardar
+
+Un guion es una lista JSON de reglas; la primera que encaja se aplica:
+
+    [
+        {"tipo": "temporal", "destinatario": "@lento\\\\.es$", "primeros": 3},
+        {"tipo": "lento", "cada": 25, "retardo": 5},
+        {"tipo": "desconexion_data", "probabilidad": 0.01},
+        {"tipo": "limitacion", "max_por_segundo": 10, "codigo": 451},
+        {"tipo": "auth", "primeros": 2}
+    ]
+
+``cada`` aplica la regla a uno de cada N mensajes (o intentos de AUTH),
+``primeros`` solo las N primeras veces, ``probabilidad`` al azar (con
+``--semilla`` es reproducible) y ``destinatario`` filtra por una expresión
+regular sobre la dirección.
+
+La primera vez se genera un certificado autofirmado con openssl en
+``certificado_pruebas/``. Para que la aplicación confíe en él, arrancarla
+con la variable SSL_CERT_FILE apuntando a ese certificado y en settings.ini:
+
+    [SMTP]
+    servidor = localhost
+    puerto = 2525
+
+Al parar el servidor (Ctrl+C) se guarda un resumen JSON con los mensajes,
+el ritmo y los fallos inyectados en la carpeta de correos recibidos.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import re
+import signal
+import ssl
+import subprocess
+import sys
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+# --- CONFIGURACIÓN ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CARPETA_CERTIFICADO = os.path.join(SCRIPT_DIR, "certificado_pruebas")
+CARPETA_CORREOS = os.path.join(SCRIPT_DIR, "correos_recibidos")
+
+HOST = "127.0.0.1"
+PUERTO = 2525
+NOMBRE_SERVIDOR = "smtp-pruebas.local"
+
+# Fase del diálogo SMTP en la que se evalúa cada tipo de fallo
+FASES_FALLO = {
+    "auth": "AUTH",
+    "limitacion": "MAIL",
+    "rechazo": "RCPT",
+    "temporal": "RCPT",
+    "desconexion_data": "DATA",
+    "lento": "DATA",
+}
+
+
+# --- REGLAS DE FALLO ---
+
+class ReglaFallo:
+    """Un fallo programado del guion."""
+
+    def __init__(self, datos, aleatorio):
+        self.tipo = datos["tipo"]
+        if self.tipo not in FASES_FALLO:
+            raise ValueError(f"Tipo de fallo desconocido: {self.tipo}")
+        self.fase = FASES_FALLO[self.tipo]
+        destinatario = datos.get("destinatario")
+        self.destinatario = re.compile(destinatario, re.IGNORECASE) if destinatario else None
+        self.cada = int(datos.get("cada", 0))
+        self.primeros = int(datos.get("primeros", 0))
+        self.probabilidad = float(datos.get("probabilidad", 1.0))
+        self.retardo = float(datos.get("retardo", 5.0))
+        self.codigo = int(datos.get("codigo", 421 if self.tipo == "limitacion" else 0))
+        self.max_por_segundo = float(datos.get("max_por_segundo", 0))
+        self.aplicadas = 0
+        self._aleatorio = aleatorio
+
+    def aplica(self, numero, destinatarios=(), ritmo_actual=0):
+        """Decide si la regla se aplica al mensaje (o intento de AUTH) ``numero``."""
+        if self.primeros and self.aplicadas >= self.primeros:
+            return False
+        if self.destinatario and not any(self.destinatario.search(d) for d in destinatarios):
+            return False
+        if self.cada and numero % self.cada:
+            return False
+        if self.max_por_segundo and ritmo_actual < self.max_por_segundo:
+            return False
+        if self.probabilidad < 1.0 and self._aleatorio.random() >= self.probabilidad:
+            return False
+        self.aplicadas += 1
+        return True
+
+
+def reglas_desde_argumentos(args, aleatorio):
+    """Construye las reglas del guion y de las opciones de la línea de comandos."""
+    datos = []
+    if args.guion:
+        with open(args.guion, "r", encoding="utf-8") as f:
+            datos.extend(json.load(f))
+    if args.fallar_auth:
+        datos.append({"tipo": "auth", "primeros": args.fallar_auth})
+    if args.limitar_ritmo:
+        datos.append({"tipo": "limitacion", "max_por_segundo": args.limitar_ritmo,
+                      "codigo": args.codigo_limitacion})
+    for patron in args.rechazar:
+        datos.append({"tipo": "rechazo", "destinatario": patron})
+    for patron in args.temporal:
+        datos.append({"tipo": "temporal", "destinatario": patron})
+    if args.cortar_data_cada:
+        datos.append({"tipo": "desconexion_data", "cada": args.cortar_data_cada})
+    if args.lento_cada:
+        datos.append({"tipo": "lento", "cada": args.lento_cada, "retardo": args.lento})
+    return [ReglaFallo(regla, aleatorio) for regla in datos]
+
+
+# --- CERTIFICADO ---
+
+def asegurar_certificado(certificado=None, clave=None):
+    """Return (certificate, key) paths, creating a self-signed pair with openssl if needed."""
+    if certificado and clave:
+        return certificado, clave
+    certificado = os.path.join(CARPETA_CERTIFICADO, "cert.pem")
+    clave = os.path.join(CARPETA_CERTIFICADO, "key.pem")
+    if os.path.exists(certificado) and os.path.exists(clave):
+        return certificado, clave
+    os.makedirs(CARPETA_CERTIFICADO, exist_ok=True)
+    print("Generando certificado autofirmado para localhost...")
+    try:
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "3650",
+             "-keyout", clave, "-out", certificado, "-subj", "/CN=localhost",
+             "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1"],
+            check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"❌ Error: no se pudo generar el certificado con openssl ({e}).")
+        print("   Indique uno existente con --certificado y --clave.")
+        sys.exit(1)
+    return certificado, clave
+
+
+# --- SERVIDOR ---
+
+class ServidorPruebas:
+    """Servidor SMTP con fallos programados; una instancia para todas las sesiones."""
+
+    def __init__(self, reglas, contexto_tls, carpeta=None, usuario=None, password=None,
+                 retardo=0.0):
+        self.reglas = reglas
+        self.contexto_tls = contexto_tls
+        self.carpeta = carpeta
+        self.usuario = usuario
+        self.password = password
+        self.retardo = retardo
+
+        self.inicio = time.monotonic()
+        self.mensajes = 0
+        self.bytes = 0
+        self.transacciones = 0
+        self.intentos_auth = 0
+        self.sesiones = 0
+        self.sesiones_activas = 0
+        self.sesiones_max = 0
+        self.fallos = Counter()
+        self._ventana = deque()  # momentos de los últimos MAIL FROM aceptados
+
+    def _fallo(self, fase, numero, destinatarios=()):
+        """Return the first rule of a phase that applies, or None."""
+        ritmo_actual = self._ritmo_ultimo_segundo() if fase == "MAIL" else 0
+        for regla in self.reglas:
+            if regla.fase == fase and regla.aplica(numero, destinatarios, ritmo_actual):
+                self.fallos[regla.tipo] += 1
+                return regla
+        return None
+
+    def _ritmo_ultimo_segundo(self):
+        ahora = time.monotonic()
+        while self._ventana and ahora - self._ventana[0] > 1.0:
+            self._ventana.popleft()
+        return len(self._ventana)
+
+    def _guardar(self, numero, destinatarios, datos):
+        if not self.carpeta:
+            return
+        nombre = re.sub(r"[^\w.@-]", "_", destinatarios[0] if destinatarios else "sin_destinatario")
+        with open(os.path.join(self.carpeta, f"{numero:06d}_{nombre}.eml"), "wb") as f:
+            f.write(datos)
+
+    async def atender(self, reader, writer):
+        """Atiende una sesión SMTP completa."""
+        self.sesiones += 1
+        self.sesiones_activas += 1
+        self.sesiones_max = max(self.sesiones_max, self.sesiones_activas)
+        sesion = _Sesion(self, reader, writer)
+        try:
+            await sesion.dialogo()
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+            pass
+        finally:
+            self.sesiones_activas -= 1
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    def resumen(self):
+        """Return the figures of the run so far."""
+        duracion = time.monotonic() - self.inicio
+        return {
+            "duracion_s": round(duracion, 2),
+            "mensajes": self.mensajes,
+            "mensajes_por_segundo": round(self.mensajes / duracion, 2) if duracion else 0,
+            "megabytes": round(self.bytes / 1024 / 1024, 2),
+            "transacciones": self.transacciones,
+            "intentos_auth": self.intentos_auth,
+            "sesiones": self.sesiones,
+            "sesiones_max_simultaneas": self.sesiones_max,
+            "fallos_inyectados": dict(self.fallos),
+        }
+
+
+class _Sesion:
+    """Estado de una conexión SMTP."""
+
+    def __init__(self, servidor, reader, writer):
+        self.servidor = servidor
+        self.reader = reader
+        self.writer = writer
+        self.tls = False
+        self.autenticada = servidor.usuario is None
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self.remitente = None
+        self.destinatarios = []
+        self.numero = 0
+
+    async def responder(self, linea):
+        self.writer.write(linea.encode("utf-8") + b"\r\n")
+        await self.writer.drain()
+
+    async def leer_linea(self):
+        linea = await self.reader.readline()
+        if not linea:
+            raise ConnectionResetError("El cliente cerró la conexión")
+        return linea.decode("utf-8", errors="replace").rstrip("\r\n")
+
+    async def dialogo(self):
+        await self.responder(f"220 {NOMBRE_SERVIDOR} ESMTP servidor de pruebas")
+        while True:
+            linea = await self.leer_linea()
+            comando = linea.split(" ", 1)[0].upper()
+            argumento = linea[len(comando):].strip()
+            if comando in ("EHLO", "HELO"):
+                await self.ehlo(comando)
+            elif comando == "STARTTLS":
+                await self.starttls()
+            elif comando == "AUTH":
+                await self.auth(argumento)
+            elif comando == "MAIL":
+                if not await self.mail(argumento):
+                    return
+            elif comando == "RCPT":
+                await self.rcpt(argumento)
+            elif comando == "DATA":
+                if not await self.data():
+                    return
+            elif comando == "RSET":
+                self._reiniciar()
+                await self.responder("250 2.0.0 OK")
+            elif comando == "NOOP":
+                await self.responder("250 2.0.0 OK")
+            elif comando == "QUIT":
+                await self.responder("221 2.0.0 Adiós")
+                return
+            else:
+                await self.responder("502 5.5.2 Comando no reconocido")
+
+    async def ehlo(self, comando):
+        if comando == "HELO":
+            await self.responder(f"250 {NOMBRE_SERVIDOR}")
+            return
+        extensiones = ["SIZE 52428800", "8BITMIME"]
+        if not self.tls:
+            extensiones.append("STARTTLS")
+        else:
+            extensiones.append("AUTH PLAIN LOGIN")
+        lineas = [NOMBRE_SERVIDOR] + extensiones
+        for linea in lineas[:-1]:
+            self.writer.write(f"250-{linea}\r\n".encode("utf-8"))
+        await self.responder(f"250 {lineas[-1]}")
+
+    async def starttls(self):
+        if self.tls:
+            await self.responder("503 5.5.1 TLS ya activo")
+            return
+        await self.responder("220 2.0.0 Listo para TLS")
+        if hasattr(self.writer, "start_tls"):
+            # Python 3.11+
+            await self.writer.start_tls(self.servidor.contexto_tls)
+        else:
+            loop = asyncio.get_running_loop()
+            transporte = self.writer.transport
+            transporte_tls = await loop.start_tls(
+                transporte, transporte.get_protocol(), self.servidor.contexto_tls, server_side=True)
+            self.writer._transport = transporte_tls
+            self.reader._transport = transporte_tls
+        self.tls = True
+        self._reiniciar()
+
+    async def auth(self, argumento):
+        if not self.tls:
+            await self.responder("530 5.7.0 Se requiere STARTTLS")
+            return
+        partes = argumento.split()
+        mecanismo = partes[0].upper() if partes else ""
+        if mecanismo == "PLAIN":
+            credencial = partes[1] if len(partes) > 1 else None
+            if credencial is None:
+                await self.responder("334 ")
+                credencial = await self.leer_linea()
+            try:
+                _, usuario, password = base64.b64decode(credencial).decode("utf-8").split("\0")
+            except ValueError:
+                await self.responder("501 5.5.2 Credencial mal formada")
+                return
+        elif mecanismo == "LOGIN":
+            await self.responder("334 VXNlcm5hbWU6")
+            usuario = await self.leer_linea()
+            await self.responder("334 UGFzc3dvcmQ6")
+            password = await self.leer_linea()
+            try:
+                usuario = base64.b64decode(usuario).decode("utf-8")
+                password = base64.b64decode(password).decode("utf-8")
+            except ValueError:
+                await self.responder("501 5.5.2 Credencial mal formada")
+                return
+        else:
+            await self.responder("504 5.5.4 Mecanismo no soportado")
+            return
+
+        self.servidor.intentos_auth += 1
+        credenciales_validas = self.servidor.usuario is None or (
+            usuario == self.servidor.usuario and password == self.servidor.password)
+        if not credenciales_validas or self.servidor._fallo("AUTH", self.servidor.intentos_auth):
+            await self.responder("535 5.7.8 Usuario o contraseña incorrectos")
+            return
+        self.autenticada = True
+        await self.responder("235 2.7.0 Autenticado")
+
+    async def mail(self, argumento):
+        """MAIL FROM; returns False if the session must be closed."""
+        if not self.autenticada:
+            await self.responder("530 5.7.0 Se requiere autenticación")
+            return True
+        self.servidor.transacciones += 1
+        self._reiniciar()
+        self.numero = self.servidor.transacciones
+        regla = self.servidor._fallo("MAIL", self.numero)
+        if regla is not None:
+            if regla.codigo == 421:
+                await self.responder("421 4.7.0 Demasiados mensajes, reduzca el ritmo")
+                return False
+            await self.responder(f"{regla.codigo} 4.7.1 Ritmo de envío limitado, try again later")
+            return True
+        self.servidor._ventana.append(time.monotonic())
+        self.remitente = argumento
+        await self.responder("250 2.1.0 OK")
+        return True
+
+    async def rcpt(self, argumento):
+        if self.remitente is None:
+            await self.responder("503 5.5.1 Falta MAIL FROM")
+            return
+        direccion = argumento.split(":", 1)[-1].strip().strip("<>")
+        regla = self.servidor._fallo("RCPT", self.numero, (direccion,))
+        if regla is not None and regla.tipo == "rechazo":
+            await self.responder("550 5.1.1 El destinatario no existe")
+            return
+        if regla is not None:
+            await self.responder("451 4.3.0 Error temporal, inténtelo más tarde")
+            return
+        self.destinatarios.append(direccion)
+        await self.responder("250 2.1.5 OK")
+
+    async def data(self):
+        """DATA; returns False if the session must be closed."""
+        if not self.destinatarios:
+            await self.responder("503 5.5.1 Falta RCPT TO")
+            return True
+        regla = self.servidor._fallo("DATA", self.numero, self.destinatarios)
+        await self.responder("354 Termine con <CRLF>.<CRLF>")
+
+        lineas = []
+        while True:
+            linea = await self.reader.readline()
+            if not linea:
+                raise ConnectionResetError("El cliente cerró la conexión")
+            if linea in (b".\r\n", b".\n"):
+                break
+            # Las líneas con punto inicial llegan duplicadas (RFC 5321, 4.5.2)
+            lineas.append(linea[1:] if linea.startswith(b"..") else linea)
+            if regla is not None and regla.tipo == "desconexion_data" and len(lineas) == 10:
+                # Corte brusco a mitad del mensaje, sin respuesta
+                self.writer.transport.abort()
+                return False
+
+        if regla is not None and regla.tipo == "lento":
+            await asyncio.sleep(regla.retardo)
+        elif self.servidor.retardo:
+            await asyncio.sleep(self.servidor.retardo)
+
+        datos = b"".join(lineas)
+        self.servidor.mensajes += 1
+        self.servidor.bytes += len(datos)
+        self.servidor._guardar(self.numero, self.destinatarios, datos)
+        await self.responder(f"250 2.0.0 OK mensaje {self.numero} en cola")
+        self._reiniciar()
+        return True
+
+
+# --- PROGRAMA PRINCIPAL ---
+
+async def informar(servidor, intervalo):
+    """Muestra cada ``intervalo`` segundos lo recibido hasta el momento."""
+    anteriores = 0
+    while True:
+        await asyncio.sleep(intervalo)
+        ritmo = (servidor.mensajes - anteriores) / intervalo
+        anteriores = servidor.mensajes
+        fallos = ", ".join(f"{tipo} {n}" for tipo, n in sorted(servidor.fallos.items())) or "ninguno"
+        print(f"{servidor.mensajes:>7} mensajes ({ritmo:.1f}/s)  "
+              f"{servidor.sesiones_activas} sesiones activas  fallos: {fallos}", flush=True)
+
+
+async def ejecutar(args):
+    aleatorio = random.Random(args.semilla)
+    try:
+        reglas = reglas_desde_argumentos(args, aleatorio)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"❌ Error: guion de fallos no válido ({e})")
+        sys.exit(1)
+    certificado, clave = asegurar_certificado(args.certificado, args.clave)
+    contexto_tls = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    contexto_tls.load_cert_chain(certificado, clave)
+
+    servidor = ServidorPruebas(reglas, contexto_tls, None, args.usuario, args.password,
+                               args.retardo)
+    try:
+        servidor_asyncio = await asyncio.start_server(servidor.atender, args.host, args.puerto)
+    except OSError as e:
+        print(f"❌ Error: no se pudo escuchar en {args.host}:{args.puerto}. ¿Está el puerto ocupado? ({e})")
+        sys.exit(1)
+    carpeta = None
+    if not args.no_guardar:
+        carpeta = os.path.join(args.carpeta, datetime.now().strftime('%Y%m%d_%H%M%S'))
+        os.makedirs(carpeta, exist_ok=True)
+        servidor.carpeta = carpeta
+
+    try:
+        # Parar con SIGTERM también guarda el resumen (no disponible en Windows)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except (NotImplementedError, AttributeError):
+        pass
+    print(f"✅ Servidor SMTP de pruebas en {args.host}:{args.puerto} (STARTTLS: {certificado})")
+    for regla in reglas:
+        print(f"   Fallo programado: {regla.tipo}")
+    if carpeta:
+        print(f"   Correos recibidos: {carpeta}")
+    print("   Ctrl+C para parar")
+
+    tarea_informe = asyncio.create_task(informar(servidor, args.informe))
+    try:
+        async with servidor_asyncio:
+            await servidor_asyncio.serve_forever()
+    finally:
+        tarea_informe.cancel()
+        resumen = servidor.resumen()
+        print("\nRESUMEN:")
+        print(json.dumps(resumen, indent=2, ensure_ascii=False))
+        if carpeta:
+            with open(os.path.join(carpeta, "resumen.json"), "w", encoding="utf-8") as f:
+                json.dump(resumen, f, indent=2, ensure_ascii=False)
+            print(f"✅ Resumen guardado en '{os.path.join(carpeta, 'resumen.json')}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor SMTP local de pruebas con inyección de fallos")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--puerto", type=int, default=PUERTO)
+    parser.add_argument("--certificado", help="Certificado PEM (por defecto se genera uno)")
+    parser.add_argument("--clave", help="Clave privada PEM del certificado")
+    parser.add_argument("--usuario", help="Usuario aceptado (por defecto cualquiera)")
+    parser.add_argument("--password", help="Contraseña aceptada con --usuario")
+    parser.add_argument("--carpeta", default=CARPETA_CORREOS,
+                        help="Carpeta donde guardar los correos recibidos")
+    parser.add_argument("--no-guardar", action="store_true",
+                        help="No guardar los correos (para medir solo el envío)")
+    parser.add_argument("--retardo", type=float, default=0.0,
+                        help="Segundos que tarda en confirmar cada mensaje")
+    parser.add_argument("--guion", help="Archivo JSON con las reglas de fallo")
+    parser.add_argument("--semilla", type=int, default=2025,
+                        help="Semilla de los fallos con probabilidad")
+    parser.add_argument("--fallar-auth", type=int, default=0, metavar="N",
+                        help="Rechazar (535) los N primeros intentos de AUTH")
+    parser.add_argument("--limitar-ritmo", type=float, default=0, metavar="N",
+                        help="Limitar al pasar de N mensajes por segundo")
+    parser.add_argument("--codigo-limitacion", type=int, choices=(421, 451), default=421)
+    parser.add_argument("--rechazar", action="append", default=[], metavar="REGEX",
+                        help="Rechazar con 550 los destinatarios que encajen")
+    parser.add_argument("--temporal", action="append", default=[], metavar="REGEX",
+                        help="Responder 451 a los destinatarios que encajen")
+    parser.add_argument("--cortar-data-cada", type=int, default=0, metavar="N",
+                        help="Cortar la conexión a mitad de DATA en uno de cada N mensajes")
+    parser.add_argument("--lento-cada", type=int, default=0, metavar="N",
+                        help="Tardar --lento segundos en uno de cada N mensajes")
+    parser.add_argument("--lento", type=float, default=5.0, help="Segundos de las respuestas lentas")
+    parser.add_argument("--informe", type=float, default=5.0,
+                        help="Segundos entre informes de progreso")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(ejecutar(args))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Caché persistente del análisis de archivos (Paso 1 -> Paso 2).
+
+Guarda en una base SQLite, junto a settings.ini, los NIFs extraídos de cada
+página del PDF maestro y las tareas resultantes del cruce con el archivo de
+empleados. Las entradas se identifican por el hash del contenido de los
+archivos, de modo que un mismo PDF o Excel renombrado sigue aprovechando la
+caché y cualquier cambio en su contenido la invalida.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+
+from utils.logger import log_info, log_warning
+
+
+# Se guarda junto a settings.ini, en el directorio de trabajo de la aplicación
+ARCHIVO_CACHE = 'cache_analisis.db'
+
+TAMANO_BLOQUE_HASH = 1024 * 1024
+
+
+def hash_archivo(ruta):
+    """Compute the SHA-256 hash of a file's content.
+
+    Args:
+        ruta (str): Path to the file
+
+    Returns:
+        str: Hexadecimal hash
+    """
+    sha = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE_HASH), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+class CacheAnalisis:
+    """Caché SQLite de extracciones de NIFs y tareas analizadas.
+
+    Cada operación abre su propia conexión para poder usarse desde el hilo
+    de la interfaz o desde hilos de trabajo. Cualquier error de la base de
+    datos se registra y se trata como un fallo de caché, nunca interrumpe
+    el análisis.
+    """
+
+    def __init__(self, config=None):
+        self.activada = True
+        self.tamano_maximo = 50 * 1024 * 1024
+        self.antiguedad_maxima = 90 * 24 * 3600
+        if config is None:
+            return
+
+        # Un valor mal escrito deja el valor por defecto en vez de parar el análisis
+        activada = config.get('Cache', 'activada', fallback='si').strip().lower()
+        self.activada = activada in ('si', 'sí', 'true', '1', 'yes', 'on')
+
+        def leer(opcion, defecto):
+            try:
+                return max(0.0, float(config.get('Cache', opcion, fallback='') or defecto))
+            except ValueError:
+                return defecto
+
+        self.tamano_maximo = int(leer('tamano_maximo_mb', 50) * 1024 * 1024)
+        self.antiguedad_maxima = int(leer('dias_maximos', 90) * 24 * 3600)
+
+    def _conectar(self):
+        conexion = sqlite3.connect(ARCHIVO_CACHE, timeout=5)
+        # auto_vacuum debe fijarse antes de crear las tablas
+        conexion.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conexion.execute(
+            "CREATE TABLE IF NOT EXISTS extracciones ("
+            " pdf_hash TEXT, modo TEXT, datos TEXT, tamano INTEGER, ultimo_uso REAL,"
+            " PRIMARY KEY (pdf_hash, modo))")
+        conexion.execute(
+            "CREATE TABLE IF NOT EXISTS analisis ("
+            " clave TEXT PRIMARY KEY, datos TEXT, tamano INTEGER, ultimo_uso REAL)")
+        return conexion
+
+    @staticmethod
+    def clave_analisis(pdf_hash, empleados_hash, columnas_map, modo):
+        """Build the key of an analysis from its inputs.
+
+        Args:
+            pdf_hash (str): Hash of the master PDF
+            empleados_hash (str): Hash of the employee file
+            columnas_map (dict): Mapping of required fields to column names
+            modo (str): NIF extraction mode
+
+        Returns:
+            str: Key identifying the analysis
+        """
+        contenido = json.dumps(
+            [pdf_hash, empleados_hash, sorted(columnas_map.items()), modo])
+        return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+    def _leer(self, consulta, parametros, actualizar):
+        if not self.activada:
+            return None
+        try:
+            conexion = self._conectar()
+            try:
+                with conexion:
+                    fila = conexion.execute(consulta, parametros).fetchone()
+                    if fila is None:
+                        return None
+                    conexion.execute(actualizar, (time.time(),) + parametros)
+                return json.loads(fila[0])
+            finally:
+                conexion.close()
+        except (sqlite3.Error, ValueError) as e:
+            log_warning(f"[ADVERTENCIA] No se pudo leer la caché de análisis: {e}")
+            return None
+
+    def _escribir(self, consulta, parametros, datos):
+        if not self.activada:
+            return
+        texto = json.dumps(datos, default=str)
+        try:
+            conexion = self._conectar()
+            try:
+                with conexion:
+                    conexion.execute(
+                        consulta, parametros + (texto, len(texto), time.time()))
+                self._purgar(conexion)
+            finally:
+                conexion.close()
+        except sqlite3.Error as e:
+            log_warning(f"[ADVERTENCIA] No se pudo escribir la caché de análisis: {e}")
+
+    def obtener_nifs(self, pdf_hash, modo):
+        """Return the cached per-page NIFs of a PDF, or None."""
+        return self._leer(
+            "SELECT datos FROM extracciones WHERE pdf_hash = ? AND modo = ?",
+            (pdf_hash, modo),
+            "UPDATE extracciones SET ultimo_uso = ? WHERE pdf_hash = ? AND modo = ?")
+
+    def guardar_nifs(self, pdf_hash, modo, nifs_paginas):
+        """Store the per-page NIFs extracted from a PDF."""
+        self._escribir(
+            "INSERT OR REPLACE INTO extracciones"
+            " (pdf_hash, modo, datos, tamano, ultimo_uso) VALUES (?, ?, ?, ?, ?)",
+            (pdf_hash, modo), nifs_paginas)
+
+    def obtener_tareas(self, clave):
+        """Return the cached tasks of an analysis, or None."""
+        return self._leer(
+            "SELECT datos FROM analisis WHERE clave = ?",
+            (clave,),
+            "UPDATE analisis SET ultimo_uso = ? WHERE clave = ?")
+
+    def guardar_tareas(self, clave, tareas):
+        """Store the tasks resulting from an analysis."""
+        self._escribir(
+            "INSERT OR REPLACE INTO analisis"
+            " (clave, datos, tamano, ultimo_uso) VALUES (?, ?, ?, ?)",
+            (clave,), tareas)
+
+    def _purgar(self, conexion):
+        """Evict entries older than the age limit, then the least recently
+        used ones until the cache fits within the size limit."""
+        limite_uso = time.time() - self.antiguedad_maxima
+        eliminadas = 0
+        with conexion:
+            for tabla in ('extracciones', 'analisis'):
+                eliminadas += conexion.execute(
+                    f"DELETE FROM {tabla} WHERE ultimo_uso < ?", (limite_uso,)).rowcount
+
+            tamano_total = sum(
+                conexion.execute(f"SELECT COALESCE(SUM(tamano), 0) FROM {tabla}").fetchone()[0]
+                for tabla in ('extracciones', 'analisis'))
+            if tamano_total > self.tamano_maximo:
+                entradas = conexion.execute(
+                    "SELECT 'extracciones', rowid, tamano, ultimo_uso FROM extracciones"
+                    " UNION ALL SELECT 'analisis', rowid, tamano, ultimo_uso FROM analisis"
+                    " ORDER BY ultimo_uso").fetchall()
+                for tabla, rowid, tamano, _ in entradas:
+                    if tamano_total <= self.tamano_maximo:
+                        break
+                    conexion.execute(f"DELETE FROM {tabla} WHERE rowid = ?", (rowid,))
+                    tamano_total -= tamano
+                    eliminadas += 1
+
+        if eliminadas:
+            conexion.execute("PRAGMA incremental_vacuum")
+            log_info(f"Caché de análisis: {eliminadas} entradas antiguas eliminadas")
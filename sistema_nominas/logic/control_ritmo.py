@@ -0,0 +1,274 @@
+"""
+Control adaptativo del ritmo de envío (AIMD).
+
+Mientras el servidor responde sin problemas, el ritmo de envío sube poco a
+poco (aumento aditivo) y se abre una conexión más cada vez; cuando responde
+con un código de limitación (421, 451 a MAIL o DATA, o un 4xx que habla de
+límites) o una respuesta tarda mucho más de lo normal, el ritmo y las conexiones se
+reducen a la mitad (disminución multiplicativa). Es el mismo esquema que el
+control de congestión de TCP.
+
+El ritmo nunca supera los límites del proveedor (ver limite_envios): el
+controlador busca el ritmo que el servidor acepta dentro de ese techo.
+"""
+import threading
+import time
+from datetime import datetime
+
+
+# Códigos con los que los servidores piden que se envíe más despacio. Un 451
+# a un destinatario (RCPT) suele ser de ese buzón (greylisting, buzón
+# ocupado): solo va a la cola de reintentos, no reduce el ritmo
+CODIGOS_LIMITACION = (421, 451)
+
+# Textos de respuestas 4xx que indican limitación aunque el código sea otro
+TEXTOS_LIMITACION = ('4.7.', 'rate', 'too many', 'throttl', 'try again later', 'limit')
+
+# Parámetros del AIMD
+ENVIOS_POR_AUMENTO = 10  # respuestas limpias seguidas para subir un escalón
+INCREMENTO_RITMO = 1.0  # correos/s que se suman en cada escalón
+FACTOR_REDUCCION = 0.5  # ritmo y conexiones se multiplican por esto al limitar
+RITMO_MINIMO = 0.2  # correos/s
+RITMO_INICIAL = 5.0  # correos/s, si no hay delay_segundos del que partir
+ENFRIAMIENTO = 2.0  # segundos tras una reducción en los que no se reduce otra vez
+
+# Un pico de latencia es una respuesta que tarda FACTOR_PICO_LATENCIA veces
+# la media (y al menos LATENCIA_PICO_MINIMA segundos), tras MUESTRAS_MINIMAS
+FACTOR_PICO_LATENCIA = 3.0
+LATENCIA_PICO_MINIMA = 0.5
+MUESTRAS_MINIMAS = 5
+PESO_MEDIA_LATENCIA = 0.2
+
+
+def respuesta_smtp(error):
+    """Return the (code, text) SMTP reply carried by an exception.
+
+    Works with the smtplib exceptions and with the ones of envio_asincrono.
+
+    Returns:
+        tuple: (code or None, text)
+    """
+    codigo = getattr(error, 'smtp_code', None) or getattr(error, 'codigo', None)
+    mensaje = getattr(error, 'smtp_error', None) or getattr(error, 'mensaje', None)
+    destinatarios = getattr(error, 'recipients', None)
+    if codigo is None and destinatarios:
+        codigo, mensaje = next(iter(destinatarios.values()))
+    if isinstance(mensaje, bytes):
+        mensaje = mensaje.decode('utf-8', errors='replace')
+    return codigo, mensaje if mensaje is not None else str(error)
+
+
+def es_respuesta_destinatario(error):
+    """Check whether an exception carries a reply to RCPT (one recipient)."""
+    return bool(getattr(error, 'recipients', None)) or getattr(error, 'comando', '') == 'RCPT'
+
+
+def es_limitacion(codigo, mensaje='', destinatario=False):
+    """Check whether an SMTP reply asks the client to slow down.
+
+    Args:
+        codigo (int): Reply code
+        mensaje (str): Reply text
+        destinatario (bool): Whether it is the reply to RCPT; there only
+            421 and replies that talk about limits (4.7.x...) count
+    """
+    if codigo == 421 or (codigo in CODIGOS_LIMITACION and not destinatario):
+        return True
+    if codigo is None or not 400 <= codigo < 500:
+        return False
+    mensaje = (mensaje or '').lower()
+    return any(texto in mensaje for texto in TEXTOS_LIMITACION)
+
+
+def obtener_control_ritmo(config, limites):
+    """Read the adaptive rate options from the ``[SMTP]`` section.
+
+    Args:
+        config (ConfigParser): Application configuration
+        limites (dict): Result of obtener_limites(); its per-second limit is
+            the default ceiling
+
+    Without ``ritmo_maximo`` nor a per-second limit the ceiling is the
+    rate of the fixed pause between emails (``delay_segundos``), so the
+    controller never sends faster than the app did without it.
+
+    Returns:
+        dict: 'adaptativo' (bool), 'ritmo_inicial' and 'ritmo_maximo'
+            (emails per second, 0 = no ceiling)
+    """
+    adaptativo = config.get('SMTP', 'ritmo_adaptativo', fallback='si').strip().lower()
+
+    def leer(opcion, defecto):
+        try:
+            return max(0.0, float(config.get('SMTP', opcion, fallback='') or defecto))
+        except ValueError:
+            return defecto
+
+    delay = leer('delay_segundos', 1.0)
+    ritmo_maximo = leer('ritmo_maximo', limites['por_segundo'])
+    if limites['por_segundo']:
+        ritmo_maximo = min(ritmo_maximo or limites['por_segundo'], limites['por_segundo'])
+    elif not ritmo_maximo and delay > 0:
+        ritmo_maximo = 1.0 / delay
+    # Por defecto se parte del ritmo de la pausa fija entre emails
+    ritmo_inicial = leer('ritmo_inicial', 1.0 / delay if delay > 0 else RITMO_INICIAL)
+    ritmo_inicial = max(RITMO_MINIMO, ritmo_inicial)
+    if ritmo_maximo:
+        ritmo_inicial = min(ritmo_inicial, ritmo_maximo)
+    return {
+        'adaptativo': adaptativo in ('si', 'sí', 'true', '1', 'yes'),
+        'ritmo_inicial': ritmo_inicial,
+        'ritmo_maximo': ritmo_maximo,
+    }
+
+
+class ControladorRitmo:
+    """Ritmo de envío y número de conexiones activas, ajustados con AIMD.
+
+    Es seguro entre hilos. reservar() reparte los envíos al ritmo actual
+    (devuelve los segundos que hay que esperar, como LimitadorEnvios) y
+    ``conexiones`` es cuántas conexiones pueden enviar a la vez. Cada
+    respuesta del servidor se anota con exito() o limitado(); si el ritmo o
+    las conexiones cambian se llama a ``al_cambiar`` con estado().
+
+    Desactivado (``adaptativo`` = False) no limita nada, pero sigue
+    contando limitaciones y latencias para el reporte.
+    """
+
+    def __init__(self, opciones, conexiones_max, al_cambiar=None):
+        self.activo = opciones['adaptativo']
+        self.ritmo_maximo = opciones['ritmo_maximo']
+        self.ritmo_inicial = self.ritmo = opciones['ritmo_inicial']
+        self.conexiones_max = max(1, conexiones_max)
+        # Se empieza con una conexión y se abren más mientras todo va bien
+        self.conexiones = 1 if self.activo else self.conexiones_max
+        self.al_cambiar = al_cambiar
+
+        self.limitaciones = 0
+        self.picos_latencia = 0
+        self.latencia_media = None
+        self.ritmo_maximo_alcanzado = self.ritmo
+        self.ritmo_minimo_alcanzado = self.ritmo
+        self.ajustes = []
+
+        self._bloqueo = threading.Lock()
+        self._siguiente_envio = 0.0
+        self._limpias = 0
+        self._muestras = 0
+        self._ultima_reduccion = float('-inf')
+
+    def ajustar_maximo(self, conexiones_max):
+        """Set how many connections could actually be opened."""
+        with self._bloqueo:
+            self.conexiones_max = max(1, conexiones_max)
+            if not self.activo or self.conexiones > self.conexiones_max:
+                self.conexiones = self.conexiones_max
+        self._notificar()
+
+    def estado(self):
+        """Return the current rate and connections as a dict."""
+        return {
+            'adaptativo': self.activo,
+            'ritmo': self.ritmo,
+            'conexiones': self.conexiones,
+            'conexiones_max': self.conexiones_max,
+        }
+
+    def reservar(self):
+        """Reserve a send slot at the current rate; returns the seconds to wait."""
+        if not self.activo:
+            return 0.0
+        with self._bloqueo:
+            ahora = time.monotonic()
+            turno = max(ahora, self._siguiente_envio)
+            self._siguiente_envio = turno + 1.0 / self.ritmo
+        return turno - ahora
+
+    def exito(self, latencia):
+        """Record a clean reply and how long the send took (seconds)."""
+        with self._bloqueo:
+            self._muestras += 1
+            pico = (
+                self.latencia_media is not None and self._muestras > MUESTRAS_MINIMAS
+                and latencia > max(LATENCIA_PICO_MINIMA, FACTOR_PICO_LATENCIA * self.latencia_media)
+            )
+            if self.latencia_media is None:
+                self.latencia_media = latencia
+            else:
+                self.latencia_media += PESO_MEDIA_LATENCIA * (latencia - self.latencia_media)
+            if pico:
+                self.picos_latencia += 1
+                cambio = self._reducir('latencia', f"{latencia:.2f}s (media {self.latencia_media:.2f}s)")
+            else:
+                cambio = self._aumentar()
+        if cambio:
+            self._notificar()
+
+    def limitado(self, codigo, mensaje=''):
+        """Record a throttling reply from the server."""
+        with self._bloqueo:
+            self.limitaciones += 1
+            cambio = self._reducir('limitacion', f"{codigo} {mensaje}".strip()[:100])
+        if cambio:
+            self._notificar()
+
+    def _aumentar(self):
+        if not self.activo:
+            return False
+        self._limpias += 1
+        if self._limpias < ENVIOS_POR_AUMENTO:
+            return False
+        self._limpias = 0
+        ritmo = self.ritmo + INCREMENTO_RITMO
+        if self.ritmo_maximo:
+            ritmo = min(ritmo, self.ritmo_maximo)
+        conexiones = min(self.conexiones + 1, self.conexiones_max)
+        if ritmo == self.ritmo and conexiones == self.conexiones:
+            return False
+        self._cambiar(ritmo, conexiones, 'aumento')
+        return True
+
+    def _reducir(self, motivo, detalle):
+        self._limpias = 0
+        ahora = time.monotonic()
+        # Las respuestas de los envíos que ya estaban en curso no reducen otra vez
+        if not self.activo or ahora - self._ultima_reduccion < ENFRIAMIENTO:
+            return False
+        self._ultima_reduccion = ahora
+        ritmo = max(RITMO_MINIMO, self.ritmo * FACTOR_REDUCCION)
+        conexiones = max(1, int(self.conexiones * FACTOR_REDUCCION))
+        self._cambiar(ritmo, conexiones, motivo, detalle)
+        return True
+
+    def _cambiar(self, ritmo, conexiones, motivo, detalle=''):
+        self.ritmo = ritmo
+        self.conexiones = conexiones
+        self.ritmo_maximo_alcanzado = max(self.ritmo_maximo_alcanzado, ritmo)
+        self.ritmo_minimo_alcanzado = min(self.ritmo_minimo_alcanzado, ritmo)
+        self.ajustes.append({
+            'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'motivo': motivo,
+            'ritmo': round(ritmo, 2),
+            'conexiones': conexiones,
+            'detalle': detalle,
+        })
+
+    def _notificar(self):
+        if self.al_cambiar:
+            self.al_cambiar(self.estado())
+
+    def resumen(self):
+        """Return the figures of the run for the report."""
+        return {
+            'adaptativo': self.activo,
+            'ritmo_inicial': round(self.ritmo_inicial, 2),
+            'ritmo_final': round(self.ritmo, 2),
+            'ritmo_maximo_alcanzado': round(self.ritmo_maximo_alcanzado, 2),
+            'ritmo_minimo_alcanzado': round(self.ritmo_minimo_alcanzado, 2),
+            'conexiones_finales': self.conexiones,
+            'conexiones_max': self.conexiones_max,
+            'limitaciones': self.limitaciones,
+            'picos_latencia': self.picos_latencia,
+            'latencia_media': round(self.latencia_media, 3) if self.latencia_media is not None else None,
+            'ajustes': list(self.ajustes),
+        }
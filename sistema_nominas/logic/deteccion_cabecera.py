@@ -0,0 +1,232 @@
+"""
+Detección rápida del formato de los archivos de empleados.
+
+Lee solo las primeras filas del archivo para localizar la fila de cabecera
+(que no siempre es la primera: muchas exportaciones de RRHH empiezan con un
+título o la fecha) y, en los CSV, la codificación y el separador. Así el
+mapeo de columnas del Paso 1 aparece al instante aunque el Excel sea grande.
+"""
+import csv
+
+
+# Filas examinadas para localizar la cabecera
+FILAS_BUSQUEDA_CABECERA = 20
+
+# Bytes leídos del CSV para detectar codificación y separador
+BYTES_MUESTRA_CSV = 64 * 1024
+
+SEPARADORES_CSV = ",;\t|"
+
+# cp1252 es la codificación habitual de los CSV exportados por Excel en Windows
+CODIFICACIONES_CSV = ("utf-8-sig", "cp1252", "latin-1")
+
+
+def _decodificar_muestra(muestra):
+    """Decode a CSV sample, returning (text, encoding)."""
+    for codificacion in CODIFICACIONES_CSV:
+        try:
+            return muestra.decode(codificacion), codificacion
+        except UnicodeDecodeError as e:
+            # La muestra puede cortar un carácter multibyte al final
+            if codificacion.startswith("utf-8") and e.start >= len(muestra) - 3:
+                return muestra[:e.start].decode(codificacion), codificacion
+    return muestra.decode("latin-1"), "latin-1"
+
+
+def _detectar_separador(lineas):
+    """Pick the delimiter that splits most lines into the same number of fields.
+
+    Title lines above the header have no delimiter at all, which confuses
+    csv.Sniffer, so lines with a single field are ignored.
+    """
+    mejor = ","
+    mejor_puntuacion = (0, 0)
+    for separador in SEPARADORES_CSV:
+        recuentos = [
+            len(fila) for fila in csv.reader(lineas, delimiter=separador) if len(fila) > 1]
+        if not recuentos:
+            continue
+        campos = max(set(recuentos), key=recuentos.count)
+        puntuacion = (recuentos.count(campos), campos)
+        if puntuacion > mejor_puntuacion:
+            mejor, mejor_puntuacion = separador, puntuacion
+    return mejor
+
+
+def detectar_formato_csv(filepath):
+    """Detect the encoding and the delimiter of a CSV file.
+
+    Only the first BYTES_MUESTRA_CSV bytes are read.
+
+    Args:
+        filepath (str): Path to the CSV file
+
+    Returns:
+        tuple: (encoding, delimiter)
+    """
+    with open(filepath, 'rb') as f:
+        muestra = f.read(BYTES_MUESTRA_CSV)
+    texto, codificacion = _decodificar_muestra(muestra)
+
+    # La última línea de la muestra puede estar cortada
+    lineas = texto.splitlines()[:FILAS_BUSQUEDA_CABECERA]
+    return codificacion, _detectar_separador(lineas)
+
+
+def _es_texto(valor):
+    """Check whether a cell value looks like a column name."""
+    if isinstance(valor, str):
+        try:
+            float(valor.replace(",", "."))
+            return False
+        except ValueError:
+            return True
+    return False
+
+
+def _celdas_con_valor(fila):
+    return [valor for valor in fila if valor is not None and str(valor).strip() != ""]
+
+
+def indice_fila_cabecera(filas):
+    """Find which of the first rows of a sheet is the header row.
+
+    The header is the first row that fills (almost) as many cells as the
+    widest row and whose cells are all text. Title rows above it usually
+    fill a single cell; data rows below it contain numbers.
+
+    Args:
+        filas (list): First rows of the sheet, each a list of cell values
+
+    Returns:
+        int: 0-based index of the header row (0 if none looks like one)
+    """
+    ancho = max((len(_celdas_con_valor(fila)) for fila in filas), default=0)
+    minimo = max(2, int(ancho * 0.8))
+    for indice, fila in enumerate(filas):
+        celdas = _celdas_con_valor(fila)
+        if len(celdas) >= minimo and all(_es_texto(valor) for valor in celdas):
+            return indice
+    return 0
+
+
+def _nombre_columna(valor):
+    return str(valor) if valor is not None else ""
+
+
+def detectar_cabecera(filepath):
+    """Locate the header row and the format of an employee file.
+
+    Args:
+        filepath (str): Path to the CSV or Excel file
+
+    Returns:
+        dict: 'fila_cabecera' (0-based row index), 'cabeceras' (column
+            names) and, for CSV files, 'codificacion' and 'separador'
+
+    Raises:
+        ValueError: If file format is not supported
+    """
+    if filepath.endswith('.csv'):
+        codificacion, separador = detectar_formato_csv(filepath)
+        with open(filepath, 'r', encoding=codificacion, errors='replace', newline='') as f:
+            lector = csv.reader(f, delimiter=separador)
+            filas = [fila for _, fila in zip(range(FILAS_BUSQUEDA_CABECERA), lector)]
+        fila_cabecera = indice_fila_cabecera(filas)
+        return {
+            "fila_cabecera": fila_cabecera,
+            "cabeceras": [_nombre_columna(v) for v in filas[fila_cabecera]] if filas else [],
+            "codificacion": codificacion,
+            "separador": separador,
+        }
+
+    if filepath.endswith('.xlsx'):
+        from openpyxl import load_workbook
+
+        libro = load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            filas = [
+                list(fila) for _, fila in zip(
+                    range(FILAS_BUSQUEDA_CABECERA),
+                    libro.worksheets[0].iter_rows(values_only=True))
+            ]
+        finally:
+            libro.close()
+    elif filepath.endswith('.xls'):
+        import pandas as pd
+
+        muestra = pd.read_excel(filepath, header=None, nrows=FILAS_BUSQUEDA_CABECERA)
+        filas = [
+            [None if pd.isna(valor) else valor for valor in fila]
+            for fila in muestra.itertuples(index=False)
+        ]
+    else:
+        raise ValueError("Formato de archivo no soportado.")
+
+    fila_cabecera = indice_fila_cabecera(filas)
+    cabeceras = [_nombre_columna(v) for v in filas[fila_cabecera]] if filas else []
+    # Las celdas vacías al final de la cabecera no son columnas
+    while cabeceras and cabeceras[-1] == "":
+        cabeceras.pop()
+    return {"fila_cabecera": fila_cabecera, "cabeceras": cabeceras}
+
+
+def leer_muestra(filepath, filas_iniciales=3, formato=None):
+    """Stream an employee file to get a preview and the number of rows.
+
+    Only the first rows and the last one are kept in memory.
+
+    Args:
+        filepath (str): Path to the CSV or Excel file
+        filas_iniciales (int): Number of first data rows to keep
+        formato (dict): Result of detectar_cabecera(), if already known
+
+    Returns:
+        dict: 'cabeceras', 'primeras' (first data rows), 'ultima' (last
+            data row or None) and 'total' (number of non-empty data rows)
+    """
+    if formato is None:
+        formato = detectar_cabecera(filepath)
+    cabeceras = formato["cabeceras"]
+    ancho = len(cabeceras)
+
+    if filepath.endswith('.csv'):
+        f = open(filepath, 'r', encoding=formato["codificacion"], errors='replace', newline='')
+        filas = csv.reader(f, delimiter=formato["separador"])
+        cerrar = f.close
+    elif filepath.endswith('.xlsx'):
+        from openpyxl import load_workbook
+
+        libro = load_workbook(filepath, read_only=True, data_only=True)
+        filas = libro.worksheets[0].iter_rows(values_only=True)
+        cerrar = libro.close
+    else:
+        import pandas as pd
+
+        df = pd.read_excel(filepath, header=None)
+        filas = (
+            [None if pd.isna(valor) else valor for valor in fila]
+            for fila in df.itertuples(index=False)
+        )
+        cerrar = None
+
+    primeras = []
+    ultima = None
+    total = 0
+    try:
+        for indice, fila in enumerate(filas):
+            if indice <= formato["fila_cabecera"]:
+                continue
+            valores = ["" if valor is None else valor for valor in list(fila)[:ancho]]
+            if not _celdas_con_valor(valores):
+                continue
+            valores += [""] * (ancho - len(valores))
+            total += 1
+            if len(primeras) < filas_iniciales:
+                primeras.append(valores)
+            ultima = valores
+    finally:
+        if cerrar:
+            cerrar()
+
+    return {"cabeceras": cabeceras, "primeras": primeras, "ultima": ultima, "total": total}
@@ -0,0 +1,221 @@
+"""
+Diario de envío a prueba de caídas.
+
+Cada ejecución del envío escribe en la carpeta del mes un diario JSON Lines
+(``diario_envio_<id>.jsonl``) al que solo se añaden líneas: el inicio de la
+ejecución, cada intento de envío, cada resultado y el final. Cada línea se
+vuelca a disco (fsync) antes de seguir, de modo que si la aplicación o el
+equipo se caen a mitad de un envío, la siguiente vez el Paso 3 puede
+reanudarlo sin volver a enviar a quien ya recibió su nómina.
+
+Un intento sin resultado (la caída ocurrió durante el envío de ese correo)
+no cuenta como enviado: al reanudar se vuelve a enviar. Un envío aplazado
+por agotarse la cuota diaria también se ofrece para reanudar.
+"""
+import glob
+import json
+import os
+import uuid
+from datetime import datetime
+
+
+PREFIJO_DIARIO = 'diario_envio_'
+
+FORMATO_FECHA = '%Y-%m-%d %H:%M:%S'
+
+
+def _ahora():
+    return datetime.now().strftime(FORMATO_FECHA)
+
+
+class DiarioEnvio:
+    """Diario de solo añadir de una ejecución del envío."""
+
+    def __init__(self, ruta, id_ejecucion):
+        self.ruta = ruta
+        self.id_ejecucion = id_ejecucion
+        self._archivo = open(ruta, 'a', encoding='utf-8')
+
+    @classmethod
+    def crear(cls, carpeta_mes, pdf_path, pdf_hash, total):
+        """Start the journal of a new run in the month folder.
+
+        Args:
+            carpeta_mes (str): Month folder of the run
+            pdf_path (str): Path to the master PDF file
+            pdf_hash (str): Content hash of the master PDF
+            total (int): Number of tasks to send
+
+        Returns:
+            DiarioEnvio: Open journal
+        """
+        id_ejecucion = f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:6]}"
+        diario = cls(os.path.join(carpeta_mes, f"{PREFIJO_DIARIO}{id_ejecucion}.jsonl"), id_ejecucion)
+        diario._escribir({
+            'tipo': 'inicio', 'ejecucion': id_ejecucion, 'fecha': _ahora(),
+            'pdf_maestro': os.path.basename(pdf_path), 'pdf_hash': pdf_hash, 'total': total,
+        })
+        return diario
+
+    @classmethod
+    def continuar(cls, ejecucion):
+        """Reopen the journal of an interrupted run to resume it.
+
+        Args:
+            ejecucion (dict): Result of buscar_ejecucion_interrumpida()
+
+        Returns:
+            DiarioEnvio: Open journal
+        """
+        diario = cls(ejecucion['ruta'], ejecucion['ejecucion'])
+        diario._escribir({'tipo': 'reanudacion', 'ejecucion': diario.id_ejecucion, 'fecha': _ahora()})
+        return diario
+
+    def _escribir(self, registro):
+        """Append a record and force it to disk before returning."""
+        self._archivo.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        self._archivo.flush()
+        os.fsync(self._archivo.fileno())
+
+    def intento(self, tarea):
+        """Record that a task is about to be sent."""
+        self._escribir({
+            'tipo': 'intento', 'pagina': tarea['pagina'], 'nif': tarea['nif'],
+            'email': tarea['email'], 'fecha': _ahora(),
+        })
+
+    def resultado(self, tarea, estado, archivo=None, error=''):
+        """Record the result of a task ('enviado' or 'error')."""
+        self._escribir({
+            'tipo': 'resultado', 'pagina': tarea['pagina'], 'nif': tarea['nif'],
+            'email': tarea['email'], 'estado': estado, 'archivo': archivo,
+            'error': error, 'fecha': _ahora(),
+        })
+
+    def finalizar(self, enviados, errores, cancelado=False, aplazado=False):
+        """Record the end of the run.
+
+        A finished run is never offered to resume, unless it was deferred
+        because the daily quota ran out (``aplazado``).
+        """
+        self._escribir({
+            'tipo': 'fin', 'fecha': _ahora(), 'enviados': enviados, 'errores': errores,
+            'cancelado': cancelado, 'aplazado': aplazado,
+        })
+
+    def descartar(self):
+        """Record that the user chose not to resume this run."""
+        self._escribir({'tipo': 'fin', 'fecha': _ahora(), 'descartada': True})
+
+    def cerrar(self):
+        """Close the journal file (without marking the run as finished)."""
+        if not self._archivo.closed:
+            self._archivo.close()
+
+
+def leer_diario(ruta):
+    """Read the records of a journal.
+
+    A truncated last line (the crash happened while it was being written)
+    is ignored.
+
+    Args:
+        ruta (str): Path to the journal
+
+    Returns:
+        list: Records in the order they were written
+    """
+    registros = []
+    with open(ruta, 'r', encoding='utf-8') as f:
+        for linea in f:
+            try:
+                registros.append(json.loads(linea))
+            except ValueError:
+                break
+    return registros
+
+
+def buscar_ejecucion_interrumpida(carpetas_mes, pdf_hash):
+    """Find the latest run of a master PDF that didn't finish.
+
+    The journals of every month folder are searched, so a run interrupted
+    (or deferred) at the end of a month is still found the next month.
+
+    Args:
+        carpetas_mes (list): Month folders of the runs
+        pdf_hash (str): Content hash of the current master PDF
+
+    Returns:
+        dict: 'ejecucion' (run ID), 'ruta', 'fecha', 'total', 'aplazada'
+            (deferred by the daily quota) and 'enviadas' (page -> result
+            record of the tasks confirmed as sent), or None
+    """
+    diarios = [
+        ruta for carpeta_mes in carpetas_mes
+        for ruta in glob.glob(os.path.join(carpeta_mes, f"{PREFIJO_DIARIO}*.jsonl"))
+    ]
+    # El nombre empieza por la fecha de la ejecución: la más reciente primero
+    diarios.sort(key=os.path.basename, reverse=True)
+    for ruta in diarios:
+        try:
+            registros = leer_diario(ruta)
+        except OSError:
+            continue
+        if not registros or registros[0].get('tipo') != 'inicio':
+            continue
+        inicio = registros[0]
+        if inicio.get('pdf_hash') != pdf_hash:
+            continue
+        finales = [registro for registro in registros if registro.get('tipo') == 'fin']
+        if finales and not finales[-1].get('aplazado'):
+            # La ejecución más reciente de este PDF terminó: no hay nada que reanudar
+            return None
+
+        enviadas = {}
+        for registro in registros:
+            if registro.get('tipo') != 'resultado':
+                continue
+            if registro.get('estado') == 'enviado':
+                enviadas[registro['pagina']] = registro
+            else:
+                enviadas.pop(registro['pagina'], None)
+        return {
+            'ejecucion': inicio['ejecucion'],
+            'ruta': ruta,
+            'fecha': inicio.get('fecha'),
+            'total': inicio.get('total', 0),
+            'aplazada': bool(finales),
+            'enviadas': enviadas,
+        }
+    return None
+
+
+def fecha_registro(registro):
+    """Return the date of a journal record as a datetime (None if missing or invalid)."""
+    try:
+        return datetime.strptime(registro.get('fecha', ''), FORMATO_FECHA)
+    except (TypeError, ValueError):
+        return None
+
+
+def ya_enviada(ejecucion, tarea):
+    """Check whether a task was confirmed as sent in an interrupted run.
+
+    The task must still have the same NIF and email it was sent to.
+    """
+    if not ejecucion:
+        return False
+    registro = ejecucion['enviadas'].get(tarea['pagina'])
+    return (
+        registro is not None and registro['nif'] == tarea['nif']
+        and registro['email'] == tarea['email']
+    )
+
+
+def descartar_ejecucion(ejecucion):
+    """Mark an interrupted run as finished so it isn't offered again."""
+    diario = DiarioEnvio(ejecucion['ruta'], ejecucion['ejecucion'])
+    try:
+        diario.descartar()
+    finally:
+        diario.cerrar()
@@ -5,6 +5,7 @@ import os
 import pandas as pd
 from datetime import datetime
 from logic.formato_archivos import generar_nombre_archivo
+from logic.registro_envio import ESTADO_ENVIADO, ESTADO_ERROR, RegistroEnvio
 from utils.logger import log_info, log_warning, log_error, log_debug
 
 
@@ -14,6 +15,8 @@ def generar_accion_requerida(status):
         return "Verificar que el PDF contenga NIFs válidos"
     elif "NIF no encontrado en la lista" in status:
         return "Añadir empleado a la lista o verificar NIF"
+    elif "NIF duplicado en la lista" in status:
+        return "Dejar una sola fila por NIF en la lista de empleados"
     elif "Email inválido" in status:
         return "Corregir formato del email del empleado"
     elif "Sin datos" in status:
@@ -23,7 +26,12 @@ def generar_accion_requerida(status):
 
 
 def generar_reporte_final(stats, todas_las_tareas_originales, config):
-    """Genera un reporte final en Excel con TODOS los empleados y sus estados."""
+    """Genera un reporte final en Excel con TODOS los empleados y sus estados.
+
+    ``todas_las_tareas_originales`` es el AlmacenTareas compartido del proceso.
+    El estado de cada tarea sale del registro de resultados del envío
+    (``stats['registro']``, un RegistroEnvio).
+    """
     try:
         carpeta_mes = stats.get('carpeta_mes')
         if not carpeta_mes:
@@ -41,39 +49,31 @@ def generar_reporte_final(stats, todas_las_tareas_originales, config):
         log_info(f"Generando reporte con {len(todas_las_tareas_originales)} empleados totales")
         
         datos_reporte = []
-        enviados_exitosos = set()
-        errores_dict = {}
-        for error_info in stats.get('errores_lista', []):
-            key = f"{error_info['nombre']}|{error_info['email']}"
-            errores_dict[key] = error_info['error']
-        
-        total_enviados = stats.get('enviados', 0)
-        if total_enviados > 0:
-            count_exitosos = 0
-            for tarea in todas_las_tareas_originales:
-                if tarea['status'] == '[OK]':
-                    key = f"{tarea['nombre']}|{tarea['email']}"
-                    if key not in errores_dict and count_exitosos < total_enviados:
-                        enviados_exitosos.add(key)
-                        count_exitosos += 1
+        registro = stats.get('registro') or RegistroEnvio()
+        paginas_aplazadas = stats.get('paginas_aplazadas', ())
         
+        plantilla_archivo = config.get('Formato', 'archivo_nomina', fallback='{nombre}_Nomina_{mes}_{año}.pdf')
         for tarea in todas_las_tareas_originales:
-            key = f"{tarea['nombre']}|{tarea['email']}"
+            resultado = registro.resultado(tarea['pagina'])
             
             if tarea['status'] != '[OK]':
                 # Las que tenían errores en Paso 2 = PENDIENTE
                 estado_envio = "PENDIENTE"
                 observaciones = f"No procesado: {tarea['status']}"
-            elif key in enviados_exitosos:
+            elif resultado is not None and resultado.estado == ESTADO_ENVIADO:
                 # Las que se procesaron y enviaron bien = ENVIADO
                 estado_envio = "ENVIADO"
                 observaciones = "Enviado correctamente"
-            elif key in errores_dict:
+            elif resultado is not None and resultado.estado == ESTADO_ERROR:
                 # Las que se procesaron pero fallaron en el envío = ERROR
                 estado_envio = "ERROR"
-                observaciones = errores_dict[key]
+                observaciones = resultado.error
+            elif tarea['pagina'] in paginas_aplazadas:
+                # No cupieron en la cuota diaria: se envían al reanudar
+                estado_envio = "APLAZADO"
+                observaciones = "Aplazado por la cuota diaria; se enviará al reanudar"
             else:
-                # Fallback (no debería pasar)
+                # Listas que no se llegaron a procesar (envío cancelado)
                 estado_envio = "PENDIENTE"
                 observaciones = "No procesado"
             
@@ -81,20 +81,22 @@ def generar_reporte_final(stats, todas_las_tareas_originales, config):
             nombre_solo = tarea['nombre']
             apellidos_solo = tarea.get('apellidos', '')
             
-            # Generar nombre del archivo 
-            plantilla_archivo = config.get('Formato', 'archivo_nomina', fallback='{nombre}_Nomina_{mes}_{año}.pdf')
-            nombre_archivo = generar_nombre_archivo(plantilla_archivo, nombre_solo, apellidos_solo)
+            # Nombre real del PDF creado, o el que tendría según la plantilla
+            if resultado is not None and resultado.archivo:
+                nombre_archivo = resultado.archivo
+            else:
+                nombre_archivo = generar_nombre_archivo(plantilla_archivo, nombre_solo, apellidos_solo)
             
             # Obtener la posición original si existe
             posicion_original = tarea.get('posicion_original', 'N/A')
             
-            # Obtener fecha de procesamiento real o usar fecha por defecto
-            fecha_procesamiento = tarea.get('fecha_procesamiento', 'No procesado')
-            if fecha_procesamiento == 'No procesado' and estado_envio == 'PENDIENTE':
-                fecha_procesamiento = 'No procesado'
-            elif fecha_procesamiento == 'No procesado':
-                fecha_procesamiento = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            # Hora real en que terminó el envío de la tarea
+            fecha_procesamiento = (resultado.fecha_fin() if resultado else None) or 'No procesado'
                 
+            # Tamaño real del adjunto y bytes ahorrados por la optimización
+            tamano_original, tamano_adjunto = stats.get('tamanos_adjuntos', {}).get(
+                tarea['pagina'], (None, None))
+            
             datos_reporte.append({
                 'POS.': posicion_original,  # Primera columna: posición original
                 'Página PDF': tarea['pagina'],
@@ -105,7 +107,9 @@ def generar_reporte_final(stats, todas_las_tareas_originales, config):
                 'Archivo PDF': nombre_archivo,
                 'Estado Envío': estado_envio,
                 'Observaciones': observaciones,  # Mantener para lógica empresarial
-                'Fecha Procesado': fecha_procesamiento
+                'Fecha Procesado': fecha_procesamiento,
+                'Tamaño PDF (KB)': round(tamano_adjunto / 1024, 1) if tamano_adjunto else '',
+                'Ahorro (KB)': round((tamano_original - tamano_adjunto) / 1024, 1) if tamano_adjunto else ''
             })
         
         # Ordenar datos por posición original (de 0 al infinito)
@@ -158,6 +162,9 @@ def _crear_excel_completo(archivo_reporte, datos_reporte, stats, config, todas_l
         
         # Hoja 3: Empleados Pendientes
         _crear_hoja_pendientes(writer, todas_las_tareas_originales)
+        
+        # Hoja 4: Cambios del ritmo de envío
+        _crear_hoja_control_ritmo(writer, stats)
     
     log_info(f"Reporte generado: {archivo_reporte}")
 
@@ -213,13 +220,13 @@ def _aplicar_validacion_estado(worksheet, datos_reporte):
     """Aplica validación dropdown para la columna Estado Envío."""
     from openpyxl.worksheet.datavalidation import DataValidation
     
-    # Crear validación con las 4 opciones
+    # Crear validación con las 5 opciones
     dv = DataValidation(
         type="list",
-        formula1='"ENVIADO,ERROR,PENDIENTE,MANUAL"',
+        formula1='"ENVIADO,ERROR,PENDIENTE,APLAZADO,MANUAL"',
         allow_blank=False
     )
-    dv.error = 'El valor debe ser: ENVIADO, ERROR, PENDIENTE o MANUAL'
+    dv.error = 'El valor debe ser: ENVIADO, ERROR, PENDIENTE, APLAZADO o MANUAL'
     dv.errorTitle = 'Valor inválido'
     dv.prompt = 'Seleccione el estado del envío'
     dv.promptTitle = 'Estado del Envío'
@@ -237,8 +244,10 @@ def _aplicar_formato_condicional(worksheet, datos_reporte, color_success, color_
     from openpyxl.formatting.rule import Rule
     from openpyxl.styles.differential import DifferentialStyle
     
+    from openpyxl.utils import get_column_letter
+    
     # Rango completo de datos (todas las columnas, todas las filas con datos)  
-    rango_datos = f"A2:J{len(datos_reporte) + 1}"
+    rango_datos = f"A2:{get_column_letter(worksheet.max_column)}{len(datos_reporte) + 1}"
     
     # Regla 1: ENVIADO = Verde
     regla_enviado = Rule(
@@ -256,10 +265,10 @@ def _aplicar_formato_condicional(worksheet, datos_reporte, color_success, color_
     )
     worksheet.conditional_formatting.add(rango_datos, regla_error)
     
-    # Regla 3: PENDIENTE = Amarillo
+    # Regla 3: PENDIENTE o APLAZADO = Amarillo
     regla_pendiente = Rule(
         type="expression",
-        formula=[f'$H2="PENDIENTE"'],  # Si columna H = "PENDIENTE" 
+        formula=[f'OR($H2="PENDIENTE",$H2="APLAZADO")'],  # Si columna H = "PENDIENTE" o "APLAZADO"
         dxf=DifferentialStyle(fill=color_pending)
     )
     worksheet.conditional_formatting.add(rango_datos, regla_pendiente)
@@ -313,6 +322,7 @@ def _crear_hoja_resumen(writer, stats, config):
     """Crea la hoja de resumen estadístico."""
     from openpyxl.styles import Alignment, PatternFill, Font
     
+    ritmo = stats.get('control_ritmo', {})
     resumen_data = {
         'Metrica': [
             'Total Procesadas',
@@ -321,7 +331,18 @@ def _crear_hoja_resumen(writer, stats, config):
             'Tasa de Exito',
             'Email Remitente',
             'Fecha del Proceso',
-            'Carpeta PDFs'
+            'Carpeta PDFs',
+            'Tamaño Adjuntos (KB)',
+            'Ahorrado por Optimización (KB)',
+            'Ritmo Adaptativo',
+            'Ritmo Inicial (correos/s)',
+            'Ritmo Final (correos/s)',
+            'Ritmo Máximo Alcanzado (correos/s)',
+            'Conexiones Finales',
+            'Respuestas de Limitación',
+            'Reintentos Aplazados',
+            'Picos de Latencia',
+            'Latencia Media (s)'
         ],
         'Valor': [
             stats['total'],
@@ -330,7 +351,18 @@ def _crear_hoja_resumen(writer, stats, config):
             f"{(stats['enviados'] / stats['total'] * 100):.1f}%" if stats['total'] > 0 else "0%",
             config.get('Email', 'email_origen', fallback='N/A'),
             datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            stats.get('carpeta_pdfs', 'N/A')
+            stats.get('carpeta_pdfs', 'N/A'),
+            round(stats.get('bytes_adjuntos', 0) / 1024, 1),
+            round(stats.get('bytes_ahorrados', 0) / 1024, 1),
+            'Sí' if ritmo.get('adaptativo') else 'No',
+            ritmo.get('ritmo_inicial', 'N/A'),
+            ritmo.get('ritmo_final', 'N/A'),
+            ritmo.get('ritmo_maximo_alcanzado', 'N/A'),
+            ritmo.get('conexiones_finales', 'N/A'),
+            ritmo.get('limitaciones', 0),
+            stats.get('reintentos_aplazados', 0),
+            ritmo.get('picos_latencia', 0),
+            ritmo.get('latencia_media') if ritmo.get('latencia_media') is not None else 'N/A'
         ]
     }
     df_resumen = pd.DataFrame(resumen_data)
@@ -381,7 +413,7 @@ def _crear_hoja_pendientes(writer, todas_las_tareas_originales):
     from openpyxl.styles import Alignment, PatternFill, Font
     
     # Hoja 3: Empleados Pendientes (los que NO se pudieron procesar)
-    empleados_pendientes = [t for t in todas_las_tareas_originales if t['status'] != '[OK]']
+    empleados_pendientes = todas_las_tareas_originales.pendientes()
     
     if empleados_pendientes:
         pendientes_data = []
@@ -453,6 +485,44 @@ def _crear_hoja_pendientes(writer, todas_las_tareas_originales):
         log_info("[OK] No hay empleados pendientes - todos se procesaron correctamente")
 
 
+def _crear_hoja_control_ritmo(writer, stats):
+    """Crea la hoja con los cambios de ritmo y conexiones del envío."""
+    from openpyxl.styles import Alignment, PatternFill, Font
+    
+    ajustes = stats.get('control_ritmo', {}).get('ajustes', [])
+    if not ajustes:
+        return
+    
+    motivos = {'aumento': 'Aumento', 'limitacion': 'Limitación del servidor', 'latencia': 'Pico de latencia'}
+    df_ritmo = pd.DataFrame([{
+        'Fecha': ajuste['fecha'],
+        'Motivo': motivos.get(ajuste['motivo'], ajuste['motivo']),
+        'Ritmo (correos/s)': ajuste['ritmo'],
+        'Conexiones': ajuste['conexiones'],
+        'Detalle': ajuste['detalle'],
+    } for ajuste in ajustes])
+    df_ritmo.to_excel(writer, sheet_name='Control de Ritmo', index=False)
+    worksheet = writer.sheets['Control de Ritmo']
+    
+    color_cabecera = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")
+    color_reduccion = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+    for cell in worksheet[1]:
+        cell.fill = color_cabecera
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+    
+    # Resaltar las reducciones
+    for row_num, ajuste in enumerate(ajustes, 2):
+        if ajuste['motivo'] != 'aumento':
+            for cell in worksheet[row_num]:
+                cell.fill = color_reduccion
+    
+    for column, ancho in zip('ABCDE', (20, 24, 18, 12, 50)):
+        worksheet.column_dimensions[column].width = ancho
+    
+    log_info(f"[OK] Hoja 'Control de Ritmo' agregada con {len(ajustes)} cambios")
+
+
 def _crear_reporte_txt(carpeta_mes, stats, archivo_reporte):
     """Crea un resumen simple en formato TXT."""
     archivo_txt = os.path.join(carpeta_mes, "resumen_proceso.txt")
@@ -465,6 +535,19 @@ def _crear_reporte_txt(carpeta_mes, stats, archivo_reporte):
         f.write(f"Enviadas exitosamente: {stats['enviados']}\n")
         f.write(f"Con errores: {stats['errores']}\n")
         f.write(f"Tasa de exito: {(stats['enviados'] / stats['total'] * 100):.1f}%\n" if stats['total'] > 0 else "Tasa de exito: 0%\n")
+        if stats.get('bytes_adjuntos'):
+            f.write(f"Tamaño de los adjuntos: {stats['bytes_adjuntos'] / 1024:.1f} KB\n")
+            f.write(f"Ahorrado por la optimización: {stats['bytes_ahorrados'] / 1024:.1f} KB\n")
+        ritmo = stats.get('control_ritmo')
+        if ritmo:
+            if ritmo['adaptativo']:
+                f.write(f"Ritmo de envío: {ritmo['ritmo_inicial']:g} -> {ritmo['ritmo_final']:g} correos/s "
+                        f"(máximo {ritmo['ritmo_maximo_alcanzado']:g}), "
+                        f"{ritmo['conexiones_finales']} de {ritmo['conexiones_max']} conexiones\n")
+            f.write(f"Respuestas de limitación: {ritmo['limitaciones']}, "
+                    f"picos de latencia: {ritmo['picos_latencia']}\n")
+        if stats.get('reintentos_aplazados'):
+            f.write(f"Reintentos aplazados por fallos temporales: {stats['reintentos_aplazados']}\n")
         f.write(f"\nCarpeta PDFs: {stats.get('carpeta_pdfs', 'N/A')}\n")
         f.write(f"Reporte detallado: {os.path.basename(archivo_reporte)}\n")
         
@@ -4,25 +4,42 @@ Main module for payroll email sending - Refactored version.
 Handles robust email sending with retry logic, error recovery, and comprehensive
 logging. Includes PDF processing, encryption, and batch sending capabilities.
 """
+import glob
 import os
+import queue
 import smtplib
+import threading
 import ssl
 import time
 import socket
 import shutil
 import random
 import string
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
-import pikepdf
 import fitz  # PyMuPDF
 
 from .formato_archivos import generar_nombre_archivo
+from .preparacion_nominas import (
+    cargar_manifiesto, entrada_manifiesto, guardar_manifiesto, iterar_nominas_preparadas,
+    obtener_optimizacion, opciones_guardado, opciones_preparacion, preparar_nomina
+)
+from .cache_analisis import hash_archivo
 from .email_templates import generar_asunto_personalizado, generar_cuerpo_personalizado
 from .email_reports import generar_reporte_final
+from .tareas import AlmacenTareas
+from .diario_envio import DiarioEnvio, buscar_ejecucion_interrumpida, fecha_registro, ya_enviada
+from .envio_asincrono import MotorEnvioAsincrono, obtener_motor_envio
+from .limite_envios import LimitadorEnvios, obtener_limites
+from .control_ritmo import (
+    ControladorRitmo, es_limitacion, es_respuesta_destinatario, obtener_control_ritmo, respuesta_smtp
+)
+from .reintentos_envio import ColaReintentos, FalloEnvio, clasificar_fallo, opciones_reintento
+from .registro_envio import ESTADO_ENVIADO, ESTADO_ERROR, ESTADO_PREPARADO, RegistroEnvio
 from utils.logger import log_info, log_error, log_warning, log_debug
 
 
@@ -71,7 +88,7 @@ def procesar_pdf_pendiente(doc_maestro, tarea, output_dir, config):
     doc_individual.insert_pdf(doc_maestro, from_page=tarea['pagina'] - 1, to_page=tarea['pagina'] - 1)
     
     # Guardar SIN contraseñas de apertura o edición
-    doc_individual.save(ruta_pdf)
+    doc_individual.save(ruta_pdf, **opciones_guardado(obtener_optimizacion(config)['nivel']))
     doc_individual.close()
     
     log_info(f"PDF pendiente creado (sin cifrar): {nombre_archivo}")
@@ -120,51 +137,84 @@ def generar_estadisticas_envio(tareas):
     potential issues, and data quality before starting email sending.
     
     Args:
-        tareas (list): List of task objects to analyze
+        tareas (AlmacenTareas): Task store to analyze (a list of task
+            dicts is also accepted)
         
     Returns:
         dict: Statistics including validation counts and email analysis
     """
+    if not isinstance(tareas, AlmacenTareas):
+        tareas = AlmacenTareas(tareas)
+    
+    # Status counts are kept up to date by the store
     stats = {
-        'total_validadas': len([t for t in tareas if t['status'] == '[OK]']),
-        'total_errores': len([t for t in tareas if t['status'].startswith('[ERROR]')]),
-        'total_warnings': len([t for t in tareas if t['status'].startswith('[ADVERTENCIA]')]),
+        'total_validadas': tareas.contadores['ok'],
+        'total_errores': tareas.contadores['error'],
+        'total_warnings': tareas.contadores['advertencia'],
         'emails_invalidos': 0,
         'emails_duplicados': 0
     }
     
     # Analyze email addresses for validity and duplicates
     emails_vistos = set()
-    for tarea in tareas:
-        if tarea['status'] == '[OK]':
-            email = tarea.get('email', '').strip().lower()
-            
-            if not validar_email_basico(email):
-                stats['emails_invalidos'] += 1
-            
-            if email in emails_vistos:
-                stats['emails_duplicados'] += 1
-            else:
-                emails_vistos.add(email)
+    for tarea in tareas.listas():
+        email = tarea.get('email', '').strip().lower()
+        
+        if not validar_email_basico(email):
+            stats['emails_invalidos'] += 1
+        
+        if email in emails_vistos:
+            stats['emails_duplicados'] += 1
+        else:
+            emails_vistos.add(email)
     
     return stats
 
 
 class RobustEmailSender:
-    """Cliente SMTP robusto con reintentos, timeouts y manejo de errores."""
+    """Cliente SMTP robusto con reintentos, timeouts y manejo de errores.
     
-    def __init__(self, config):
+    Mantiene un pool de ``[SMTP] conexiones`` conexiones autenticadas. Cada
+    llamada a enviar_email() toma una conexión libre, de modo que varios
+    hilos pueden enviar a la vez; cada conexión se reconecta por su cuenta.
+    El ``limitador`` (ver limite_envios) limita el ritmo global de todas las
+    conexiones juntas y el ``controlador`` (ver control_ritmo) ajusta el
+    ritmo y cuántas conexiones envían a la vez según responde el servidor;
+    con cualquiera de los dos, la pausa fija ``delay_segundos`` entre emails
+    deja de aplicarse.
+    """
+    
+    def __init__(self, config, limitador=None, controlador=None):
         self.config = config
         self.servidor_smtp = config.get('SMTP', 'servidor', fallback='smtp.gmail.com')
         self.puerto_smtp = int(config.get('SMTP', 'puerto', fallback='587'))
         self.timeout = int(config.get('SMTP', 'timeout', fallback='30'))
         self.max_reintentos = int(config.get('SMTP', 'max_reintentos', fallback='3'))
         self.delay_entre_emails = float(config.get('SMTP', 'delay_segundos', fallback='1.0'))
+        self.tamano_pool = max(1, int(config.get('SMTP', 'conexiones', fallback='1')))
+        self.limitador = limitador or LimitadorEnvios(obtener_limites(config))
+        self.controlador = controlador or ControladorRitmo(
+            obtener_control_ritmo(config, self.limitador.limites), self.tamano_pool)
         self.server = None
         self.conexiones_fallidas = 0
         
-    def conectar(self, email_origen, password):
-        """Establece conexión SMTP con reintentos."""
+        # Conexiones del pool; cada una es un dict con su objeto 'server'
+        self._conexiones = []
+        self._libres = queue.Queue()
+        self._agregar_conexion(None)
+        
+        # Envíos en curso, como mucho controlador.conexiones a la vez
+        self._turno_conexion = threading.Condition()
+        self._en_curso = 0
+    
+    def _agregar_conexion(self, server):
+        conexion = {'server': server}
+        self._conexiones.append(conexion)
+        self._libres.put(conexion)
+        return conexion
+    
+    def _abrir_conexion(self, email_origen, password):
+        """Abre y autentica una conexión SMTP con reintentos; None si no se pudo."""
         for intento in range(self.max_reintentos):
             try:
                 log_info(f"Conectando a {self.servidor_smtp}:{self.puerto_smtp} (intento {intento + 1})")
@@ -172,24 +222,24 @@ class RobustEmailSender:
                 # Configurar timeout a nivel socket
                 socket.setdefaulttimeout(self.timeout)
                 
-                self.server = smtplib.SMTP(self.servidor_smtp, self.puerto_smtp, timeout=self.timeout)
-                self.server.set_debuglevel(0)  # 0=sin debug, 1=debug básico, 2=debug completo
+                server = smtplib.SMTP(self.servidor_smtp, self.puerto_smtp, timeout=self.timeout)
+                server.set_debuglevel(0)  # 0=sin debug, 1=debug básico, 2=debug completo
                 
                 log_info("Iniciando TLS...")
                 context = ssl.create_default_context()
-                self.server.starttls(context=context)
+                server.starttls(context=context)
                 
                 log_info("Autenticando...")
-                self.server.login(email_origen, password)
+                server.login(email_origen, password)
                 
                 log_info("[OK] Conexión SMTP establecida exitosamente")
                 self.conexiones_fallidas = 0
-                return True
+                return server
                 
             except smtplib.SMTPAuthenticationError as e:
                 log_error(f"[ERROR] Error de autenticación: {e}")
                 log_error("Verificar credenciales de email y contraseñas de aplicación")
-                return False
+                return None
                 
             except smtplib.SMTPServerDisconnected as e:
                 log_warning(f"[ADVERTENCIA] Servidor desconectado (intento {intento + 1}): {e}")
@@ -199,7 +249,7 @@ class RobustEmailSender:
                 
             except socket.gaierror as e:
                 log_error(f"[ERROR] Error de DNS/red: {e}")
-                return False
+                return None
                 
             except Exception as e:
                 log_warning(f"[ADVERTENCIA] Error de conexión (intento {intento + 1}): {type(e).__name__}: {e}")
@@ -212,78 +262,166 @@ class RobustEmailSender:
         
         log_error(f"[ERROR] Failed to connect after {self.max_reintentos} attempts")
         self.conexiones_fallidas += 1
-        return False
+        return None
+        
+    def conectar(self, email_origen, password):
+        """Establece las conexiones SMTP del pool con reintentos.
+        
+        Basta con que se abra la primera: si alguna de las demás falla se
+        sigue con las que se hayan abierto.
+        """
+        server = self._abrir_conexion(email_origen, password)
+        if server is None:
+            return False
+        
+        self.cerrar()
+        self.server = server
+        self._conexiones = []
+        self._libres = queue.Queue()
+        self._agregar_conexion(server)
+        for _ in range(1, self.tamano_pool):
+            adicional = self._abrir_conexion(email_origen, password)
+            if adicional is None:
+                log_warning(f"[ADVERTENCIA] Se continúa con {len(self._conexiones)} conexiones SMTP")
+                break
+            self._agregar_conexion(adicional)
+        if len(self._conexiones) > 1:
+            log_info(f"[OK] Pool de {len(self._conexiones)} conexiones SMTP listo")
+        self.controlador.ajustar_maximo(len(self._conexiones))
+        return True
     
-    def enviar_email(self, msg, email_destino, max_reintentos=None):
-        """Envía un email con reintentos automáticos."""
-        if max_reintentos is None:
-            max_reintentos = self.max_reintentos
-            
-        for intento in range(max_reintentos):
+    @property
+    def num_conexiones(self):
+        """Number of connections in the pool (how many emails can be sent at once)."""
+        return len(self._conexiones)
+    
+    def enviar_email(self, msg, email_destino):
+        """Intenta enviar un email una vez por una conexión libre del pool.
+        
+        Puede llamarse a la vez desde varios hilos; si no hay ninguna
+        conexión libre, o ya envían tantas como permite el controlador de
+        ritmo, espera a que otro envío termine. Los reintentos no se hacen
+        aquí sino en la cola de reintentos aplazados (ver reintentos_envio).
+        
+        Returns:
+            bool: True si se envió
+        
+        Raises:
+            FalloEnvio: Si no se pudo enviar, indicando si el fallo es temporal
+        """
+        with self._turno_conexion:
+            # El límite puede subir sin aviso: se vuelve a mirar cada poco
+            while self._en_curso >= self.controlador.conexiones:
+                self._turno_conexion.wait(0.1)
+            self._en_curso += 1
+        conexion = self._libres.get()
+        try:
+            return self._enviar_por(conexion, msg, email_destino)
+        finally:
+            self._libres.put(conexion)
+            with self._turno_conexion:
+                self._en_curso -= 1
+                self._turno_conexion.notify()
+    
+    def _reconectar(self, conexion):
+        """Reabre una conexión del pool; False si no se pudo."""
+        email_origen = self.config.get('Email', 'email_origen')
+        password = self.config.get('Email', 'password')
+        server = self._abrir_conexion(email_origen, password)
+        if server is None:
+            return False
+        conexion['server'] = server
+        return True
+    
+    def _enviar_por(self, conexion, msg, email_destino):
+        """Intenta una vez enviar un email por una conexión concreta.
+        
+        Si la conexión estaba caída se reabre y se vuelve a intentar en el
+        acto (el servidor no llegó a recibir el mensaje); cualquier otro
+        fallo se lanza clasificado por su código de respuesta.
+        """
+        for reconexion in range(2):
             try:
                 # Verificar conexión
-                if not self.server:
+                if not conexion['server']:
                     raise smtplib.SMTPServerDisconnected("No hay conexión activa")
                 
-                # Enviar mensaje
-                self.server.send_message(msg)
+                # Enviar mensaje al ritmo permitido por el limitador y el controlador
+                espera = max(self.limitador.reservar(), self.controlador.reservar())
+                if espera > 0:
+                    time.sleep(espera)
+                inicio = time.monotonic()
+                conexion['server'].send_message(msg)
+                self.controlador.exito(time.monotonic() - inicio)
                 
-                # Rate limiting - pausa entre emails
-                if self.delay_entre_emails > 0:
+                # Rate limiting - pausa entre emails de esta conexión
+                if self.delay_entre_emails > 0 and not (self.limitador.activo or self.controlador.activo):
                     time.sleep(self.delay_entre_emails)
                     
                 return True
                 
             except smtplib.SMTPServerDisconnected as e:
-                log_warning(f"[ADVERTENCIA] Servidor desconectado durante envío (intento {intento + 1}): {e}")
-                # Intentar reconectar
-                email_origen = self.config.get('Email', 'email_origen')
-                password = self.config.get('Email', 'password')
-                if self.conectar(email_origen, password):
-                    continue  # Reintentar envío
-                else:
-                    return False
-                    
-            except smtplib.SMTPRecipientsRefused as e:
-                log_error(f"[ERROR] Email rechazado por el servidor: {email_destino} - {e}")
-                return False  # No reintentar, email inválido
-                
-            except smtplib.SMTPDataError as e:
-                log_error(f"[ERROR] Error de datos SMTP: {e}")
-                return False  # No reintentar, problema con el mensaje
+                log_warning(f"[ADVERTENCIA] Servidor desconectado durante envío: {e}")
+                # Intentar reconectar solo esta conexión y reenviar una vez
+                if reconexion == 0 and self._reconectar(conexion):
+                    continue
+                raise FalloEnvio(f"Servidor desconectado: {e}", temporal=True) from e
                 
-            except socket.timeout as e:
-                log_warning(f"[ADVERTENCIA] Timeout enviando email (intento {intento + 1}): {e}")
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as e:
+                codigo, mensaje = respuesta_smtp(e)
+                if es_limitacion(codigo, mensaje, es_respuesta_destinatario(e)):
+                    # El servidor pide ir más despacio: se reduce el ritmo
+                    self.controlador.limitado(codigo, mensaje)
+                # Con 421 smtplib cierra la conexión; con el resto ya hizo RSET
+                if codigo == 421:
+                    self._reconectar(conexion)
+                fallo = clasificar_fallo(e)
+                if fallo.temporal:
+                    log_warning(f"[ADVERTENCIA] Fallo temporal enviando a {email_destino}: {fallo}")
+                else:
+                    log_error(f"[ERROR] Email rechazado por el servidor: {email_destino} - {fallo}")
+                raise fallo from e
                 
             except Exception as e:
-                log_warning(f"[ADVERTENCIA] Error enviando email (intento {intento + 1}): {type(e).__name__}: {e}")
-            
-            # Pausa antes del siguiente intento
-            if intento < max_reintentos - 1:
-                delay = min((2 ** intento), 10)  # Max 10 segundos
-                log_info(f"Esperando {delay}s antes de reintentar envío...")
-                time.sleep(delay)
-        
-        log_error(f"[ERROR] Failed to send email to {email_destino} after {max_reintentos} attempts")
-        return False
+                log_warning(f"[ADVERTENCIA] Error enviando email a {email_destino}: {type(e).__name__}: {e}")
+                if isinstance(e, socket.timeout):
+                    # La conexión queda en un estado desconocido: se abrirá de nuevo
+                    try:
+                        conexion['server'].close()
+                    except Exception:
+                        pass
+                    conexion['server'] = None
+                raise clasificar_fallo(e) from e
     
     def cerrar(self):
-        """Cierra la conexión SMTP de forma segura."""
-        if self.server:
+        """Cierra todas las conexiones SMTP del pool de forma segura."""
+        cerradas = 0
+        for conexion in self._conexiones:
+            server = conexion['server']
+            if not server:
+                continue
             try:
-                self.server.quit()
-                log_info("[OK] Conexión SMTP cerrada correctamente")
+                server.quit()
+                cerradas += 1
             except:
                 try:
-                    self.server.close()
+                    server.close()
                 except:
                     pass
             finally:
-                self.server = None
+                conexion['server'] = None
+        if cerradas:
+            log_info("[OK] Conexión SMTP cerrada correctamente")
+        self.server = None
 
 
-def crear_mensaje_email(config, email_origen, email_destino, nombre, apellidos, pdf_path):
-    """Crea el mensaje de email con plantillas personalizadas."""
+def crear_mensaje_email(config, email_origen, email_destino, nombre, apellidos, pdf_path,
+                        contenido_pdf=None):
+    """Crea el mensaje de email con plantillas personalizadas.
+    
+    Si se pasa ``contenido_pdf`` (los bytes ya escritos en ``pdf_path``) se
+    adjunta directamente, sin volver a leer el archivo.
+    """
     msg = MIMEMultipart()
     msg['From'] = email_origen
     msg['To'] = email_destino
@@ -295,9 +433,11 @@ def crear_mensaje_email(config, email_origen, email_destino, nombre, apellidos,
     msg.attach(MIMEText(cuerpo_mensaje, 'plain'))
     
     # Adjuntar PDF
-    with open(pdf_path, "rb") as attachment:
-        part = MIMEBase('application', 'octet-stream')
-        part.set_payload(attachment.read())
+    if contenido_pdf is None:
+        with open(pdf_path, "rb") as attachment:
+            contenido_pdf = attachment.read()
+    part = MIMEBase('application', 'octet-stream')
+    part.set_payload(contenido_pdf)
     
     encoders.encode_base64(part)
     part.add_header(
@@ -310,57 +450,261 @@ def crear_mensaje_email(config, email_origen, email_destino, nombre, apellidos,
 
 
 def procesar_pdf_individual(doc_maestro, tarea, output_dir, config):
-    """Procesa y guarda un PDF individual encriptado."""
-    nombre = tarea['nombre']
-    nif = tarea['nif']
+    """Procesa y guarda un PDF individual encriptado.
     
-    # 1. Extraer PDF individual
-    doc_individual = fitz.open()
-    doc_individual.insert_pdf(
-        doc_maestro, from_page=tarea['pagina'] - 1,
-        to_page=tarea['pagina'] - 1)
+    La página se extrae y se cifra en memoria y se escribe a disco una sola
+    vez, sin archivos temporales (ver preparacion_nominas.preparar_nomina()).
     
-    temp_pdf_path = os.path.join(output_dir, f"temp_{nif}.pdf")
-    doc_individual.save(temp_pdf_path)
-    doc_individual.close()
+    Returns:
+        tuple: (ruta del PDF cifrado, contenido del PDF en bytes) para
+            adjuntarlo sin volver a leer el archivo
+    """
+    log_debug(f"Encriptando PDF para {tarea['nombre']}")
+    ruta, contenido, _ = preparar_nomina(doc_maestro, tarea, output_dir, opciones_preparacion(config))
+    return ruta, contenido
 
-    # 2. Generar nombre de archivo personalizado  
-    plantilla_archivo = config.get('Formato', 'archivo_nomina', 
-                                  fallback='{nombre}_Nomina_{mes}_{año}.pdf')
+
+def registrar_tamano_adjunto(stats, tarea, tamano_original, tamano):
+    """Record the size of a payslip attachment and the bytes its optimization saved.
     
-    # Obtener apellidos de la tarea
-    apellido_empleado = tarea.get('apellidos', '')
-    if not apellido_empleado and ' ' in nombre:
-        # Si no hay apellido separado, intentar separar del nombre completo
-        partes = nombre.strip().split(' ', 1)
-        nombre_empleado = partes[0]
-        apellido_empleado = partes[1] if len(partes) > 1 else ''
-    else:
-        nombre_empleado = nombre
+    Args:
+        stats (dict): Statistics of the run
+        tarea (dict): Task the attachment belongs to
+        tamano_original (int): Size in bytes without optimization
+        tamano (int): Size in bytes of the attachment
+    """
+    stats.setdefault('tamanos_adjuntos', {})[tarea['pagina']] = (tamano_original, tamano)
+    stats['bytes_sin_optimizar'] = stats.get('bytes_sin_optimizar', 0) + tamano_original
+    stats['bytes_adjuntos'] = stats.get('bytes_adjuntos', 0) + tamano
+    stats['bytes_ahorrados'] = stats['bytes_sin_optimizar'] - stats['bytes_adjuntos']
+
+
+def carpetas_envio(config, crear=True, carpeta_mes=None):
+    """Return the month folder of the current run and its subfolders.
     
-    nombre_archivo = generar_nombre_archivo(plantilla_archivo, nombre_empleado, apellido_empleado)
+    Args:
+        config (ConfigParser): Application configuration
+        crear (bool): Create the folders if they don't exist
+        carpeta_mes (str): Month folder to use instead of the current
+            month's (e.g. the one of a run that is being resumed)
+        
+    Returns:
+        dict: 'carpeta_mes', 'enviados' and 'pendientes' paths
+    """
+    if carpeta_mes is None:
+        base_dir = config.get('Carpetas', 'salida', fallback='nominas_individuales')
+        fecha_actual = datetime.now()
+        # Carpeta principal: nominas_2025_09/
+        carpeta_mes = os.path.join(base_dir, f"nominas_{fecha_actual.year}_{fecha_actual.month:02d}")
+    carpetas = {
+        'carpeta_mes': carpeta_mes,
+        # Subcarpetas para PDFs enviados y pendientes
+        'enviados': os.path.join(carpeta_mes, "pdfs_enviados"),
+        'pendientes': os.path.join(carpeta_mes, "pdfs_pendientes"),
+    }
+    if crear:
+        os.makedirs(carpetas['enviados'], exist_ok=True)
+        os.makedirs(carpetas['pendientes'], exist_ok=True)
+    return carpetas
+
+
+def carpetas_meses(config):
+    """Return every month folder under ``[Carpetas] salida``, newest first."""
+    base_dir = config.get('Carpetas', 'salida', fallback='nominas_individuales')
+    carpetas = [
+        carpeta for carpeta in glob.glob(os.path.join(base_dir, 'nominas_*'))
+        if os.path.isdir(carpeta)
+    ]
+    return sorted(carpetas, reverse=True)
+
+
+def _buscar_nominas_preparadas(pdf_path, tareas, config, pdf_hash=None, carpeta_mes=None):
+    """Find the month folder whose manifest has payslips of this master PDF.
     
-    pdf_encriptado_path = os.path.join(output_dir, nombre_archivo)
+    Args:
+        pdf_path (str): Path to the master PDF file
+        tareas (iterable): Tasks about to be sent
+        config (ConfigParser): Application configuration
+        pdf_hash (str): Content hash of the master PDF, if already known
+        carpeta_mes (str): Only look in this month folder
+        
+    Returns:
+        tuple: (month folder, page number -> manifest entry), or (None, {})
+    """
+    tareas = list(tareas)
+    carpetas = [carpeta_mes] if carpeta_mes else carpetas_meses(config)
+    if not carpetas:
+        return None, {}
+    if pdf_hash is None:
+        try:
+            pdf_hash = hash_archivo(pdf_path)
+        except OSError:
+            return None, {}
+    opciones = opciones_preparacion(config)
+    # El lote se busca por el hash del PDF maestro en todas las carpetas:
+    # uno preparado el último día del mes se sigue usando al mes siguiente
+    for carpeta in carpetas:
+        enviados = carpetas_envio(config, crear=False, carpeta_mes=carpeta)['enviados']
+        if not os.path.isdir(enviados):
+            continue
+        preparadas = cargar_manifiesto(carpeta, pdf_hash, tareas, enviados, opciones)
+        if preparadas:
+            return carpeta, preparadas
+    return None, {}
+
+
+def nominas_ya_preparadas(pdf_path, tareas, config, pdf_hash=None, carpeta_mes=None):
+    """Return the payslips prepared earlier that can be sent as they are.
+    
+    Args:
+        pdf_path (str): Path to the master PDF file
+        tareas (iterable): Tasks about to be sent
+        config (ConfigParser): Application configuration
+        pdf_hash (str): Content hash of the master PDF, if already known
+        carpeta_mes (str): Only look in this month folder (by default the
+            newest month folder with a matching manifest is used)
+        
+    Returns:
+        dict: Page number -> manifest entry (see cargar_manifiesto())
+    """
+    return _buscar_nominas_preparadas(pdf_path, tareas, config, pdf_hash, carpeta_mes)[1]
+
+
+def ejecucion_interrumpida(pdf_path, config, pdf_hash=None):
+    """Return the interrupted run of this master PDF in any month folder, if any.
+    
+    Args:
+        pdf_path (str): Path to the master PDF file
+        config (ConfigParser): Application configuration
+        pdf_hash (str): Content hash of the master PDF, if already known
+        
+    Returns:
+        dict: Result of diario_envio.buscar_ejecucion_interrumpida(), or None
+    """
+    carpetas = carpetas_meses(config)
+    if not carpetas:
+        return None
+    if pdf_hash is None:
+        pdf_hash = hash_archivo(pdf_path)
+    return buscar_ejecucion_interrumpida(carpetas, pdf_hash)
+
+
+def _validar_destinatario(tarea):
+    """Raise ValueError if the task's email can't be used (before preparing its PDF)."""
+    if not validar_email_basico(tarea['email']):
+        raise ValueError(f"Formato de email inválido: {tarea['email']}")
+
+
+def _enviar_con_hilos(email_sender, nominas, preparar_envio, completar_envio, stop_event=None,
+                      reintentos=None, aplazar_envio=None, reintentar_envio=None):
+    """Envía las nóminas por el pool de conexiones de RobustEmailSender.
+    
+    Cada envío sale por una conexión libre del pool en un hilo aparte, con
+    como mucho un envío en curso por conexión y el mensaje siguiente ya
+    preparado esperando turno; los resultados se anotan en el hilo que
+    llama (ver MotorEnvioAsincrono.ejecutar() para el contrato de
+    ``preparar_envio``, ``completar_envio``, ``reintentos``,
+    ``aplazar_envio`` y ``reintentar_envio``).
+    """
+    en_vuelo = {}
+    num_conexiones = email_sender.num_conexiones
+    # Uno más que conexiones: mientras se espera el turno del limitador ya
+    # está preparado (PDF y mensaje) el siguiente envío
+    limite_en_vuelo = num_conexiones + 1
     
-    # 3. Encriptar PDF
-    password_autor = config.get('PDF', 'password_autor', fallback='')
-    owner_password = password_autor if password_autor else nif
+    def completar(futuro):
+        envio = en_vuelo.pop(futuro)
+        tarea, _, pdf_encriptado_path = envio
+        try:
+            futuro.result()
+        except Exception as e:
+            fallo = clasificar_fallo(e)
+            if not isinstance(e, FalloEnvio):
+                log_error(f"[ERROR] Error enviando a {tarea['email']}: {type(e).__name__}: {e}")
+                log_debug("Stack trace completo:", exc_info=True)
+            espera = reintentos.aplazar(envio, fallo) if reintentos is not None else None
+            if espera is None:
+                completar_envio(tarea, pdf_encriptado_path, False, str(fallo))
+            elif aplazar_envio:
+                aplazar_envio(tarea, str(fallo), espera)
+            return
+        completar_envio(tarea, pdf_encriptado_path, True)
     
-    log_debug(f"Encriptando PDF para {nombre}")
-    with pikepdf.open(temp_pdf_path) as pdf:
-        pdf.save(
-            pdf_encriptado_path,
-            encryption=pikepdf.Encryption(owner=owner_password, user=nif, R=4)
-        )
-    os.remove(temp_pdf_path)
+    def completar_terminados(timeout=None):
+        terminados, _ = wait(list(en_vuelo), timeout=timeout, return_when=FIRST_COMPLETED)
+        for terminado in terminados:
+            completar(terminado)
     
-    return pdf_encriptado_path
+    def enviar(envio):
+        futuro = envios.submit(email_sender.enviar_email, envio[1], envio[0]['email'])
+        en_vuelo[futuro] = envio
+        # Como mucho un envío en curso por conexión (más el siguiente en cola)
+        while len(en_vuelo) >= limite_en_vuelo:
+            completar_terminados()
+    
+    def enviar_reintentos_listos():
+        if reintentos is not None:
+            for envio in reintentos.listos():
+                if reintentar_envio is None or reintentar_envio(envio):
+                    enviar(envio)
+    
+    def cancelado():
+        return stop_event is not None and stop_event.is_set()
+    
+    with ThreadPoolExecutor(max_workers=num_conexiones, thread_name_prefix='envio_smtp') as envios:
+        # Procesar cada nómina con recuperación de errores
+        for tarea, preparada in nominas:
+            # Verificar si se debe cancelar el proceso
+            if cancelado():
+                break
+            # Los reintentos cuya espera ya venció van por delante
+            enviar_reintentos_listos()
+            envio = preparar_envio(tarea, preparada)
+            if envio is not None:
+                enviar(envio)
+        
+        # Tras la pasada principal quedan los envíos en curso y los reintentos
+        while not cancelado() and (en_vuelo or reintentos):
+            enviar_reintentos_listos()
+            espera = reintentos.espera_siguiente() if reintentos is not None else None
+            if en_vuelo:
+                completar_terminados(timeout=espera)
+            elif espera and stop_event is not None:
+                stop_event.wait(espera)
+            elif espera:
+                time.sleep(espera)
+        
+        # Los envíos ya en curso terminan (también al cancelar) y se anotan
+        while en_vuelo:
+            completar_terminados()
+    
+    # Al cancelar, los reintentos pendientes quedan como fallidos
+    if reintentos is not None:
+        for tarea, _, pdf_encriptado_path in reintentos.vaciar():
+            completar_envio(tarea, pdf_encriptado_path, False, "Envío cancelado con un reintento pendiente")
 
 
-def enviar_nominas_worker(pdf_path, tareas, config, status_callback, progress_callback, stop_event=None):
-    """Worker que procesa y envía las nóminas en un hilo separado."""
+def enviar_nominas_worker(pdf_path, tareas, config, status_callback, progress_callback, stop_event=None,
+                          reanudar=None):
+    """Worker que procesa y envía las nóminas en un hilo separado.
+    
+    Cada intento y cada resultado se anotan en el diario de la ejecución
+    (ver diario_envio). Con ``reanudar`` (resultado de
+    buscar_ejecucion_interrumpida()) se continúa esa ejecución: las tareas
+    confirmadas como enviadas no se vuelven a enviar.
+    
+    Si la cuota diaria del proveedor (ver limite_envios) no alcanza para
+    todas las nóminas, se envían las que caben y el resto se aplaza: la
+    ejecución queda en el diario para reanudarla otro día. Sin ``reanudar``,
+    una ejecución aplazada del mismo PDF (de este mes o de uno anterior) se
+    continúa igualmente en vez de volver a enviar las nóminas ya enviadas.
+    """
     log_info("Iniciando el proceso de envío de nóminas.")
     
+    # Todas las fases (envío, pendientes y reporte) leen el mismo almacén
+    if not isinstance(tareas, AlmacenTareas):
+        tareas = AlmacenTareas(tareas)
+    
     # IMPORTANTE: Siempre recargar configuración para asegurar descifrado
     from .settings import load_settings
     config_descifrada = load_settings()
@@ -375,6 +719,7 @@ def enviar_nominas_worker(pdf_path, tareas, config, status_callback, progress_ca
     }
     
     email_sender = None
+    diario = None
     try:
         email_origen = config_descifrada.get('Email', 'email_origen')
         password = config_descifrada.get('Email', 'password')
@@ -386,16 +731,40 @@ def enviar_nominas_worker(pdf_path, tareas, config, status_callback, progress_ca
             log_error("[ERROR] Credenciales de email no configuradas")
             raise ValueError("[ERROR] Credenciales de email no configuradas.")
 
-        # Inicializar cliente robusto de email
-        email_sender = RobustEmailSender(config_descifrada)
+        # El motor asyncio abre sus propias sesiones SMTP al empezar a enviar
+        motor = obtener_motor_envio(config_descifrada)
+        log_info(f"Motor de envío: {motor}")
         
-        # Establecer conexión con reintentos automáticos
-        log_info("Estableciendo conexión SMTP...")
+        # Ritmo y cuota diaria, compartidos por todas las conexiones; la cuota
+        # se guarda junto a las carpetas de nóminas para contar todo el día
+        limites = obtener_limites(config_descifrada)
+        limitador = LimitadorEnvios(
+            limites, carpeta_cuota=config_descifrada.get('Carpetas', 'salida', fallback='nominas_individuales'))
+        if limitador.activo:
+            log_info(f"Límites de envío (perfil {limites['perfil']}): {limites['por_segundo']:g}/s, "
+                     f"{limites['por_minuto']:g}/min, {limites['por_dia']}/día (0 = sin límite)")
         
-        if not email_sender.conectar(email_origen, password):
-            log_error("[ERROR] Falló la conexión SMTP después de reintentos")
-            raise ConnectionError("[ERROR] No se pudo establecer conexión SMTP después de varios intentos")
-        log_info("[OK] Conexión SMTP establecida correctamente")
+        # Ritmo y conexiones adaptativos (AIMD); cada cambio se muestra en el Paso 3
+        opciones_ritmo = obtener_control_ritmo(config_descifrada, limites)
+        controlador = ControladorRitmo(
+            opciones_ritmo, max(1, int(config_descifrada.get('SMTP', 'conexiones', fallback='1'))),
+            al_cambiar=lambda estado: status_callback("ritmo_envio", "", "info", estado))
+        stats['control_ritmo'] = controlador.resumen()
+        if controlador.activo:
+            log_info(f"Ritmo adaptativo: desde {opciones_ritmo['ritmo_inicial']:g} correos/s "
+                     f"(máximo {opciones_ritmo['ritmo_maximo']:g}, 0 = sin máximo)")
+        
+        if motor == 'hilos':
+            # Inicializar cliente robusto de email
+            email_sender = RobustEmailSender(config_descifrada, limitador, controlador)
+            
+            # Establecer conexión con reintentos automáticos
+            log_info("Estableciendo conexión SMTP...")
+            
+            if not email_sender.conectar(email_origen, password):
+                log_error("[ERROR] Falló la conexión SMTP después de reintentos")
+                raise ConnectionError("[ERROR] No se pudo establecer conexión SMTP después de varios intentos")
+            log_info("[OK] Conexión SMTP establecida correctamente")
 
         # Análisis previo de las tareas
         pre_stats = generar_estadisticas_envio(tareas)
@@ -408,26 +777,36 @@ def enviar_nominas_worker(pdf_path, tareas, config, status_callback, progress_ca
         if pre_stats['emails_duplicados'] > 0:
             log_warning(f"   [ADVERTENCIA] Emails duplicados detectados: {pre_stats['emails_duplicados']}")
 
-        doc_maestro = fitz.open(pdf_path)
-        tareas_a_enviar = [t for t in tareas if t['status'] == '[OK]']
-        # Ordenar por número de página para procesar de arriba hacia abajo
-        tareas_a_enviar.sort(key=lambda x: x['pagina'])
+        # El almacén ya está en orden de página: se procesa de arriba hacia abajo
+        tareas_a_enviar = tareas.listas()
         
+        # Resultado de cada tarea por página: fuente única para pendientes y reportes
+        registro = RegistroEnvio(tareas_a_enviar)
+        stats['registro'] = registro
         stats['total'] = len(tareas_a_enviar)
         log_info(f"Iniciando procesamiento de {stats['total']} nóminas.")
         
-        # Crear estructura organizada por mes/año
-        base_dir = config_descifrada.get('Carpetas', 'salida', fallback='nominas_individuales')
-        fecha_actual = datetime.now()
-        
-        # Carpeta principal: nominas_2025_09/
-        carpeta_mes = os.path.join(base_dir, f"nominas_{fecha_actual.year}_{fecha_actual.month:02d}")
-        
-        # Subcarpetas para PDFs enviados y pendientes
-        output_dir_enviados = os.path.join(carpeta_mes, "pdfs_enviados")
-        output_dir_pendientes = os.path.join(carpeta_mes, "pdfs_pendientes")
-        os.makedirs(output_dir_enviados, exist_ok=True)
-        os.makedirs(output_dir_pendientes, exist_ok=True)
+        # Crear estructura organizada por mes/año; una ejecución reanudada
+        # sigue en la carpeta de su diario y un lote ya preparado se envía
+        # desde la carpeta de su manifiesto aunque haya cambiado el mes
+        pdf_hash = hash_archivo(pdf_path)
+        if not reanudar:
+            # Un envío aplazado por la cuota el último día del mes tiene el
+            # diario en la carpeta del mes anterior: se continúa igualmente
+            aplazada = buscar_ejecucion_interrumpida(carpetas_meses(config_descifrada), pdf_hash)
+            if aplazada and aplazada['aplazada']:
+                log_warning(f"[ADVERTENCIA] El envío {aplazada['ejecucion']} de este PDF quedó aplazado "
+                            f"por la cuota diaria: se continúa en {os.path.dirname(aplazada['ruta'])}")
+                reanudar = aplazada
+        if reanudar:
+            carpeta_mes = os.path.dirname(reanudar['ruta'])
+        else:
+            carpeta_mes, _ = _buscar_nominas_preparadas(
+                pdf_path, tareas_a_enviar, config_descifrada, pdf_hash)
+        carpetas = carpetas_envio(config_descifrada, carpeta_mes=carpeta_mes)
+        carpeta_mes = carpetas['carpeta_mes']
+        output_dir_enviados = carpetas['enviados']
+        output_dir_pendientes = carpetas['pendientes']
         
         # DEBUG: Verificar que las carpetas se crearon
         log_info(f"[DEBUG] Carpeta enviados creada: {os.path.exists(output_dir_enviados)}")
@@ -452,111 +831,210 @@ def enviar_nominas_worker(pdf_path, tareas, config, status_callback, progress_ca
         except Exception as e:
             log_error(f"[ERROR] Error al copiar PDF original: {e}")
 
-        # Procesar cada nómina con recuperación de errores
-        for i, tarea in enumerate(tareas_a_enviar):
-            # Verificar si se debe cancelar el proceso
-            if stop_event and stop_event.is_set():
-                log_info("[CANCELADO] Proceso de envío cancelado por el usuario.")
-                status_callback("proceso_cancelado", "Proceso cancelado", "cancelled")
-                break
-                
+        # Diario de la ejecución: permite reanudar tras una caída sin duplicar envíos
+        if reanudar:
+            diario = DiarioEnvio.continuar(reanudar)
+            log_info(f"Reanudando la ejecución {diario.id_ejecucion}")
+        else:
+            diario = DiarioEnvio.crear(carpeta_mes, pdf_path, pdf_hash, stats['total'])
+            log_info(f"Diario de la ejecución: {diario.ruta}")
+        stats['id_ejecucion'] = diario.id_ejecucion
+        
+        # Las ya enviadas antes de la interrupción cuentan como enviadas
+        pendientes_envio = []
+        for tarea in tareas_a_enviar:
+            if ya_enviada(reanudar, tarea):
+                enviada = reanudar['enviadas'][tarea['pagina']]
+                registro.enviado(tarea['pagina'], enviada['archivo'], fecha_registro(enviada))
+                status_callback(f"pagina_{tarea['pagina']}", "SUCCESS", "sent")
+            else:
+                pendientes_envio.append(tarea)
+        ya_enviadas = stats['total'] - len(pendientes_envio)
+        if ya_enviadas:
+            log_info(f"Nóminas ya enviadas en la ejecución interrumpida (se omiten): {ya_enviadas}")
+        
+        # Lo que no cabe en la cuota diaria se aplaza en vez de fallar
+        cupo_hoy = limitador.cupo_restante_hoy()
+        aplazadas = []
+        if cupo_hoy is not None and cupo_hoy < len(pendientes_envio):
+            pendientes_envio, aplazadas = pendientes_envio[:cupo_hoy], pendientes_envio[cupo_hoy:]
+            log_warning(f"[ADVERTENCIA] La cuota diaria solo permite {cupo_hoy} envíos más hoy: "
+                        f"se aplazan {len(aplazadas)} nóminas")
+        stats['aplazadas'] = len(aplazadas)
+        
+        # Las nóminas ya preparadas con "Preparar PDFs" solo se adjuntan
+        preparadas = nominas_ya_preparadas(
+            pdf_path, pendientes_envio, config_descifrada, pdf_hash=pdf_hash, carpeta_mes=carpeta_mes)
+        if preparadas:
+            log_info(f"Nóminas ya preparadas que se enviarán sin volver a cifrar: {len(preparadas)}")
+        
+        # Los PDFs cifrados se preparan por adelantado (en un pool de procesos
+        # si compensa) mientras se envían los ya listos, en el mismo orden
+        nominas_preparadas = iterar_nominas_preparadas(
+            pdf_path, pendientes_envio, output_dir_enviados, config_descifrada,
+            cancelar=stop_event, validar=_validar_destinatario, preparadas=preparadas)
+        
+        # Los resultados se anotan siempre en este hilo (registro y diario no
+        # se comparten entre hilos), sea cual sea el motor de envío
+        completadas = [ya_enviadas]
+        procesadas = [ya_enviadas]
+        
+        def anotar_error(tarea, error_msg, pdf_path_error=None):
+            diario.resultado(tarea, ESTADO_ERROR,
+                             os.path.basename(pdf_path_error) if pdf_path_error else None, error_msg)
+            registro.fallido(tarea['pagina'], error_msg,
+                             os.path.basename(pdf_path_error) if pdf_path_error else None)
+            status_callback(f"pagina_{tarea['pagina']}", f"ERROR: {error_msg}", "error")
+        
+        def aplazar_por_cuota(tarea):
+            """Aplaza una tarea que ya no cabe en la cuota diaria."""
+            aplazadas.append(tarea)
+            log_warning(f"[ADVERTENCIA] Cuota diaria agotada: se aplaza el envío a {tarea['email']}")
+            status_callback(f"pagina_{tarea['pagina']}", "Aplazada (cuota diaria agotada)", "deferred")
+        
+        def avanzar_progreso():
+            completadas[0] += 1
+            progress_callback(completadas[0] / stats['total'] * 100)
+        
+        def preparar_envio(tarea, preparada):
+            """Crea el mensaje de una nómina preparada; None si la tarea ya falló."""
             nombre = tarea['nombre']
-            nif = tarea['nif']
             email_destino = tarea['email']
             apellidos_empleado = tarea.get('apellidos', '')
+            pagina = tarea['pagina']
             
-            log_info(f"Procesando {i+1}/{stats['total']}: {nombre} -> {email_destino}")
+            procesadas[0] += 1
+            log_info(f"Procesando {procesadas[0]}/{stats['total']}: {nombre} -> {email_destino}")
             
-            tarea_exitosa = False
-            error_msg = ""
+            pdf_encriptado_path = None
+            registro.iniciar(pagina)
             
             try:
-                # Capturar tiempo de inicio del procesamiento
-                tiempo_procesamiento = datetime.now()
-                status_callback(f"pagina_{tarea['pagina']}", "Procesando PDF...", "processing")
-                
-                # 1. Validar email antes de procesar
-                if not validar_email_basico(email_destino):
-                    raise ValueError(f"Formato de email inválido: {email_destino}")
+                status_callback(f"pagina_{pagina}", "Procesando PDF...", "processing")
                 
-                # 2. Procesar PDF individual (cifrado para envío)
-                pdf_encriptado_path = procesar_pdf_individual(doc_maestro, tarea, output_dir_enviados, config_descifrada)
+                # 1-2. Email validado y PDF individual cifrado en la etapa de preparación
+                if isinstance(preparada, Exception):
+                    raise preparada
+                pdf_encriptado_path, contenido_pdf, tamano_original = preparada
+                registrar_tamano_adjunto(stats, tarea, tamano_original, len(contenido_pdf))
                 
                 # 3. Preparar email
-                status_callback(f"pagina_{tarea['pagina']}", "Enviando email...", "processing")
-                
                 msg = crear_mensaje_email(config_descifrada, email_origen, email_destino, 
-                                        nombre, apellidos_empleado, pdf_encriptado_path)
-                
-                # 4. Enviar con reintentos automáticos
-                envio_exitoso = email_sender.enviar_email(msg, email_destino)
-                if envio_exitoso:
-                    # Éxito - MANTENER el PDF para archivo
-                    status_callback(f"pagina_{tarea['pagina']}", "SUCCESS", "sent")
-                    stats['enviados'] += 1
-                    log_info(f"Email enviado exitosamente a {email_destino} (total enviados: {stats['enviados']})")
-                    tarea_exitosa = True
-                    # Guardar tiempo de envío exitoso
-                    tarea['fecha_procesamiento'] = tiempo_procesamiento.strftime('%Y-%m-%d %H:%M:%S')
-                else:
-                    # Error en envío (ya reintentado automáticamente)
-                    error_msg = f"Fallo en envío después de reintentos"
-                    stats['errores'] += 1
-                    # Mantener PDF para inspección manual
-                    log_error(f"Email fallido a {email_destino} (total errores: {stats['errores']})")
-                    # Guardar tiempo de intento fallido
-                    tarea['fecha_procesamiento'] = tiempo_procesamiento.strftime('%Y-%m-%d %H:%M:%S')
-                    
-                    # Agregar a lista de errores
-                    stats['errores_lista'].append({
-                        'nombre': nombre,
-                        'email': email_destino,
-                        'error': error_msg
-                    })
+                                        nombre, apellidos_empleado, pdf_encriptado_path,
+                                        contenido_pdf)
                 
             except Exception as e:
                 # Error en procesamiento del PDF o preparación del email
                 error_msg = f"{type(e).__name__}: {str(e)[:100]}"
-                stats['errores'] += 1
                 log_error(f"[ERROR] Error procesando {nombre}: {error_msg}")
                 log_debug("Stack trace completo:", exc_info=True)
                 
-                # Guardar tiempo de error también
-                if 'tiempo_procesamiento' not in locals():
-                    tiempo_procesamiento = datetime.now()
-                tarea['fecha_procesamiento'] = tiempo_procesamiento.strftime('%Y-%m-%d %H:%M:%S')
-                
                 # Limpiar archivos temporales en caso de error
                 try:
-                    if 'pdf_encriptado_path' in locals() and os.path.exists(pdf_encriptado_path):
+                    if pdf_encriptado_path and os.path.exists(pdf_encriptado_path):
                         os.remove(pdf_encriptado_path)
                 except:
                     pass
+                anotar_error(tarea, error_msg)
+                avanzar_progreso()
+                return None
             
-            # Actualizar estado final
-            if not tarea_exitosa:
-                status_callback(f"pagina_{tarea['pagina']}", f"ERROR: {error_msg}", "error")
-                # Si no se agregó ya a la lista de errores, agregarlo ahora
-                if not any(err['email'] == email_destino and err['nombre'] == nombre for err in stats['errores_lista']):
-                    stats['errores_lista'].append({
-                        'nombre': nombre,
-                        'email': email_destino,
-                        'error': error_msg
-                    })
-            
-            # Actualizar progreso
-            progress_callback((i + 1) / stats['total'] * 100)
+            # 4. Cuenta para la cuota diaria (si se agotó, se aplaza) y el
+            # intento queda en disco antes de enviar
+            if not limitador.tomar_cupo_diario():
+                if pagina not in preparadas:
+                    try:
+                        os.remove(pdf_encriptado_path)
+                    except OSError:
+                        pass
+                aplazar_por_cuota(tarea)
+                avanzar_progreso()
+                return None
+            status_callback(f"pagina_{pagina}", "Enviando email...", "processing")
+            diario.intento(tarea)
+            return tarea, msg, pdf_encriptado_path
+        
+        def completar_envio(tarea, pdf_encriptado_path, envio_exitoso, error=None):
+            """Anota el resultado definitivo de un envío."""
+            email_destino = tarea['email']
+            if envio_exitoso:
+                # Éxito - MANTENER el PDF para archivo
+                diario.resultado(tarea, ESTADO_ENVIADO, os.path.basename(pdf_encriptado_path))
+                registro.enviado(tarea['pagina'], os.path.basename(pdf_encriptado_path))
+                status_callback(f"pagina_{tarea['pagina']}", "SUCCESS", "sent")
+                log_info(f"Email enviado exitosamente a {email_destino} "
+                         f"(total enviados: {registro.contadores[ESTADO_ENVIADO]})")
+            else:
+                # Rechazo permanente o sin más reintentos
+                # Mantener PDF para inspección manual
+                anotar_error(tarea, error or "Fallo en envío después de reintentos", pdf_encriptado_path)
+                log_error(f"Email fallido a {email_destino} "
+                          f"(total errores: {registro.contadores[ESTADO_ERROR]})")
+            avanzar_progreso()
+        
+        # Los fallos temporales se reintentan más tarde sin bloquear al resto
+        reintentos = ColaReintentos(opciones_reintento(config_descifrada))
+        
+        def reintentar_envio(envio):
+            """Anota en el diario el reintento de un envío aplazado; False si no debe salir."""
+            tarea = envio[0]
+            # Cada reintento es otro correo para la cuota diaria
+            if not limitador.tomar_cupo_diario():
+                aplazar_por_cuota(tarea)
+                avanzar_progreso()
+                return False
+            status_callback(f"pagina_{tarea['pagina']}", "Reintentando envío...", "processing")
+            diario.intento(tarea)
+            return True
+        
+        def aplazar_envio(tarea, error, espera):
+            """Anota que un envío con un fallo temporal se reintentará más tarde."""
+            log_warning(f"[ADVERTENCIA] Reintento de {tarea['email']} en {espera:.0f}s: {error}")
+            status_callback(f"pagina_{tarea['pagina']}", f"Reintento en {espera:.0f}s...", "processing")
+        
+        if motor == 'asyncio':
+            # Todas las sesiones SMTP en un bucle asyncio; la preparación, en un executor
+            MotorEnvioAsincrono(config_descifrada, email_origen, password, limitador,
+                                controlador).ejecutar(
+                nominas_preparadas, preparar_envio, completar_envio, stop_event,
+                reintentos, aplazar_envio, reintentar_envio)
+        else:
+            _enviar_con_hilos(email_sender, nominas_preparadas, preparar_envio, completar_envio,
+                              stop_event, reintentos, aplazar_envio, reintentar_envio)
+        stats['reintentos_aplazados'] = reintentos.aplazados
+        stats['aplazadas'] = len(aplazadas)
+        stats['paginas_aplazadas'] = {tarea['pagina'] for tarea in aplazadas}
+        
+        # Detiene el pool de preparación si el bucle terminó antes (cancelación)
+        nominas_preparadas.close()
+        
+        # Las estadísticas salen del registro de resultados
+        stats['control_ritmo'] = controlador.resumen()
+        stats['enviados'] = registro.contadores[ESTADO_ENVIADO]
+        stats['errores'] = registro.contadores[ESTADO_ERROR]
+        stats['errores_lista'] = registro.errores(tareas_a_enviar)
+        cancelado = bool(stop_event and stop_event.is_set())
+        aplazado = bool(aplazadas) and not cancelado
+        # Una ejecución terminada (o cancelada por el usuario) no se ofrece para
+        # reanudar; una aplazada por la cuota diaria sí
+        diario.finalizar(stats['enviados'], stats['errores'], cancelado, aplazado)
+        if cancelado:
+            log_info("[CANCELADO] Proceso de envío cancelado por el usuario.")
+            status_callback("proceso_cancelado", "Proceso cancelado", "cancelled")
+        elif aplazado:
+            log_warning(f"[ADVERTENCIA] Cuota diaria agotada: {len(aplazadas)} nóminas aplazadas")
+            status_callback("envio_aplazado",
+                            f"Se ha agotado la cuota diaria de envíos del proveedor. Quedan "
+                            f"{len(aplazadas)} nóminas por enviar: vuelva a cargar el mismo PDF "
+                            f"otro día para reanudar el envío.", "deferred")
 
         # Cerrar conexión de forma segura
         if email_sender:
             email_sender.cerrar()
         
         # Generar PDFs pendientes para procesamiento manual
-        _generar_pdfs_pendientes(doc_maestro, tareas, output_dir_pendientes, config_descifrada, stats)
-        
-        # Cerrar documento PDF maestro
-        if doc_maestro:
-            doc_maestro.close()
+        _generar_pdfs_pendientes(pdf_path, tareas, registro, output_dir_pendientes,
+                                 config_descifrada, stats, stats['paginas_aplazadas'])
         
         # Resumen final
         log_info("=" * 50)
@@ -564,6 +1042,22 @@ def enviar_nominas_worker(pdf_path, tareas, config, status_callback, progress_ca
         log_info(f"   Total procesadas: {stats['total']}")
         log_info(f"   [OK] Enviadas exitosamente: {stats['enviados']}")
         log_info(f"   [ERROR] Con errores: {stats['errores']}")
+        if stats['aplazadas']:
+            log_info(f"   [INFO] Aplazadas por la cuota diaria: {stats['aplazadas']}")
+        if stats['reintentos_aplazados']:
+            log_info(f"   [INFO] Reintentos aplazados por fallos temporales: {stats['reintentos_aplazados']}")
+        ritmo = stats['control_ritmo']
+        if ritmo['adaptativo']:
+            log_info(f"   [INFO] Ritmo final: {ritmo['ritmo_final']:g} correos/s con "
+                     f"{ritmo['conexiones_finales']} conexiones (máximo alcanzado "
+                     f"{ritmo['ritmo_maximo_alcanzado']:g}/s)")
+        if ritmo['limitaciones'] or ritmo['picos_latencia']:
+            log_info(f"   [INFO] Respuestas de limitación: {ritmo['limitaciones']}, "
+                     f"picos de latencia: {ritmo['picos_latencia']}")
+        if stats.get('bytes_adjuntos'):
+            log_info(
+                f"   [INFO] Tamaño de los adjuntos: {stats['bytes_adjuntos'] / 1024:.1f} KB "
+                f"(ahorrados {stats['bytes_ahorrados'] / 1024:.1f} KB con la optimización)")
         
         # Información sobre PDFs pendientes
         pdfs_pendientes = stats.get('pdfs_pendientes_generados', 0)
@@ -607,99 +1101,123 @@ def enviar_nominas_worker(pdf_path, tareas, config, status_callback, progress_ca
             pass
             
     finally:
+        if diario:
+            diario.cerrar()
         # Asegurar que se complete el progreso
         progress_callback(-1)
 
 
-def _generar_pdfs_pendientes(doc_maestro, tareas, output_dir_pendientes, config, stats):
-    """Genera PDFs sin cifrado para tareas que no se enviaron exitosamente."""
-    # DEBUG: Mostrar información de todas las tareas
-    log_info(f"[DEBUG] Total de tareas recibidas: {len(tareas)}")
-    log_info(f"[DEBUG] Stats enviados: {stats.get('enviados', 0)}")
-    log_info(f"[DEBUG] Stats errores: {stats.get('errores', 0)}")
-    log_info(f"[DEBUG] Stats total: {stats.get('total', 0)}")
+def preparar_nominas_worker(pdf_path, tareas, config, status_callback, progress_callback,
+                            stop_event=None):
+    """Worker que solo prepara las nóminas cifradas, para enviarlas más tarde.
     
-    # Filtrar tareas que ESTABAN listas para enviar pero NO se enviaron exitosamente
-    tareas_listas = [t for t in tareas if t['status'] == '[OK]']  # Las que podían enviarse
+    Genera en la carpeta de enviados del mes todos los PDFs cifrados de las
+    tareas listas y un manifiesto con el archivo, el destinatario y el hash
+    de cada uno. El envío posterior (enviar_nominas_worker) adjunta esos
+    archivos sin volver a separarlos ni cifrarlos.
     
-    # Contar PDFs realmente creados en carpeta enviados (más preciso que stats)
-    carpeta_enviados = stats.get('carpeta_pdfs_enviados', '')
-    pdfs_ya_creados = 0
-    if os.path.exists(carpeta_enviados):
-        pdfs_ya_creados = len([f for f in os.listdir(carpeta_enviados) if f.endswith('.pdf')])
+    Usa el mismo contrato de callbacks que enviar_nominas_worker; al terminar
+    llama a ``status_callback("preparacion_finalizada", "", "completed", stats)``.
+    """
+    log_info("Iniciando la preparación de nóminas (sin envío).")
+    if not isinstance(tareas, AlmacenTareas):
+        tareas = AlmacenTareas(tareas)
     
-    log_info(f"[DEBUG] Tareas listas para envío: {len(tareas_listas)}")
-    log_info(f"[DEBUG] PDFs ya creados físicamente: {pdfs_ya_creados}")
-    log_info(f"[DEBUG] Stats enviados (solo emails): {stats.get('enviados', 0)}")
+    from .settings import load_settings
+    config_descifrada = load_settings()
     
-    # Las pendientes son las que estaban OK pero no tienen PDF creado
-    tareas_pendientes = tareas_listas[pdfs_ya_creados:]  # Las que no se procesaron
+    stats = {'total': 0, 'preparadas': 0, 'errores': 0, 'errores_lista': []}
+    try:
+        tareas_a_preparar = tareas.listas()
+        stats['total'] = len(tareas_a_preparar)
+        carpetas = carpetas_envio(config_descifrada)
+        stats['carpeta_mes'] = carpetas['carpeta_mes']
+        stats['carpeta_pdfs_enviados'] = carpetas['enviados']
+        
+        pdf_hash = hash_archivo(pdf_path)
+        registro = RegistroEnvio(tareas_a_preparar)
+        stats['registro'] = registro
+        entradas = []
+        nominas_preparadas = iterar_nominas_preparadas(
+            pdf_path, tareas_a_preparar, carpetas['enviados'], config_descifrada,
+            cancelar=stop_event, validar=_validar_destinatario)
+        for i, (tarea, preparada) in enumerate(nominas_preparadas):
+            clave = f"pagina_{tarea['pagina']}"
+            if isinstance(preparada, Exception):
+                error_msg = f"{type(preparada).__name__}: {str(preparada)[:100]}"
+                registro.fallido(tarea['pagina'], error_msg)
+                log_error(f"[ERROR] Error preparando {tarea['nombre']}: {error_msg}")
+                status_callback(clave, f"ERROR: {error_msg}", "error")
+            else:
+                ruta, contenido, tamano_original = preparada
+                registrar_tamano_adjunto(stats, tarea, tamano_original, len(contenido))
+                entradas.append(entrada_manifiesto(tarea, ruta, contenido, tamano_original))
+                registro.preparado(tarea['pagina'], os.path.basename(ruta))
+                status_callback(clave, os.path.basename(ruta), "prepared")
+            progress_callback((i + 1) / stats['total'] * 100)
+        nominas_preparadas.close()
+        stats['preparadas'] = registro.contadores[ESTADO_PREPARADO]
+        stats['errores'] = registro.contadores[ESTADO_ERROR]
+        stats['errores_lista'] = registro.errores(tareas_a_preparar)
+        
+        if stop_event and stop_event.is_set():
+            log_info("[CANCELADO] Preparación de nóminas cancelada por el usuario.")
+        
+        # Aunque se cancele, las ya preparadas quedan en el manifiesto
+        stats['manifiesto'] = guardar_manifiesto(
+            carpetas['carpeta_mes'], pdf_path, pdf_hash, entradas,
+            opciones_preparacion(config_descifrada))
+        log_info(
+            f"[OK] Nóminas preparadas: {stats['preparadas']}/{stats['total']} "
+            f"(manifiesto: {stats['manifiesto']})")
+        status_callback("preparacion_finalizada", "", "completed", stats)
     
-    # También agregar las que tenían errores originales para procesamiento manual
-    tareas_con_errores = [t for t in tareas if t['status'] != '[OK]']
-    tareas_pendientes.extend(tareas_con_errores)
+    except Exception as e:
+        log_error(f"[ERROR] Error crítico preparando nóminas: {type(e).__name__}: {e}")
+        log_debug("Stack trace crítico:", exc_info=True)
+        status_callback("error_general", f"Error crítico: {str(e)[:100]}", "error")
     
-    log_info(f"[DEBUG] Tareas filtradas como pendientes: {len(tareas_pendientes)}")
-    if tareas_pendientes:
-        log_info("[DEBUG] Ejemplos de tareas pendientes:")
-        for i, tarea in enumerate(tareas_pendientes[:3]):
-            log_info(f"[DEBUG]   - Página {tarea.get('pagina', 'N/A')}: {tarea['status']}")
+    finally:
+        progress_callback(-1)
+
+
+def _generar_pdfs_pendientes(pdf_path, tareas, registro, output_dir_pendientes, config, stats,
+                             paginas_aplazadas=()):
+    """Genera PDFs sin cifrado para las tareas que no se enviaron.
+    
+    Las pendientes son las tareas listas cuyo resultado en el registro no es
+    "enviado" (fallidas o no procesadas por una cancelación) más las que ya
+    tenían errores en el análisis. Las aplazadas por la cuota diaria
+    (``paginas_aplazadas``) no: se enviarán al reanudar la ejecución.
+    """
+    tareas_pendientes = [
+        tarea for tarea in tareas.listas()
+        if not registro.enviada(tarea['pagina']) and tarea['pagina'] not in paginas_aplazadas]
+    tareas_pendientes.extend(tareas.pendientes())
     
     if not tareas_pendientes:
         log_info("[OK] No hay PDFs pendientes para generar")
         return
     
     log_info(f"Generando {len(tareas_pendientes)} PDFs pendientes (sin cifrar)...")
-    log_info(f"[DEBUG] Directorio destino: {output_dir_pendientes}")
     pdfs_creados = 0
     
     try:
-        for i, tarea in enumerate(tareas_pendientes):
+        doc_maestro = fitz.open(pdf_path)
+    except Exception as e:
+        log_error(f"[ERROR] Error general generando PDFs pendientes: {e}")
+        return
+    
+    try:
+        for tarea in tareas_pendientes:
             try:
-                log_info(f"[DEBUG] Procesando tarea pendiente {i+1}/{len(tareas_pendientes)}")
-                
-                # Generar UUIDs para nombre y apellido
-                uuid_nombre = generar_uuid_corto()
-                uuid_apellido = generar_uuid_corto()
-                log_info(f"[DEBUG] UUIDs generados: {uuid_nombre}_{uuid_apellido}")
-                
-                # Generar nombre de archivo con UUIDs
-                plantilla_archivo = config.get('Formato', 'archivo_nomina', 
-                                              fallback='{nombre}_{apellido}_Nomina_{mes}_{año}.pdf')
-                nombre_archivo = generar_nombre_archivo(plantilla_archivo, uuid_nombre, uuid_apellido)
-                log_info(f"[DEBUG] Nombre archivo: {nombre_archivo}")
-                
-                # Crear PDF individual SIN cifrado
-                ruta_pdf = os.path.join(output_dir_pendientes, nombre_archivo)
-                log_info(f"[DEBUG] Ruta completa: {ruta_pdf}")
-                
-                # Usar fitz para crear el PDF individual
-                import fitz
-                doc_individual = fitz.open()
-                log_info(f"[DEBUG] Insertando página {tarea['pagina']} (índice {tarea['pagina'] - 1})")
-                doc_individual.insert_pdf(doc_maestro, from_page=tarea['pagina'] - 1, to_page=tarea['pagina'] - 1)
-                
-                # Guardar SIN contraseñas de apertura o edición
-                doc_individual.save(ruta_pdf)
-                doc_individual.close()
-                
-                # Verificar que el archivo se creó
-                if os.path.exists(ruta_pdf):
-                    tamaño = os.path.getsize(ruta_pdf)
-                    log_info(f"[DEBUG] Archivo creado exitosamente: {tamaño} bytes")
-                else:
-                    log_error(f"[ERROR] El archivo no se creó: {ruta_pdf}")
-                    continue
-                
+                procesar_pdf_pendiente(doc_maestro, tarea, output_dir_pendientes, config)
                 pdfs_creados += 1
-                log_info(f"[OK] PDF pendiente: {nombre_archivo} (Página {tarea['pagina']}, Motivo: {tarea['status']})")
-                
             except Exception as e:
                 log_error(f"[ERROR] Error creando PDF pendiente para página {tarea['pagina']}: {e}")
                 log_debug("Stack trace del error:", exc_info=True)
-                
-    except Exception as e:
-        log_error(f"[ERROR] Error general generando PDFs pendientes: {e}")
+    finally:
+        doc_maestro.close()
     
     # Actualizar estadísticas
     stats['pdfs_pendientes_generados'] = pdfs_creados
@@ -707,4 +1225,4 @@ def _generar_pdfs_pendientes(doc_maestro, tareas, output_dir_pendientes, config,
     log_info(f"[OK] PDFs pendientes generados: {pdfs_creados}/{len(tareas_pendientes)}")
     if pdfs_creados > 0:
         log_info(f"[OK] Ubicación: {output_dir_pendientes}")
-        log_info("[INFO] Estos PDFs NO tienen cifrado para facilitar el procesamiento manual")
\ No newline at end of file
+        log_info("[INFO] Estos PDFs NO tienen cifrado para facilitar el procesamiento manual")
@@ -0,0 +1,442 @@
+"""
+Motor de envío asíncrono ([SMTP] motor = asyncio).
+
+Un único hilo con un bucle asyncio mantiene varias sesiones SMTP abiertas
+a la vez (una por ``[SMTP] conexiones``), escritas sobre los streams de
+asyncio de la librería estándar, con STARTTLS y AUTH. Las esperas de red,
+los reintentos y las reconexiones de una sesión no paran a las demás, y la
+preparación de los PDFs (bloqueante) se ejecuta en un executor mientras
+tanto.
+
+Las reglas son las mismas que las de RobustEmailSender: cada envío se
+intenta una vez (reconectando si el servidor había cortado la conexión),
+si el servidor pide ir más despacio se avisa al controlador de ritmo y los
+fallos temporales pasan a la cola de reintentos aplazados (ver
+reintentos_envio).
+"""
+import asyncio
+import base64
+import re
+import socket
+import ssl
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import getaddresses
+
+from .control_ritmo import (
+    ControladorRitmo, es_limitacion, es_respuesta_destinatario, obtener_control_ritmo, respuesta_smtp
+)
+from .limite_envios import LimitadorEnvios, obtener_limites
+from .reintentos_envio import FalloEnvio, clasificar_fallo
+from utils.logger import log_info, log_error, log_warning, log_debug
+
+
+MOTORES_ENVIO = ('hilos', 'asyncio')
+
+# Marca de fin de la cola de envíos
+_FIN = object()
+
+
+def obtener_motor_envio(config):
+    """Return the sending engine set in ``[SMTP] motor`` ('hilos' or 'asyncio')."""
+    motor = config.get('SMTP', 'motor', fallback='hilos').strip().lower()
+    return motor if motor in MOTORES_ENVIO else 'hilos'
+
+
+class ErrorRespuestaSMTP(Exception):
+    """El servidor respondió con un código distinto del esperado."""
+
+    def __init__(self, codigo, mensaje, comando=''):
+        super().__init__(f"{codigo} {mensaje}")
+        self.codigo = codigo
+        self.mensaje = mensaje
+        self.comando = comando
+
+
+class CierreSMTP(ConnectionResetError):
+    """El servidor respondió 421: va a cerrar la conexión."""
+
+    def __init__(self, mensaje):
+        super().__init__(f"421 {mensaje}")
+        self.codigo = 421
+        self.mensaje = mensaje
+
+
+class SesionSMTP:
+    """Una conexión SMTP sobre streams de asyncio."""
+
+    def __init__(self, servidor, puerto, timeout):
+        self.servidor = servidor
+        self.puerto = puerto
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._extensiones = {}
+
+    @property
+    def abierta(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _leer_respuesta(self):
+        """Read a (possibly multi-line) reply, returning (code, text)."""
+        lineas = []
+        while True:
+            linea = await asyncio.wait_for(self._reader.readline(), self.timeout)
+            if not linea:
+                raise ConnectionResetError("El servidor cerró la conexión")
+            linea = linea.decode('utf-8', errors='replace').rstrip('\r\n')
+            lineas.append(linea[4:])
+            if len(linea) < 4 or linea[3] != '-':
+                try:
+                    return int(linea[:3]), '\n'.join(lineas)
+                except ValueError:
+                    raise ErrorRespuestaSMTP(0, linea)
+
+    async def _comando(self, comando, esperados=(250,), ocultar=False):
+        """Send a command and check the reply code."""
+        self._writer.write(comando.encode('utf-8') + b'\r\n')
+        await asyncio.wait_for(self._writer.drain(), self.timeout)
+        codigo, mensaje = await self._leer_respuesta()
+        if codigo == 421:
+            # El servidor va a cerrar la conexión
+            raise CierreSMTP(mensaje)
+        if codigo not in esperados:
+            raise ErrorRespuestaSMTP(codigo, mensaje, '***' if ocultar else comando.split(' ')[0])
+        return codigo, mensaje
+
+    async def _ehlo(self):
+        _, mensaje = await self._comando('EHLO nominas')
+        self._extensiones = {}
+        for linea in mensaje.split('\n')[1:]:
+            partes = linea.strip().split(' ', 1)
+            self._extensiones[partes[0].upper()] = partes[1] if len(partes) > 1 else ''
+
+    async def _starttls(self):
+        await self._comando('STARTTLS', (220,))
+        contexto = ssl.create_default_context()
+        if hasattr(self._writer, 'start_tls'):
+            # Python 3.11+
+            await self._writer.start_tls(contexto, server_hostname=self.servidor)
+        else:
+            loop = asyncio.get_running_loop()
+            transporte = self._writer.transport
+            transporte_tls = await loop.start_tls(
+                transporte, transporte.get_protocol(), contexto, server_hostname=self.servidor)
+            self._writer._transport = transporte_tls
+            self._reader._transport = transporte_tls
+
+    async def _autenticar(self, usuario, password):
+        metodos = self._extensiones.get('AUTH', '').upper().split()
+        if 'PLAIN' in metodos or 'LOGIN' not in metodos:
+            credencial = base64.b64encode(f"\0{usuario}\0{password}".encode('utf-8')).decode('ascii')
+            await self._comando(f"AUTH PLAIN {credencial}", (235,), ocultar=True)
+        else:
+            await self._comando('AUTH LOGIN', (334,))
+            await self._comando(
+                base64.b64encode(usuario.encode('utf-8')).decode('ascii'), (334,), ocultar=True)
+            await self._comando(
+                base64.b64encode(password.encode('utf-8')).decode('ascii'), (235,), ocultar=True)
+
+    async def abrir(self, usuario, password):
+        """Connect, switch to TLS and log in.
+
+        Raises:
+            ErrorRespuestaSMTP: If the server rejects a step (535 = bad credentials)
+            OSError: If the connection fails
+        """
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.servidor, self.puerto), self.timeout)
+        codigo, mensaje = await self._leer_respuesta()
+        if codigo != 220:
+            raise ErrorRespuestaSMTP(codigo, mensaje, 'saludo')
+        await self._ehlo()
+        await self._starttls()
+        await self._ehlo()
+        await self._autenticar(usuario, password)
+
+    async def enviar(self, msg):
+        """Send an email.message.Message through the open session."""
+        remitente = getaddresses(msg.get_all('From', []))[0][1]
+        destinatarios = [
+            direccion for _, direccion in getaddresses(
+                msg.get_all('To', []) + msg.get_all('Cc', []) + msg.get_all('Bcc', []))
+        ]
+        await self._comando(f"MAIL FROM:<{remitente}>")
+        for destinatario in destinatarios:
+            await self._comando(f"RCPT TO:<{destinatario}>", (250, 251))
+        await self._comando('DATA', (354,))
+
+        del msg['Bcc']
+        datos = msg.as_bytes(policy=msg.policy.clone(linesep='\r\n'))
+        # Las líneas que empiezan por punto se duplican (RFC 5321, 4.5.2)
+        datos = re.sub(rb'(?m)^\.', b'..', datos)
+        if not datos.endswith(b'\r\n'):
+            datos += b'\r\n'
+        self._writer.write(datos + b'.\r\n')
+        await asyncio.wait_for(self._writer.drain(), self.timeout)
+        codigo, mensaje = await self._leer_respuesta()
+        if codigo == 421:
+            raise CierreSMTP(mensaje)
+        if codigo != 250:
+            raise ErrorRespuestaSMTP(codigo, mensaje, 'DATA')
+
+    async def cerrar(self):
+        """Say QUIT and close the connection, ignoring errors."""
+        if self._writer is None:
+            return
+        try:
+            if self.abierta:
+                await self._comando('QUIT', (221,))
+        except Exception:
+            pass
+        try:
+            self._writer.close()
+            await asyncio.wait_for(self._writer.wait_closed(), self.timeout)
+        except Exception:
+            pass
+        self._writer = None
+        self._reader = None
+
+
+class MotorEnvioAsincrono:
+    """Envía los correos de una ejecución con varias sesiones SMTP asíncronas."""
+
+    def __init__(self, config, email_origen, password, limitador=None, controlador=None):
+        self.servidor_smtp = config.get('SMTP', 'servidor', fallback='smtp.gmail.com')
+        self.puerto_smtp = int(config.get('SMTP', 'puerto', fallback='587'))
+        self.timeout = int(config.get('SMTP', 'timeout', fallback='30'))
+        self.max_reintentos = int(config.get('SMTP', 'max_reintentos', fallback='3'))
+        self.delay_entre_emails = float(config.get('SMTP', 'delay_segundos', fallback='1.0'))
+        self.num_sesiones = max(1, int(config.get('SMTP', 'conexiones', fallback='1')))
+        self.limitador = limitador or LimitadorEnvios(obtener_limites(config))
+        self.controlador = controlador or ControladorRitmo(
+            obtener_control_ritmo(config, self.limitador.limites), self.num_sesiones)
+        self.email_origen = email_origen
+        self.password = password
+
+    def _nueva_sesion(self):
+        return SesionSMTP(self.servidor_smtp, self.puerto_smtp, self.timeout)
+
+    async def _abrir_sesion(self, sesion):
+        """Open a session with retries; returns False if it couldn't be opened."""
+        for intento in range(self.max_reintentos):
+            try:
+                log_info(f"Conectando a {self.servidor_smtp}:{self.puerto_smtp} (intento {intento + 1})")
+                await sesion.abrir(self.email_origen, self.password)
+                log_info("[OK] Conexión SMTP establecida exitosamente")
+                return True
+            except ErrorRespuestaSMTP as e:
+                await sesion.cerrar()
+                if e.codigo == 535:
+                    log_error(f"[ERROR] Error de autenticación: {e}")
+                    log_error("Verificar credenciales de email y contraseñas de aplicación")
+                    return False
+                log_warning(f"[ADVERTENCIA] Error de conexión (intento {intento + 1}): {e}")
+            except OSError as e:
+                await sesion.cerrar()
+                if isinstance(e, socket.gaierror):
+                    log_error(f"[ERROR] Error de DNS/red: {e}")
+                    return False
+                log_warning(f"[ADVERTENCIA] Error de conexión (intento {intento + 1}): {type(e).__name__}: {e}")
+            except asyncio.TimeoutError:
+                await sesion.cerrar()
+                log_warning(f"[ADVERTENCIA] Timeout de conexión (intento {intento + 1})")
+
+            # Backoff exponencial entre reintentos
+            if intento < self.max_reintentos - 1:
+                delay = (2 ** intento) * 2  # 2, 4, 8 segundos
+                log_info(f"Esperando {delay}s antes del siguiente intento...")
+                await asyncio.sleep(delay)
+
+        log_error(f"[ERROR] Failed to connect after {self.max_reintentos} attempts")
+        return False
+
+    async def _esperar_turno(self):
+        """Espera hasta que el limitador y el controlador de ritmo permitan enviar otro email."""
+        espera = max(self.limitador.reservar(), self.controlador.reservar())
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+    async def _enviar(self, sesion, msg, email_destino):
+        """Try once to send an email through a session.
+
+        A dropped session is reopened and the email sent again straight away
+        (the server never got it); any other failure is raised classified by
+        its reply code, as RobustEmailSender does.
+
+        Raises:
+            FalloEnvio: If the email couldn't be sent
+        """
+        loop = asyncio.get_running_loop()
+        for reconexion in range(2):
+            try:
+                if not sesion.abierta:
+                    raise ConnectionResetError("No hay conexión activa")
+                await self._esperar_turno()
+                inicio = loop.time()
+                await sesion.enviar(msg)
+                self.controlador.exito(loop.time() - inicio)
+                if self.delay_entre_emails > 0 and not (self.limitador.activo or self.controlador.activo):
+                    await asyncio.sleep(self.delay_entre_emails)
+                return True
+
+            except (ConnectionError, asyncio.IncompleteReadError, ErrorRespuestaSMTP) as e:
+                codigo, mensaje = respuesta_smtp(e)
+                if codigo is None:
+                    log_warning(f"[ADVERTENCIA] Servidor desconectado durante envío: {e}")
+                    await sesion.cerrar()
+                    if reconexion == 0 and await self._abrir_sesion(sesion):
+                        continue  # Reenviar una vez por la sesión reabierta
+                    raise FalloEnvio(f"Servidor desconectado: {e}", temporal=True) from e
+                if es_limitacion(codigo, mensaje, es_respuesta_destinatario(e)):
+                    # El servidor pide ir más despacio: se reduce el ritmo
+                    self.controlador.limitado(codigo, mensaje)
+                if codigo == 421:
+                    # El servidor cierra la sesión: se reabre para el siguiente envío
+                    await sesion.cerrar()
+                    await self._abrir_sesion(sesion)
+                else:
+                    await self._reiniciar(sesion)
+                fallo = clasificar_fallo(e)
+                if fallo.temporal:
+                    log_warning(f"[ADVERTENCIA] Fallo temporal enviando a {email_destino}: {fallo}")
+                else:
+                    log_error(f"[ERROR] Email rechazado por el servidor: {email_destino} - {fallo}")
+                raise fallo from e
+
+            except asyncio.TimeoutError as e:
+                log_warning(f"[ADVERTENCIA] Timeout enviando email a {email_destino}")
+                # La sesión queda en un estado desconocido: se abrirá de nuevo en el siguiente envío
+                await sesion.cerrar()
+                raise FalloEnvio("Timeout enviando email", temporal=True) from e
+
+            except Exception as e:
+                log_warning(f"[ADVERTENCIA] Error enviando email a {email_destino}: {type(e).__name__}: {e}")
+                await self._reiniciar(sesion)
+                raise clasificar_fallo(e) from e
+
+    async def _reiniciar(self, sesion):
+        """Reset the transaction after a rejected command, keeping the session."""
+        try:
+            await sesion._comando('RSET')
+        except Exception:
+            await sesion.cerrar()
+
+    async def _ejecutar(self, nominas, preparar_envio, completar, cancelar, reintentos, aplazar,
+                        reintentar):
+        loop = asyncio.get_running_loop()
+        sesiones = [self._nueva_sesion() for _ in range(self.num_sesiones)]
+
+        # Las sesiones se abren a la vez; basta con que se abra una
+        abiertas = await asyncio.gather(*(self._abrir_sesion(sesion) for sesion in sesiones))
+        sesiones = [sesion for sesion, abierta in zip(sesiones, abiertas) if abierta]
+        if not sesiones:
+            raise ConnectionError("[ERROR] No se pudo establecer conexión SMTP después de varios intentos")
+        log_info(f"[OK] {len(sesiones)} sesiones SMTP asíncronas listas")
+        self.controlador.ajustar_maximo(len(sesiones))
+        en_curso = [0]
+        # Envíos en la cola o en curso, que aún pueden acabar en la cola de reintentos
+        pendientes = [0]
+
+        cola = asyncio.Queue(maxsize=1)
+
+        def cancelado():
+            return cancelar is not None and cancelar.is_set()
+
+        async def encolar(envio):
+            pendientes[0] += 1
+            await cola.put(envio)
+
+        async def encolar_reintentos_listos():
+            if reintentos is not None:
+                for envio in reintentos.listos():
+                    if reintentar is None or reintentar(envio):
+                        await encolar(envio)
+
+        async def producir():
+            # La preparación de los PDFs bloquea: se avanza en un hilo aparte
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix='preparacion') as executor:
+                while True:
+                    if cancelado():
+                        break
+                    # Los reintentos cuya espera ya venció van por delante
+                    await encolar_reintentos_listos()
+                    elemento = await loop.run_in_executor(executor, next, nominas, _FIN)
+                    # Una nómina ya preparada se envía aunque se acabe de cancelar
+                    if elemento is _FIN:
+                        break
+                    envio = preparar_envio(*elemento)
+                    if envio is not None:
+                        await encolar(envio)
+
+            # Tras la pasada principal quedan los envíos en curso y los reintentos
+            while not cancelado() and (pendientes[0] or reintentos):
+                await encolar_reintentos_listos()
+                await asyncio.sleep(0.1)
+            for _ in sesiones:
+                await cola.put(_FIN)
+
+        async def consumir(sesion):
+            while True:
+                envio = await cola.get()
+                if envio is _FIN:
+                    break
+                tarea, msg, pdf_path = envio
+                # Solo envían a la vez tantas sesiones como permite el controlador
+                while en_curso[0] >= self.controlador.conexiones:
+                    await asyncio.sleep(0.05)
+                en_curso[0] += 1
+                try:
+                    await self._enviar(sesion, msg, tarea['email'])
+                    completar(tarea, pdf_path, True)
+                except Exception as e:
+                    fallo = clasificar_fallo(e)
+                    if not isinstance(e, FalloEnvio):
+                        log_error(f"[ERROR] Error enviando a {tarea['email']}: {type(e).__name__}: {e}")
+                        log_debug("Stack trace completo:", exc_info=True)
+                    espera = reintentos.aplazar(envio, fallo) if reintentos is not None else None
+                    if espera is None:
+                        completar(tarea, pdf_path, False, str(fallo))
+                    elif aplazar:
+                        aplazar(tarea, str(fallo), espera)
+                finally:
+                    en_curso[0] -= 1
+                    pendientes[0] -= 1
+            await sesion.cerrar()
+
+        try:
+            await asyncio.gather(producir(), *(consumir(sesion) for sesion in sesiones))
+        finally:
+            for sesion in sesiones:
+                await sesion.cerrar()
+
+        # Al cancelar, los reintentos pendientes quedan como fallidos
+        if reintentos is not None:
+            for tarea, _, pdf_path in reintentos.vaciar():
+                completar(tarea, pdf_path, False, "Envío cancelado con un reintento pendiente")
+
+    def ejecutar(self, nominas, preparar_envio, completar, cancelar=None, reintentos=None, aplazar=None,
+                 reintentar=None):
+        """Send every prepared payslip; blocks until all are done.
+
+        Args:
+            nominas (iterator): Yields (tarea, preparada) as
+                iterar_nominas_preparadas() does; advanced in an executor
+            preparar_envio (callable): Called in this thread with each
+                (tarea, preparada); returns (tarea, message, pdf path) or
+                None if the task failed before sending
+            completar (callable): Called in this thread with (tarea, pdf
+                path, success[, error]) once the send is final
+            cancelar (threading.Event): Stops taking new payslips when set
+            reintentos (ColaReintentos): Queue for the sends that fail with a
+                temporary error; without it every failure is final
+            aplazar (callable): Called in this thread with (tarea, error,
+                seconds) when a send is queued for a retry
+            reintentar (callable): Called in this thread with (tarea, message,
+                pdf path) before a queued send is retried; if it returns
+                False the send doesn't go out
+
+        Raises:
+            ConnectionError: If no SMTP session could be opened
+        """
+        asyncio.run(self._ejecutar(
+            nominas, preparar_envio, completar, cancelar, reintentos, aplazar, reintentar))
@@ -0,0 +1,277 @@
+"""
+Extracción de NIFs desde el PDF maestro de nóminas.
+
+Recorre las páginas del PDF maestro y obtiene el NIF impreso en cada una.
+Para PDFs grandes reparte el rango de páginas entre un pool de procesos,
+donde cada proceso abre su propio documento ``fitz``.
+
+Modos de extracción (``[PDF] extraccion_nif``):
+    completo: busca el NIF en el texto completo de cada página
+    region: aprende dónde se imprime el NIF y solo lee ese recuadro,
+        volviendo al texto completo si el recuadro no contiene un NIF
+    rapido: recorre los bloques de texto de la página, sin conservar
+        ligaduras, espacios ni imágenes, y se detiene en el primer NIF válido
+"""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+
+PATRON_NIF = re.compile(r'\b(\d{8}[A-Z])\b')
+LETRAS_NIF = "TRWAGMYFPDXBNJZSQVHLCKE"
+
+MODOS_EXTRACCION = ('completo', 'region', 'rapido')
+
+# Flags de TextPage para el modo rápido: solo el texto dentro de la página,
+# sin imágenes, ligaduras ni espacios preservados
+FLAGS_TEXTO_RAPIDO = fitz.TEXT_MEDIABOX_CLIP
+
+# Por debajo de este número de páginas por proceso no compensa arrancar el pool
+PAGINAS_MINIMAS_POR_PROCESO = 50
+
+# Cada proceso recibe varios bloques para repartir mejor la carga
+BLOQUES_POR_PROCESO = 4
+
+# Tamaño máximo de cada bloque, para entregar resultados parciales pronto
+PAGINAS_MAXIMAS_POR_BLOQUE = 100
+
+# Páginas entregadas juntas en la extracción secuencial
+PAGINAS_POR_LOTE = 25
+
+
+def es_nif_valido(nif):
+    """Check the control letter of a NIF (8 digits plus letter).
+
+    Args:
+        nif (str): NIF to check
+
+    Returns:
+        bool: True if the letter matches the number
+    """
+    return LETRAS_NIF[int(nif[:8]) % 23] == nif[8]
+
+
+def buscar_nif_en_texto(texto):
+    """Return the NIF found in a text, or None if there is none.
+
+    Other identifiers with the same shape (company codes, references...)
+    may appear before the employee's NIF, so the first match with a valid
+    control letter is preferred over the first match.
+
+    Args:
+        texto (str): Text extracted from a PDF page
+
+    Returns:
+        str: NIF found (8 digits plus letter), None if not found
+    """
+    candidatos = PATRON_NIF.findall(texto)
+    for nif in candidatos:
+        if es_nif_valido(nif):
+            return nif
+    return candidatos[0] if candidatos else None
+
+
+def buscar_nif_en_bloques(pagina):
+    """Return the NIF of a page scanning its text blocks, or None.
+
+    Builds a trimmed TextPage and stops at the first NIF with a valid
+    control letter. Gives the same result as buscar_nif_en_texto() on the
+    full page text, since blocks come in the same order.
+
+    Args:
+        pagina (fitz.Page): Page to inspect
+
+    Returns:
+        str: NIF found (8 digits plus letter), None if not found
+    """
+    primer_candidato = None
+    for bloque in pagina.get_text("blocks", flags=FLAGS_TEXTO_RAPIDO):
+        for coincidencia in PATRON_NIF.finditer(bloque[4]):
+            nif = coincidencia.group(1)
+            if es_nif_valido(nif):
+                return nif
+            if primer_candidato is None:
+                primer_candidato = nif
+    return primer_candidato
+
+
+def nif_en_palabra(palabra):
+    """Return the NIF if a single word is exactly a NIF, otherwise None."""
+    palabra = palabra.strip('.,;:()[]')
+    if len(palabra) == 9 and PATRON_NIF.fullmatch(palabra):
+        return palabra
+    return None
+
+
+def obtener_modo_extraccion(config):
+    """Read the NIF extraction mode from ``[PDF] extraccion_nif``.
+
+    Args:
+        config (ConfigParser): Application configuration, may be None
+
+    Returns:
+        str: One of MODOS_EXTRACCION, 'completo' if unset or unknown
+    """
+    if config is None:
+        return 'completo'
+    modo = config.get('PDF', 'extraccion_nif', fallback='completo').strip().lower()
+    return modo if modo in MODOS_EXTRACCION else 'completo'
+
+
+def _extraer_nif_pagina(pagina, region=None, modo='completo'):
+    """Extract the NIF of a page, reading only ``region`` when given.
+
+    Falls back to the full page text when the region has no NIF. In
+    'rapido' mode the text blocks are scanned instead of the full text.
+    """
+    if modo == 'rapido':
+        return buscar_nif_en_bloques(pagina)
+    if region:
+        nif = buscar_nif_en_texto(pagina.get_text(clip=fitz.Rect(region)))
+        if nif:
+            return nif
+    return buscar_nif_en_texto(pagina.get_text())
+
+
+def _extraer_nifs_rango(pdf_path, inicio, fin, region=None, modo='completo'):
+    """Extract the NIF of pages ``inicio`` to ``fin - 1`` of a PDF.
+
+    Runs inside the worker processes, so it opens its own document
+    instead of sharing the parent's one.
+
+    Args:
+        pdf_path (str): Path to the master PDF file
+        inicio (int): First page index (0-based, inclusive)
+        fin (int): Last page index (0-based, exclusive)
+        region (list): Learned NIF region [x0, y0, x1, y1] (optional)
+        modo (str): NIF extraction mode, one of MODOS_EXTRACCION
+
+    Returns:
+        list: NIF (or None) for each page of the range, in order
+    """
+    doc = fitz.open(pdf_path)
+    try:
+        return [
+            _extraer_nif_pagina(doc.load_page(num_pagina), region, modo)
+            for num_pagina in range(inicio, fin)
+        ]
+    finally:
+        doc.close()
+
+
+def obtener_procesos_extraccion(config, num_paginas):
+    """Determine how many processes to use for extracting a PDF.
+
+    Reads ``procesos_extraccion`` from the ``[PDF]`` section, where 0 means
+    one process per CPU core and 1 disables parallel extraction. The
+    number is capped so each process gets a reasonable amount of pages.
+
+    Args:
+        config (ConfigParser): Application configuration, may be None
+        num_paginas (int): Number of pages of the master PDF
+
+    Returns:
+        int: Number of processes to use (1 means sequential extraction)
+    """
+    procesos = 0
+    if config is not None:
+        try:
+            procesos = int(config.get('PDF', 'procesos_extraccion', fallback='0'))
+        except ValueError:
+            procesos = 0
+
+    if procesos <= 0:
+        procesos = os.cpu_count() or 1
+
+    procesos_utiles = max(1, num_paginas // PAGINAS_MINIMAS_POR_PROCESO)
+    return max(1, min(procesos, procesos_utiles))
+
+
+def _dividir_rango(num_paginas, num_bloques):
+    """Split ``range(num_paginas)`` into consecutive (inicio, fin) blocks."""
+    tamano = -(-num_paginas // num_bloques)  # División redondeando hacia arriba
+    return [
+        (inicio, min(inicio + tamano, num_paginas))
+        for inicio in range(0, num_paginas, tamano)
+    ]
+
+
+def iterar_nifs_pdf(pdf_path, config=None, cancelar=None):
+    """Extract the NIF printed on every page of the master PDF progressively.
+
+    Uses a process pool when the PDF is large enough and the configuration
+    allows it. In 'region' mode the NIF position is learned (or taken from
+    the cached layout profile) before the pages are distributed. Batches
+    are always yielded in page order, as soon as they are available.
+
+    Args:
+        pdf_path (str): Path to the master PDF file
+        config (ConfigParser): Application configuration (optional)
+        cancelar (threading.Event): Stops the extraction when set (optional)
+        
+    Yields:
+        list: NIF (or None) for each page of the next batch of pages
+    """
+    doc_maestro = fitz.open(pdf_path)
+    num_paginas = len(doc_maestro)
+    num_procesos = obtener_procesos_extraccion(config, num_paginas)
+
+    modo = obtener_modo_extraccion(config)
+    region = None
+    if modo == 'region':
+        # Importación diferida: los procesos del pool no necesitan el logger
+        from logic.perfiles_nif import obtener_region_nif
+        region = obtener_region_nif(doc_maestro, nif_en_palabra)
+
+    if num_procesos <= 1:
+        try:
+            for inicio in range(0, num_paginas, PAGINAS_POR_LOTE):
+                if cancelar is not None and cancelar.is_set():
+                    return
+                yield [
+                    _extraer_nif_pagina(doc_maestro.load_page(num_pagina), region, modo)
+                    for num_pagina in range(inicio, min(inicio + PAGINAS_POR_LOTE, num_paginas))
+                ]
+        finally:
+            doc_maestro.close()
+        return
+    doc_maestro.close()
+
+    num_bloques = max(
+        num_procesos * BLOQUES_POR_PROCESO,
+        -(-num_paginas // PAGINAS_MAXIMAS_POR_BLOQUE))
+    bloques = _dividir_rango(num_paginas, num_bloques)
+    executor = ProcessPoolExecutor(max_workers=num_procesos)
+    try:
+        # map() devuelve los bloques en el orden en que se enviaron
+        for nifs_bloque in executor.map(
+                _extraer_nifs_rango,
+                [pdf_path] * len(bloques),
+                [inicio for inicio, _ in bloques],
+                [fin for _, fin in bloques],
+                [region] * len(bloques),
+                [modo] * len(bloques)):
+            if cancelar is not None and cancelar.is_set():
+                return
+            yield nifs_bloque
+    finally:
+        # Al cancelar no se espera a los bloques que aún no han empezado
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def extraer_nifs_pdf(pdf_path, config=None):
+    """Extract the NIF printed on every page of the master PDF.
+
+    Args:
+        pdf_path (str): Path to the master PDF file
+        config (ConfigParser): Application configuration (optional)
+        
+    Returns:
+        list: NIF (or None) for each page, index 0 being page 1
+    """
+    nifs = []
+    for nifs_lote in iterar_nifs_pdf(pdf_path, config):
+        nifs.extend(nifs_lote)
+    return nifs
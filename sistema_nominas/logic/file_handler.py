@@ -1,13 +1,53 @@
-import pandas as pd
-import fitz  # PyMuPDF
 import re
+import pandas as pd
+try:
+    import pyarrow  # noqa: F401 - only needed as pandas CSV engine
+    PYARROW_DISPONIBLE = True
+except ImportError:
+    PYARROW_DISPONIBLE = False
+
+from logic.cache_analisis import CacheAnalisis, hash_archivo
+from logic.deteccion_cabecera import detectar_cabecera
+from logic.extraccion_pdf import (
+    extraer_nifs_pdf, iterar_nifs_pdf, obtener_modo_extraccion
+)
+from logic.tareas import CAMPOS_TAREA
+
+
+# Separadores habituales al escribir un NIF a mano (12345678-Z, 12.345.678 Z)
+SEPARADORES_NIF = re.compile(r"[\s.\-_/]")
+
+# Columna opcional con la posición del empleado en la lista original
+COLUMNA_POSICION = "POS."
+
+MODOS_CARGA_EMPLEADOS = ('completa', 'filtrada')
+
+# Filas leídas de cada vez al filtrar un CSV de empleados por NIF
+FILAS_POR_BLOQUE_EMPLEADOS = 50000
+
+
+def obtener_carga_empleados(config=None):
+    """Return the configured employee loading mode ('completa' or 'filtrada')."""
+    if config is None:
+        return 'completa'
+    carga = config.get('Empleados', 'carga', fallback='completa').strip().lower()
+    return carga if carga in MODOS_CARGA_EMPLEADOS else 'completa'
+
+
+def _normalizar_nif(valor):
+    """Normalize a single NIF cell, like normalizar_nifs() does for a column."""
+    if valor is None:
+        return ""
+    return SEPARADORES_NIF.sub("", str(valor).upper())
 
 
 def leer_cabeceras_empleados(filepath):
     """Read column headers from a CSV or Excel file.
     
     Extracts only the column names without loading the full dataset.
-    Useful for mapping columns before processing the complete file.
+    Useful for mapping columns before processing the complete file. Only
+    the first rows are streamed, and the header row is found even when
+    the file starts with title rows.
     
     Args:
         filepath (str): Path to the CSV or Excel file
@@ -16,96 +56,497 @@ def leer_cabeceras_empleados(filepath):
         list: Column names from the file, empty list if error occurs
     """
     try:
-        if filepath.endswith('.csv'):
-            return pd.read_csv(filepath, nrows=0).columns.tolist()
-        elif filepath.endswith(('.xlsx', '.xls')):
-            return pd.read_excel(filepath, nrows=0).columns.tolist()
-        else:
-            return []
+        return detectar_cabecera(filepath)["cabeceras"]
     except Exception:
         return []
 
 
-def leer_archivo_empleados(filepath):
+def _columnas_a_leer(cabeceras, columnas_map):
+    """Return the file columns needed for the mapping, in file order."""
+    necesarias = set(columnas_map.values()) | {COLUMNA_POSICION}
+    return [col for col in cabeceras if col in necesarias]
+
+
+def _leer_csv_columnas(filepath, columnas_map, formato, nifs=None):
+    """Read only the mapped columns of a CSV, as strings.
+    
+    Uses the pyarrow engine when it is installed, otherwise the C engine.
+    When ``nifs`` is given the file is read in chunks and only the rows
+    whose normalized NIF is in the set are kept.
+    """
+    columnas = _columnas_a_leer(formato["cabeceras"], columnas_map)
+    # La posición se deja con su tipo para ordenar el reporte numéricamente
+    tipos = {col: str for col in columnas if col != COLUMNA_POSICION}
+    opciones = dict(
+        skiprows=formato["fila_cabecera"], sep=formato["separador"],
+        encoding=formato["codificacion"], usecols=columnas, dtype=tipos)
+    if nifs is None:
+        motor = "pyarrow" if PYARROW_DISPONIBLE else "c"
+        return pd.read_csv(filepath, engine=motor, **opciones)
+    
+    # pyarrow no admite lectura por bloques
+    columna_nif = columnas_map["nif"]
+    partes = [
+        bloque[normalizar_nifs(bloque[columna_nif]).isin(nifs)]
+        for bloque in pd.read_csv(
+            filepath, engine="c", chunksize=FILAS_POR_BLOQUE_EMPLEADOS, **opciones)
+    ]
+    if not partes:
+        return pd.DataFrame({col: pd.Series(dtype=tipos.get(col, object)) for col in columnas})
+    return pd.concat(partes, ignore_index=True)
+
+
+def _leer_xlsx_columnas(filepath, columnas_map, formato, nifs=None):
+    """Read only the mapped columns of an xlsx workbook, as strings.
+    
+    Streams the first sheet with openpyxl in read-only mode instead of
+    loading the whole workbook. When ``nifs`` is given only the rows whose
+    normalized NIF is in the set are kept.
+    """
+    from openpyxl import load_workbook
+    
+    libro = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        filas = libro.worksheets[0].iter_rows(
+            min_row=formato["fila_cabecera"] + 2, values_only=True)
+        cabeceras = formato["cabeceras"]
+        columnas = _columnas_a_leer(cabeceras, columnas_map)
+        indices = [cabeceras.index(col) for col in columnas]
+        indice_nif = cabeceras.index(columnas_map["nif"]) if nifs is not None else None
+        
+        datos = {col: [] for col in columnas}
+        for fila in filas:
+            if nifs is not None:
+                nif = fila[indice_nif] if indice_nif < len(fila) else None
+                if _normalizar_nif(nif) not in nifs:
+                    continue
+            valores = [fila[i] if i < len(fila) else None for i in indices]
+            if all(valor is None for valor in valores):
+                continue  # Filas vacías (p. ej. formato aplicado al final de la hoja)
+            for col, valor in zip(columnas, valores):
+                if valor is not None and col != COLUMNA_POSICION:
+                    valor = str(valor)
+                datos[col].append(valor)
+    finally:
+        libro.close()
+    
+    # Los valores ya son str o None: astype(str) convertiría None en "None"
+    return pd.DataFrame(datos)
+
+
+def leer_archivo_empleados(filepath, columnas_map=None, formato=None, nifs=None):
     """Read employee data file, automatically detecting CSV or Excel format.
     
+    The header row, and for CSV files the encoding and the delimiter, are
+    detected first. When the column mapping is given only the mapped
+    columns (plus the original position column, if present) are read, as
+    strings, which is much faster on exports with many columns and rows.
+    With ``nifs`` only the employees whose normalized NIF is in the set are
+    kept, streaming the file so memory depends on the matching rows only.
+    
     Args:
         filepath (str): Path to the employee data file
+        columnas_map (dict): Mapping of required fields to actual column
+            names (optional, all columns are read if omitted)
+        formato (dict): Result of detectar_cabecera(), if already known
+        nifs (set): Normalized NIFs to keep (optional, requires columnas_map)
         
     Returns:
         pandas.DataFrame: Employee data
         
     Raises:
-        ValueError: If file format is not supported
+        ValueError: If file format is not supported, or if filtering by
+            NIF and the NIF column is missing
     """
+    if formato is None:
+        formato = detectar_cabecera(filepath)
+    fila_cabecera = formato["fila_cabecera"]
+    if nifs is not None and columnas_map["nif"] not in formato["cabeceras"]:
+        raise ValueError(f"Column '{columnas_map['nif']}' mapped to 'nif' not found in file.")
     if filepath.endswith('.csv'):
-        return pd.read_csv(filepath)
-    elif filepath.endswith(('.xlsx', '.xls')):
-        return pd.read_excel(filepath)
+        if columnas_map:
+            return _leer_csv_columnas(filepath, columnas_map, formato, nifs)
+        return pd.read_csv(
+            filepath, skiprows=fila_cabecera, sep=formato["separador"],
+            encoding=formato["codificacion"])
+    elif filepath.endswith('.xlsx') and columnas_map:
+        return _leer_xlsx_columnas(filepath, columnas_map, formato, nifs)
     else:
-        raise ValueError("Formato de archivo no soportado.")
+        if columnas_map:
+            columnas = _columnas_a_leer(formato["cabeceras"], columnas_map)
+            tipos = {col: str for col in columnas if col != COLUMNA_POSICION}
+            df = pd.read_excel(
+                filepath, header=fila_cabecera, usecols=columnas, dtype=tipos)
+            if nifs is not None:
+                # xlrd no permite leer por bloques: se filtra tras la lectura
+                df = df[normalizar_nifs(df[columnas_map["nif"]]).isin(nifs)]
+            return df
+        return pd.read_excel(filepath, header=fila_cabecera)
 
 
-def analizar_archivos(pdf_path, empleados_path, columnas_map):
-    """Analyze PDF and employee files to create processing tasks.
+def normalizar_nifs(serie):
+    """Normalize a column of NIFs so they can be used as lookup keys.
     
-    Extracts NIFs from each PDF page and matches them with employee data.
-    Creates task objects that contain all information needed for payroll processing.
+    Trims whitespace, upper-cases and removes separators, so values such as
+    ' 12345678-z' or '12.345.678 Z' become '12345678Z'. Empty cells become
+    an empty string.
     
     Args:
-        pdf_path (str): Path to the master PDF file containing all payrolls
-        empleados_path (str): Path to the employee data file (CSV/Excel)
+        serie (pandas.Series): Column with the NIFs as typed in the file
+        
+    Returns:
+        pandas.Series: Normalized NIFs
+    """
+    return (
+        serie.astype("string")
+        .str.upper()
+        .str.replace(SEPARADORES_NIF, "", regex=True)
+        .fillna("")
+    )
+
+
+def construir_indice_empleados(df, columnas_map):
+    """Build a normalized NIF -> employee index from the employee file.
+    
+    The index only keeps the columns needed to create the tasks. NIFs that
+    appear in more than one row are returned apart so they can be reported
+    instead of silently taking the first row.
+    
+    Args:
+        df (pandas.DataFrame): Employee data
         columnas_map (dict): Mapping of required fields to actual column names
         
     Returns:
-        dict: Contains 'tareas' list with task objects, or 'error' message if failed
+        tuple: (DataFrame indexed by normalized NIF, dict NIF -> number of rows)
     """
-    try:
-        df = leer_archivo_empleados(empleados_path)
-        for col_key, col_name in columnas_map.items():
-            if col_name not in df.columns:
-                raise ValueError(
-                    f"Column '{col_name}' mapped to '{col_key}' "
-                    f"not found in file."
-                )
-    except Exception as e:
-        return {"error": f"Error reading employee file:\n{e}"}
+    apellidos_col = columnas_map.get("apellidos")
+    indice = pd.DataFrame({
+        "nombre": df[columnas_map["nombre"]],
+        "apellidos": df[apellidos_col] if apellidos_col else "",
+        "email": df[columnas_map["email"]],
+        "posicion_original": df[COLUMNA_POSICION] if COLUMNA_POSICION in df.columns else None,
+    }, dtype="object")  # Keep original values (e.g. integer POS.) after the join
+    indice.index = normalizar_nifs(df[columnas_map["nif"]]).rename("nif")
+    indice = indice[indice.index != ""]
+    
+    repeticiones = indice.index.value_counts()
+    duplicados = repeticiones[repeticiones > 1].to_dict()
+    indice = indice[~indice.index.duplicated(keep="first")]
+    return indice, duplicados
 
-    doc_maestro = fitz.open(pdf_path)
-    tareas = []
+
+def unir_nifs_con_empleados(nifs_paginas, indice, duplicados, primera_pagina=1):
+    """Match the NIF of every PDF page with the employee index.
+    
+    Performs a single vectorized join between the pages and the index and
+    then builds one task per page.
     
-    for num_pagina in range(len(doc_maestro)):
-        texto_pagina = doc_maestro.load_page(num_pagina).get_text()
-        nif_match = re.search(r'\b(\d{8}[A-Z])\b', texto_pagina)
+    Args:
+        nifs_paginas (list): NIF (or None) for each page, index 0 being page 1
+        indice (pandas.DataFrame): Index from construir_indice_empleados()
+        duplicados (dict): Duplicated NIFs and how many rows each one has
+        primera_pagina (int): Page number of the first NIF, when joining
+            a batch of pages (optional)
         
+    Returns:
+        list: Task objects, one per page in page order
+    """
+    paginas = pd.DataFrame({"nif": pd.Series(nifs_paginas, dtype="object")})
+    encontrados = paginas.join(indice, on="nif")
+    encontrados["existe"] = paginas["nif"].isin(indice.index)
+    
+    tareas = []
+    for num_pagina, (nif, nombre, apellidos, email, posicion, existe) in enumerate(zip(
+            paginas["nif"].tolist(),
+            encontrados["nombre"].tolist(),
+            encontrados["apellidos"].tolist(),
+            encontrados["email"].tolist(),
+            encontrados["posicion_original"].tolist(),
+            encontrados["existe"].tolist())):
         tarea = {
-            "pagina": num_pagina + 1, "nif": "N/A", "nombre": "N/A",
+            "pagina": primera_pagina + num_pagina, "nif": "N/A", "nombre": "N/A",
             "apellidos": "N/A", "email": "N/A", "status": "[ADVERTENCIA] Sin NIF en PDF"}
-        if nif_match:
-            nif = nif_match.group(1)
+        if nif:
             tarea["nif"] = nif
-            info = df[df[columnas_map["nif"]] == nif]
-            if not info.empty:
-                nombre_solo = info.iloc[0][columnas_map["nombre"]]
-                if "apellidos" in columnas_map and columnas_map["apellidos"]:
-                    apellidos_campo = info.iloc[0][columnas_map["apellidos"]]
-                else:
-                    apellidos_campo = ""
-                
-                posicion_original = None
-                if "POS." in df.columns:
-                    posicion_original = info.iloc[0]["POS."]
-                
+            if nif in duplicados:
+                tarea["status"] = (
+                    f"[ERROR] NIF duplicado en la lista ({duplicados[nif]} filas)")
+            elif existe:
                 tarea.update({
-                    "nombre": nombre_solo,  # First name only, without last name
-                    "apellidos": apellidos_campo,  # Last name separate field
-                    "email": info.iloc[0][columnas_map["email"]],
-                    "posicion_original": posicion_original,  # Maintain original order
+                    "nombre": nombre,  # First name only, without last name
+                    "apellidos": apellidos,  # Last name separate field
+                    "email": email,
+                    "posicion_original": posicion,  # Maintain original order
                     "status": "[OK]"
                 })
             else:
                 tarea["status"] = "[ERROR] NIF no encontrado en la lista"
         tareas.append(tarea)
+    return tareas
+
+
+def _leer_indice_empleados(empleados_path, columnas_map, formato=None, nifs=None):
+    """Read the employee file and build its NIF index (join stage input).
+    
+    Raises:
+        ValueError: If a mapped column is missing from the file
+    """
+    df = leer_archivo_empleados(empleados_path, columnas_map, formato, nifs)
+    for col_key, col_name in columnas_map.items():
+        if col_name not in df.columns:
+            raise ValueError(
+                f"Column '{col_name}' mapped to '{col_key}' "
+                f"not found in file."
+            )
+    return construir_indice_empleados(df, columnas_map)
+
+
+def _indice_empleados(empleados_path, columnas_map, sesion, nifs=None):
+    """Return the employee NIF index, reusing the one loaded in the session."""
+    if sesion is None:
+        return _leer_indice_empleados(empleados_path, columnas_map, nifs=nifs)
+    return sesion.indice_empleados(
+        empleados_path, columnas_map, _leer_indice_empleados, nifs)
+
+
+def _filtro_nifs(nifs_paginas, config):
+    """Return the set of PDF NIFs to filter the employee file by, or None
+    when the whole employee file is loaded."""
+    if obtener_carga_empleados(config) != 'filtrada':
+        return None
+    return frozenset(nif for nif in nifs_paginas if nif)
+
+
+def _hashes_entradas(pdf_path, empleados_path, sesion):
+    """Return the content hashes of both input files, reusing the session ones."""
+    if sesion is None:
+        return hash_archivo(pdf_path), hash_archivo(empleados_path)
+    return sesion.hash_pdf(pdf_path), sesion.hash_empleados(empleados_path)
+
+
+def _obtener_nifs_pdf(pdf_path, pdf_hash, modo, cache, config):
+    """Return the per-page NIFs of the PDF (extraction stage), using the cache."""
+    nifs_paginas = cache.obtener_nifs(pdf_hash, modo)
+    if nifs_paginas is None:
+        nifs_paginas = extraer_nifs_pdf(pdf_path, config)
+        cache.guardar_nifs(pdf_hash, modo, nifs_paginas)
+    return nifs_paginas
+
+
+def _crear_estado(pdf_hash, empleados_hash, columnas_map, modo, tareas, nifs_paginas=None):
+    """Build the state needed to re-verify an analysis incrementally.
+    
+    The tasks are kept as compact tuples of their fields, so later manual
+    corrections do not alter the reference used to detect which rows changed.
+    """
+    if nifs_paginas is None:
+        nifs_paginas = [
+            tarea["nif"] if tarea["nif"] != "N/A" else None for tarea in tareas]
+    return {
+        "pdf_hash": pdf_hash,
+        "empleados_hash": empleados_hash,
+        "columnas_map": dict(columnas_map),
+        "modo": modo,
+        "nifs_paginas": list(nifs_paginas),
+        "tareas": [_fila_tarea(tarea) for tarea in tareas],
+    }
+
+
+def _fila_tarea(tarea):
+    """Return the fields of a task dict as a tuple, for comparisons."""
+    return tuple(tarea.get(campo) for campo in CAMPOS_TAREA)
+
+
+def iterar_analisis(pdf_path, empleados_path, columnas_map, config=None, cancelar=None,
+                    sesion=None):
+    """Analyze PDF and employee files progressively.
+    
+    Same analysis as analizar_archivos(), but the tasks are yielded in
+    batches as the PDF pages are processed, so a caller running it in a
+    worker thread can show the first rows while the rest are extracted.
+    Results are cached by the content hash of both files and the column
+    mapping, so analyzing unchanged inputs again returns almost instantly.
+    
+    Args:
+        pdf_path (str): Path to the master PDF file containing all payrolls
+        empleados_path (str): Path to the employee data file (CSV/Excel)
+        columnas_map (dict): Mapping of required fields to actual column names
+        config (ConfigParser): Application configuration, used for the
+            extraction settings and the analysis cache (optional)
+        cancelar (threading.Event): Stops the analysis when set (optional)
+        sesion (SesionArchivos): Loaded inputs to reuse instead of reading
+            the files again (optional)
+        
+    Yields:
+        dict: {'tareas': batch} for each batch of pages in page order and
+            finally {'estado': ...} for reverificar_archivos(), or a single
+            {'error': message} if failed. Nothing more is yielded once
+            ``cancelar`` is set.
+    """
+    cache = CacheAnalisis(config)
+    modo = obtener_modo_extraccion(config)
+    try:
+        pdf_hash, empleados_hash = _hashes_entradas(pdf_path, empleados_path, sesion)
+    except OSError as e:
+        yield {"error": f"Error reading input files:\n{e}"}
+        return
+    
+    clave = cache.clave_analisis(pdf_hash, empleados_hash, columnas_map, modo)
+    tareas = cache.obtener_tareas(clave)
+    if tareas is not None:
+        yield {"tareas": tareas}
+        yield {"estado": _crear_estado(pdf_hash, empleados_hash, columnas_map, modo, tareas)}
+        return
+    
+    nifs_cache = cache.obtener_nifs(pdf_hash, modo)
+    if nifs_cache is not None:
+        lotes = [nifs_cache]
+    else:
+        lotes = iterar_nifs_pdf(pdf_path, config, cancelar)
+    
+    filtro = None
+    if obtener_carga_empleados(config) == 'filtrada':
+        # Primera pasada: los NIFs del PDF deciden qué empleados se cargan
+        lotes = [[nif for lote in lotes for nif in lote]]
+        if cancelar is not None and cancelar.is_set():
+            return
+        filtro = _filtro_nifs(lotes[0], config)
+    
+    try:
+        indice, duplicados = _indice_empleados(empleados_path, columnas_map, sesion, filtro)
+    except Exception as e:
+        yield {"error": f"Error reading employee file:\n{e}"}
+        return
+    
+    nifs_paginas = []
+    tareas = []
+    for nifs_lote in lotes:
+        tareas_lote = unir_nifs_con_empleados(
+            nifs_lote, indice, duplicados, primera_pagina=len(nifs_paginas) + 1)
+        nifs_paginas.extend(nifs_lote)
+        tareas.extend(tareas_lote)
+        if cancelar is not None and cancelar.is_set():
+            return
+        yield {"tareas": tareas_lote}
+    
+    if cancelar is not None and cancelar.is_set():
+        return
+    if nifs_cache is None:
+        cache.guardar_nifs(pdf_hash, modo, nifs_paginas)
+    cache.guardar_tareas(clave, tareas)
+    yield {
+        "estado": _crear_estado(
+            pdf_hash, empleados_hash, columnas_map, modo, tareas, nifs_paginas)
+    }
+
+
+def analizar_archivos(pdf_path, empleados_path, columnas_map, config=None, sesion=None):
+    """Analyze PDF and employee files to create processing tasks.
+    
+    Extracts NIFs from each PDF page and matches them with employee data.
+    Creates task objects that contain all information needed for payroll processing.
+    See iterar_analisis() for the progressive version.
+    
+    Args:
+        pdf_path (str): Path to the master PDF file containing all payrolls
+        empleados_path (str): Path to the employee data file (CSV/Excel)
+        columnas_map (dict): Mapping of required fields to actual column names
+        config (ConfigParser): Application configuration, used for the
+            extraction settings and the analysis cache (optional)
+        sesion (SesionArchivos): Loaded inputs to reuse (optional)
         
-    doc_maestro.close()
-    return {"tareas": tareas}
+    Returns:
+        dict: Contains 'tareas' list with task objects and 'estado' for
+            reverificar_archivos(), or 'error' message if failed
+    """
+    resultado = {"tareas": []}
+    for parcial in iterar_analisis(
+            pdf_path, empleados_path, columnas_map, config, sesion=sesion):
+        if "error" in parcial:
+            return parcial
+        if "tareas" in parcial:
+            resultado["tareas"].extend(parcial["tareas"])
+        else:
+            resultado["estado"] = parcial["estado"]
+    return resultado
+
+
+def reverificar_archivos(pdf_path, empleados_path, columnas_map, estado, config=None,
+                         sesion=None):
+    """Re-run only the analysis stages whose inputs changed.
+    
+    The extraction stage (page -> NIF) is only repeated when the PDF or the
+    extraction mode changed; otherwise the NIFs of the previous analysis are
+    joined again with the employee file. When only the employee file or the
+    column mapping changed, the pages whose task changed are reported so the
+    caller can update just those rows.
+    
+    Args:
+        pdf_path (str): Path to the master PDF file containing all payrolls
+        empleados_path (str): Path to the employee data file (CSV/Excel)
+        columnas_map (dict): Mapping of required fields to actual column names
+        estado (dict): 'estado' returned by the previous analysis (may be None)
+        config (ConfigParser): Application configuration (optional)
+        sesion (SesionArchivos): Loaded inputs to reuse (optional)
+        
+    Returns:
+        dict: 'tareas', 'estado', 'paginas_actualizadas' (page numbers whose
+            task changed) and 'completa' (True if every row must be
+            refreshed), or 'error' message if failed
+    """
+    if not estado:
+        res = analizar_archivos(pdf_path, empleados_path, columnas_map, config, sesion)
+        if "tareas" in res:
+            res["paginas_actualizadas"] = [tarea["pagina"] for tarea in res["tareas"]]
+            res["completa"] = True
+        return res
+    
+    cache = CacheAnalisis(config)
+    modo = obtener_modo_extraccion(config)
+    try:
+        pdf_hash, empleados_hash = _hashes_entradas(pdf_path, empleados_path, sesion)
+    except OSError as e:
+        return {"error": f"Error reading input files:\n{e}"}
+    
+    pdf_igual = pdf_hash == estado["pdf_hash"] and modo == estado["modo"]
+    if (pdf_igual and empleados_hash == estado["empleados_hash"]
+            and dict(columnas_map) == estado["columnas_map"]):
+        return {
+            "tareas": [
+                {campo: valor for campo, valor in zip(CAMPOS_TAREA, fila) if valor is not None}
+                for fila in estado["tareas"]
+            ],
+            "estado": estado,
+            "paginas_actualizadas": [],
+            "completa": False
+        }
+    
+    clave = cache.clave_analisis(pdf_hash, empleados_hash, columnas_map, modo)
+    tareas = cache.obtener_tareas(clave)
+    nifs_paginas = estado["nifs_paginas"] if pdf_igual else None
+    if tareas is None:
+        if nifs_paginas is None:
+            nifs_paginas = _obtener_nifs_pdf(pdf_path, pdf_hash, modo, cache, config)
+        try:
+            indice, duplicados = _indice_empleados(
+                empleados_path, columnas_map, sesion, _filtro_nifs(nifs_paginas, config))
+        except Exception as e:
+            return {"error": f"Error reading employee file:\n{e}"}
+        tareas = unir_nifs_con_empleados(nifs_paginas, indice, duplicados)
+        cache.guardar_tareas(clave, tareas)
+    
+    if pdf_igual:
+        paginas_actualizadas = [
+            tarea["pagina"] for tarea, previa in zip(tareas, estado["tareas"])
+            if _fila_tarea(tarea) != previa
+        ]
+    else:
+        paginas_actualizadas = [tarea["pagina"] for tarea in tareas]
+    
+    return {
+        "tareas": tareas,
+        "estado": _crear_estado(
+            pdf_hash, empleados_hash, columnas_map, modo, tareas, nifs_paginas),
+        "paginas_actualizadas": paginas_actualizadas,
+        "completa": not pdf_igual
+    }
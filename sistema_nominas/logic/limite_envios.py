@@ -0,0 +1,178 @@
+"""
+Límites de ritmo de envío (cubetas de tokens) y cuota diaria.
+
+El ritmo se limita con una cubeta de tokens por segundo y otra por minuto:
+se permiten ráfagas hasta el tamaño de la cubeta y después se envía al
+ritmo al que se rellena. Los límites salen de un perfil de proveedor
+(``[SMTP] perfil_proveedor``) y cada uno puede cambiarse por separado.
+
+La cuota diaria se cuenta por día natural y se guarda en disco, de modo que
+también cuenta lo enviado en ejecuciones anteriores del mismo día. Cuando se
+agota, el envío se aplaza (ver enviar_nominas_worker) en vez de dar por
+fallidas las nóminas que faltan.
+"""
+import json
+import os
+import threading
+import time
+from datetime import date
+
+
+# Límites orientativos de cada proveedor; 0 = sin límite. Los proveedores
+# pueden cambiarlos y dependen del tipo de cuenta: ajustarlos en settings.ini
+# con limite_por_segundo, limite_por_minuto y limite_por_dia si hace falta.
+PERFILES_PROVEEDOR = {
+    'ninguno': {'por_segundo': 0, 'por_minuto': 0, 'por_dia': 0},
+    'gmail': {'por_segundo': 1, 'por_minuto': 20, 'por_dia': 500},
+    'google_workspace': {'por_segundo': 2, 'por_minuto': 60, 'por_dia': 2000},
+    'outlook': {'por_segundo': 1, 'por_minuto': 30, 'por_dia': 300},
+    'office365': {'por_segundo': 1, 'por_minuto': 30, 'por_dia': 10000},
+}
+
+# Se guarda junto a las carpetas de nóminas ([Carpetas] salida)
+ARCHIVO_CUOTA = 'cuota_envios.json'
+
+
+def obtener_limites(config):
+    """Read the sending limits from the ``[SMTP]`` section.
+
+    ``perfil_proveedor`` picks the defaults from PERFILES_PROVEEDOR and
+    ``limite_por_segundo``, ``limite_por_minuto`` and ``limite_por_dia``
+    override them (``max_envios_por_segundo`` is still read as the
+    per-second limit).
+
+    Args:
+        config (ConfigParser): Application configuration
+
+    Returns:
+        dict: 'perfil', 'por_segundo', 'por_minuto' and 'por_dia' (0 = no limit)
+    """
+    perfil = config.get('SMTP', 'perfil_proveedor', fallback='ninguno').strip().lower()
+    if perfil not in PERFILES_PROVEEDOR:
+        perfil = 'ninguno'
+    limites = dict(PERFILES_PROVEEDOR[perfil], perfil=perfil)
+
+    claves = {
+        'por_segundo': ('limite_por_segundo', 'max_envios_por_segundo'),
+        'por_minuto': ('limite_por_minuto',),
+        'por_dia': ('limite_por_dia',),
+    }
+    for limite, opciones in claves.items():
+        for opcion in opciones:
+            valor = config.get('SMTP', opcion, fallback='').strip()
+            if not valor:
+                continue
+            try:
+                limites[limite] = max(0.0, float(valor))
+            except ValueError:
+                pass
+            break
+    limites['por_dia'] = int(limites['por_dia'])
+    return limites
+
+
+class CubetaTokens:
+    """Cubeta de tokens: ``capacidad`` envíos de golpe, rellenada en ``periodo`` segundos.
+
+    Los tokens pueden quedar en negativo: cada reserva devuelve cuánto debe
+    esperar quien la hizo, y así varias reservas seguidas se reparten en el
+    tiempo sin tener que volver a consultar la cubeta.
+    """
+
+    def __init__(self, capacidad, periodo):
+        self.capacidad = float(capacidad)
+        self.ritmo = self.capacidad / periodo
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+
+    def reservar(self, ahora):
+        """Take one token, returning how many seconds to wait before using it."""
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.ritmo)
+        self._ultimo = ahora
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.ritmo
+
+
+class LimitadorEnvios:
+    """Límites de ritmo y cuota diaria compartidos por todas las conexiones.
+
+    reservar() es seguro entre hilos y no espera: devuelve los segundos que
+    hay que esperar, para que cada hilo o corrutina espere por su cuenta.
+    """
+
+    def __init__(self, limites, carpeta_cuota=None):
+        self.limites = limites
+        self._bloqueo = threading.Lock()
+        self._cubetas = []
+        if limites['por_segundo']:
+            # Con menos de un envío por segundo la ráfaga es de un solo envío
+            capacidad = max(1.0, limites['por_segundo'])
+            self._cubetas.append(CubetaTokens(capacidad, capacidad / limites['por_segundo']))
+        if limites['por_minuto']:
+            self._cubetas.append(CubetaTokens(limites['por_minuto'], 60.0))
+        self._ruta_cuota = os.path.join(carpeta_cuota, ARCHIVO_CUOTA) if carpeta_cuota else None
+        self._dia, self._enviados_hoy = self._leer_cuota()
+
+    @property
+    def activo(self):
+        """Whether any rate limit or daily quota is configured."""
+        return bool(self._cubetas or self.limites['por_dia'])
+
+    def reservar(self):
+        """Reserve a send slot; returns the seconds to wait before sending."""
+        if not self._cubetas:
+            return 0.0
+        with self._bloqueo:
+            ahora = time.monotonic()
+            return max(cubeta.reservar(ahora) for cubeta in self._cubetas)
+
+    def _leer_cuota(self):
+        hoy = date.today().isoformat()
+        if not self._ruta_cuota:
+            return hoy, 0
+        try:
+            with open(self._ruta_cuota, 'r', encoding='utf-8') as f:
+                datos = json.load(f)
+            if datos.get('dia') == hoy:
+                return hoy, int(datos.get('enviados', 0))
+        except (OSError, ValueError):
+            pass
+        return hoy, 0
+
+    def _guardar_cuota(self):
+        if not self._ruta_cuota:
+            return
+        temporal = self._ruta_cuota + '.tmp'
+        try:
+            with open(temporal, 'w', encoding='utf-8') as f:
+                json.dump({'dia': self._dia, 'enviados': self._enviados_hoy}, f)
+            os.replace(temporal, self._ruta_cuota)
+        except OSError:
+            pass
+
+    def tomar_cupo_diario(self):
+        """Count one email against today's quota.
+
+        Returns:
+            bool: False if the daily quota is exhausted (nothing is counted)
+        """
+        if not self.limites['por_dia']:
+            return True
+        with self._bloqueo:
+            hoy = date.today().isoformat()
+            if hoy != self._dia:
+                self._dia, self._enviados_hoy = hoy, 0
+            if self._enviados_hoy >= self.limites['por_dia']:
+                return False
+            self._enviados_hoy += 1
+            self._guardar_cuota()
+            return True
+
+    def cupo_restante_hoy(self):
+        """Return how many emails can still be sent today (None if unlimited)."""
+        if not self.limites['por_dia']:
+            return None
+        with self._bloqueo:
+            if date.today().isoformat() != self._dia:
+                return self.limites['por_dia']
+            return max(0, self.limites['por_dia'] - self._enviados_hoy)
@@ -0,0 +1,180 @@
+"""
+Perfiles de posición del NIF en las nóminas.
+
+Las nóminas de un mismo proveedor imprimen el D.N.I. siempre en el mismo
+sitio. Este módulo aprende ese recuadro en las primeras páginas a partir de
+una etiqueta ancla ("D.N.I.", "N.I.F."...) y lo guarda por huella de
+maquetación, de forma que el mes siguiente se reutiliza sin volver a
+aprender.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from utils.logger import log_info, log_warning
+
+
+# Se guarda junto a settings.ini, en el directorio de trabajo de la aplicación
+ARCHIVO_PERFILES = 'perfiles_nif.json'
+
+# Etiquetas que preceden al NIF, de más a menos específica
+ANCLAS_NIF = ("D.N.I.", "N.I.F.", "DNI", "NIF")
+
+# Páginas usadas para aprender y validar la posición del NIF
+PAGINAS_APRENDIZAJE = 3
+
+# Diferencia máxima (en puntos) entre las posiciones aprendidas en cada página
+TOLERANCIA_POSICION = 10
+
+# Holgura añadida al recuadro aprendido (en puntos)
+MARGEN_REGION = 3
+
+
+def _huella_maquetacion(pagina, ancla, rect_ancla):
+    """Compute the layout fingerprint of a page from its anchor label."""
+    clave = (
+        f"{pagina.rect.width:.0f}x{pagina.rect.height:.0f}|{ancla}|"
+        f"{rect_ancla.x0:.0f},{rect_ancla.y0:.0f}"
+    )
+    return hashlib.sha1(clave.encode('utf-8')).hexdigest()[:16]
+
+
+def _buscar_ancla(pagina):
+    """Return (anchor, rect) of the first NIF label found on a page."""
+    for ancla in ANCLAS_NIF:
+        rects = pagina.search_for(ancla)
+        if rects:
+            return ancla, rects[0]
+    return None, None
+
+
+def _rect_nif_junto_a_ancla(pagina, rect_ancla, es_nif):
+    """Find the NIF word closest to the anchor, to its right or below it.
+
+    Args:
+        pagina (fitz.Page): Page to inspect
+        rect_ancla (fitz.Rect): Position of the anchor label
+        es_nif (callable): Returns the NIF contained in a word, or None
+
+    Returns:
+        tuple: (x0, y0, x1, y1) of the NIF word, None if not found
+    """
+    mejor = None
+    mejor_distancia = None
+    for x0, y0, x1, y1, palabra, *_ in pagina.get_text("words"):
+        if not es_nif(palabra):
+            continue
+        # Solo se consideran palabras a la derecha o por debajo de la etiqueta
+        if x0 < rect_ancla.x0 - MARGEN_REGION or y0 < rect_ancla.y0 - MARGEN_REGION:
+            continue
+        distancia = max(0, x0 - rect_ancla.x1) + 2 * max(0, y0 - rect_ancla.y1)
+        if mejor_distancia is None or distancia < mejor_distancia:
+            mejor = (x0, y0, x1, y1)
+            mejor_distancia = distancia
+    return mejor
+
+
+def aprender_region_nif(doc, es_nif):
+    """Learn where the NIF is printed using the first pages of a document.
+
+    The NIF must be found at (almost) the same position on every learning
+    page; otherwise the layout is not considered stable and no region is
+    returned.
+
+    Args:
+        doc (fitz.Document): Master PDF document
+        es_nif (callable): Returns the NIF contained in a word, or None
+
+    Returns:
+        list: [x0, y0, x1, y1] region containing the NIF, None if not learned
+    """
+    rects = []
+    for num_pagina in range(min(PAGINAS_APRENDIZAJE, len(doc))):
+        pagina = doc.load_page(num_pagina)
+        _, rect_ancla = _buscar_ancla(pagina)
+        if rect_ancla is None:
+            continue
+        rect = _rect_nif_junto_a_ancla(pagina, rect_ancla, es_nif)
+        if rect:
+            rects.append(rect)
+
+    if not rects:
+        return None
+
+    for coordenada in range(4):
+        valores = [rect[coordenada] for rect in rects]
+        if max(valores) - min(valores) > TOLERANCIA_POSICION:
+            log_warning("[ADVERTENCIA] La posición del NIF varía entre páginas, no se usará región")
+            return None
+
+    # El recuadro se amplía a la derecha por si hay NIFs impresos más anchos
+    ancho = max(rect[2] for rect in rects) - min(rect[0] for rect in rects)
+    region = [
+        min(rect[0] for rect in rects) - MARGEN_REGION,
+        min(rect[1] for rect in rects) - MARGEN_REGION,
+        max(rect[2] for rect in rects) + ancho / 2 + MARGEN_REGION,
+        max(rect[3] for rect in rects) + MARGEN_REGION,
+    ]
+    return [round(valor, 1) for valor in region]
+
+
+def _cargar_perfiles():
+    """Load the stored layout profiles, empty dict if none or unreadable."""
+    if not os.path.exists(ARCHIVO_PERFILES):
+        return {}
+    try:
+        with open(ARCHIVO_PERFILES, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _guardar_perfil(huella, perfil):
+    """Store a layout profile, ignoring write errors (it's only a cache)."""
+    perfiles = _cargar_perfiles()
+    perfiles[huella] = perfil
+    try:
+        with open(ARCHIVO_PERFILES, 'w', encoding='utf-8') as f:
+            json.dump(perfiles, f, indent=2)
+    except OSError as e:
+        log_warning(f"[ADVERTENCIA] No se pudo guardar el perfil de NIF: {e}")
+
+
+def obtener_region_nif(doc, es_nif):
+    """Return the NIF region for a document, learning it if necessary.
+
+    Looks up the cached profile for the document's layout fingerprint and
+    learns (and caches) a new one when there is none.
+
+    Args:
+        doc (fitz.Document): Master PDF document
+        es_nif (callable): Returns the NIF contained in a word, or None
+
+    Returns:
+        list: [x0, y0, x1, y1] region containing the NIF, None if unknown
+    """
+    if len(doc) == 0:
+        return None
+
+    primera_pagina = doc.load_page(0)
+    ancla, rect_ancla = _buscar_ancla(primera_pagina)
+    if ancla is None:
+        log_info("No se encontró etiqueta de NIF, se usará el texto completo de cada página")
+        return None
+
+    huella = _huella_maquetacion(primera_pagina, ancla, rect_ancla)
+    perfil = _cargar_perfiles().get(huella)
+    if perfil:
+        log_info(f"Perfil de NIF reutilizado para la maquetación {huella}")
+        return perfil['region']
+
+    region = aprender_region_nif(doc, es_nif)
+    if region:
+        log_info(f"Perfil de NIF aprendido para la maquetación {huella}: {region}")
+        _guardar_perfil(huella, {
+            'ancla': ancla,
+            'region': region,
+            'actualizado': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        })
+    return region
@@ -0,0 +1,532 @@
+"""
+Preparación de las nóminas individuales cifradas para el envío.
+
+Separa cada página del PDF maestro, la cifra con el NIF del empleado y la
+guarda en la carpeta de enviados. Para envíos grandes las nóminas se
+preparan por adelantado en un pool de procesos (cada uno con su propio
+documento ``fitz``) mientras el hilo de envío va mandando las que ya están
+listas, de modo que el cifrado y la espera de la red se solapan.
+
+También pueden prepararse todas antes de enviar ("preparar ahora, enviar
+después"): se guarda un manifiesto con el archivo, el destinatario y el hash
+de cada nómina, y el envío posterior solo adjunta y transmite.
+
+Cada página extraída con ``insert_pdf`` arrastra copias completas de las
+fuentes e imágenes del maestro, así que la nómina se guarda con el nivel de
+optimización configurado (limpieza de objetos, compresión, subconjunto de
+fuentes y, opcionalmente, reducción de imágenes) y se recomprime si supera
+el tamaño máximo de adjunto.
+
+Este módulo se importa en los procesos del pool: no debe importar el logger
+ni nada de la interfaz a nivel de módulo.
+"""
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import fitz  # PyMuPDF
+
+from .formato_archivos import generar_nombre_archivo
+
+
+# Por debajo de este número de nóminas por proceso no compensa arrancar el pool
+NOMINAS_MINIMAS_POR_PROCESO = 20
+
+# Nóminas preparadas por adelantado por cada proceso (límite de la cola)
+NOMINAS_EN_COLA_POR_PROCESO = 4
+
+# Se guarda en la carpeta del mes, junto a pdfs_enviados
+ARCHIVO_MANIFIESTO = 'manifiesto_nominas.json'
+
+# Opciones de guardado de PyMuPDF de cada nivel de [PDF] optimizacion
+NIVELES_OPTIMIZACION = {
+    'ninguna': {},
+    'basica': {'garbage': 3, 'deflate': True},
+    'maxima': {
+        'garbage': 4, 'deflate': True, 'deflate_images': True, 'deflate_fonts': True,
+        'clean': True, 'use_objstms': 1},
+}
+
+# Resolución de las imágenes al recomprimir una nómina que supera el tamaño máximo
+DPI_RECOMPRESION = 96
+
+# Documento maestro abierto en cada proceso del pool
+_doc_proceso = None
+
+
+def opciones_preparacion(config):
+    """Read the options needed to prepare the payslips from the configuration.
+
+    The options are a plain dict so they can be sent to the pool processes.
+
+    Args:
+        config (ConfigParser): Application configuration
+
+    Returns:
+        dict: 'plantilla_archivo', 'password_autor' and 'optimizacion' (see
+            obtener_optimizacion())
+    """
+    return {
+        'plantilla_archivo': config.get(
+            'Formato', 'archivo_nomina', fallback='{nombre}_Nomina_{mes}_{año}.pdf'),
+        'password_autor': config.get('PDF', 'password_autor', fallback=''),
+        'optimizacion': obtener_optimizacion(config),
+    }
+
+
+def obtener_optimizacion(config):
+    """Read how the single-page payslips are optimized from the configuration.
+
+    Reads ``optimizacion`` (ninguna, basica or maxima), ``reducir_imagenes_dpi``
+    (0 keeps the images as they are) and ``tamano_maximo_adjunto_kb`` (0 means
+    no limit) from the ``[PDF]`` section.
+
+    Args:
+        config (ConfigParser): Application configuration, may be None
+
+    Returns:
+        dict: 'nivel', 'dpi_imagenes' and 'tamano_maximo' (in bytes)
+    """
+    nivel = 'basica'
+    dpi_imagenes = 0
+    tamano_maximo_kb = 0
+    if config is not None:
+        nivel = config.get('PDF', 'optimizacion', fallback=nivel).strip().lower()
+        try:
+            dpi_imagenes = int(config.get('PDF', 'reducir_imagenes_dpi', fallback='0'))
+        except ValueError:
+            dpi_imagenes = 0
+        try:
+            tamano_maximo_kb = int(config.get('PDF', 'tamano_maximo_adjunto_kb', fallback='0'))
+        except ValueError:
+            tamano_maximo_kb = 0
+    if nivel not in NIVELES_OPTIMIZACION:
+        nivel = 'basica'
+    return {
+        'nivel': nivel,
+        'dpi_imagenes': max(0, dpi_imagenes),
+        'tamano_maximo': max(0, tamano_maximo_kb) * 1024,
+    }
+
+
+def opciones_guardado(nivel):
+    """Return the PyMuPDF save options of an optimization level."""
+    return dict(NIVELES_OPTIMIZACION.get(nivel, NIVELES_OPTIMIZACION['basica']))
+
+
+def nombre_archivo_nomina(tarea, plantilla_archivo):
+    """Build the file name of a task's payslip from the name template.
+
+    Args:
+        tarea (dict): Task with 'nombre' and optionally 'apellidos'
+        plantilla_archivo (str): File name template ([Formato] archivo_nomina)
+
+    Returns:
+        str: File name of the payslip
+    """
+    nombre = tarea['nombre']
+    apellido_empleado = tarea.get('apellidos', '')
+    if not apellido_empleado and ' ' in nombre:
+        # Si no hay apellido separado, intentar separar del nombre completo
+        partes = nombre.strip().split(' ', 1)
+        nombre_empleado = partes[0]
+        apellido_empleado = partes[1] if len(partes) > 1 else ''
+    else:
+        nombre_empleado = nombre
+    return generar_nombre_archivo(plantilla_archivo, nombre_empleado, apellido_empleado)
+
+
+def _reducir(doc_individual, nivel, dpi_imagenes):
+    """Shrink the fonts and images of a single-page document in place."""
+    if nivel == 'maxima':
+        # Solo los glifos usados en la página, no la fuente completa del maestro
+        doc_individual.subset_fonts()
+    if dpi_imagenes:
+        doc_individual.rewrite_images(
+            dpi_threshold=dpi_imagenes + dpi_imagenes // 2, dpi_target=dpi_imagenes, quality=75)
+
+
+def cifrar_pagina(doc_maestro, pagina, nif, password_autor='', optimizacion=None):
+    """Extract one page of the master PDF as an encrypted PDF, in memory.
+
+    Uses PyMuPDF's native AES-128 encryption (the R=4 security handler).
+    The user password is the employee's NIF; the owner password is the
+    configured author password, or the NIF if there is none.
+
+    The page is saved with the configured optimization and, if it is still
+    over the size limit, saved again at the highest level with its images
+    downsampled to DPI_RECOMPRESION. The unoptimized output is kept if it
+    happens to be smaller.
+
+    Args:
+        doc_maestro (fitz.Document): Master PDF document
+        pagina (int): Page number (1-based)
+        nif (str): Employee's NIF
+        password_autor (str): Owner password (optional)
+        optimizacion (dict): Result of obtener_optimizacion(), None to save
+            the page without optimizing it
+
+    Returns:
+        tuple: (content of the encrypted single-page PDF, size in bytes of
+            the same PDF without optimization)
+    """
+    optimizacion = optimizacion or {'nivel': 'ninguna', 'dpi_imagenes': 0, 'tamano_maximo': 0}
+    cifrado = {
+        'encryption': fitz.PDF_ENCRYPT_AES_128,
+        'owner_pw': password_autor or nif,
+        'user_pw': nif,
+        'permissions': -1,  # Todos los permisos, como con pikepdf
+    }
+    doc_individual = fitz.open()
+    try:
+        doc_individual.insert_pdf(doc_maestro, from_page=pagina - 1, to_page=pagina - 1)
+        contenido = doc_individual.tobytes(**cifrado)
+        tamano_original = len(contenido)
+
+        nivel = optimizacion['nivel']
+        if nivel != 'ninguna' or optimizacion['dpi_imagenes']:
+            _reducir(doc_individual, nivel, optimizacion['dpi_imagenes'])
+            guardado = opciones_guardado(nivel)
+            if optimizacion['dpi_imagenes']:
+                # Sin recolección de basura las imágenes originales siguen en el archivo
+                guardado.setdefault('garbage', 3)
+            optimizado = doc_individual.tobytes(**cifrado, **guardado)
+            if len(optimizado) < len(contenido):
+                contenido = optimizado
+
+        tamano_maximo = optimizacion['tamano_maximo']
+        if tamano_maximo and len(contenido) > tamano_maximo:
+            _reducir(doc_individual, 'maxima', DPI_RECOMPRESION)
+            recomprimido = doc_individual.tobytes(**cifrado, **opciones_guardado('maxima'))
+            if len(recomprimido) < len(contenido):
+                contenido = recomprimido
+        return contenido, tamano_original
+    finally:
+        doc_individual.close()
+
+
+def preparar_nomina(doc_maestro, tarea, output_dir, opciones):
+    """Encrypt a task's payslip and write it to the output folder once.
+
+    Args:
+        doc_maestro (fitz.Document): Master PDF document
+        tarea (dict): Task with 'pagina', 'nif', 'nombre' and 'apellidos'
+        output_dir (str): Folder for the encrypted payslips
+        opciones (dict): Result of opciones_preparacion()
+
+    Returns:
+        tuple: (path of the encrypted PDF, content in bytes, size in bytes
+            it would have had without optimization)
+    """
+    nombre_archivo = nombre_archivo_nomina(tarea, opciones['plantilla_archivo'])
+    ruta = os.path.join(output_dir, nombre_archivo)
+    contenido, tamano_original = cifrar_pagina(
+        doc_maestro, tarea['pagina'], tarea['nif'], opciones['password_autor'],
+        opciones.get('optimizacion'))
+    with open(ruta, 'wb') as f:
+        f.write(contenido)
+    return ruta, contenido, tamano_original
+
+
+def hash_contenido(contenido):
+    """Return the SHA-256 hash of a payslip's content."""
+    return hashlib.sha256(contenido).hexdigest()
+
+
+def huella_opciones(opciones):
+    """Return a hash of the options a payslip is built with.
+
+    Covers the file name template, the owner password and the optimization,
+    so payslips prepared with other options aren't sent. The password
+    itself isn't stored in the manifest, only this hash.
+
+    Args:
+        opciones (dict): Result of opciones_preparacion()
+    """
+    datos = json.dumps({
+        'plantilla_archivo': opciones['plantilla_archivo'],
+        'password_autor': opciones['password_autor'],
+        'optimizacion': opciones['optimizacion'],
+    }, sort_keys=True)
+    return hashlib.sha256(datos.encode('utf-8')).hexdigest()
+
+
+def entrada_manifiesto(tarea, ruta, contenido, tamano_original=None):
+    """Build the manifest entry of a prepared payslip.
+
+    Args:
+        tarea (dict): Task the payslip belongs to
+        ruta (str): Path of the encrypted PDF
+        contenido (bytes): Content written to that path
+        tamano_original (int): Size without optimization (optional)
+
+    Returns:
+        dict: Page, recipient, file name, hash and size of the payslip
+    """
+    return {
+        'pagina': tarea['pagina'],
+        'nif': tarea['nif'],
+        'email': tarea['email'],
+        'nombre': tarea['nombre'],
+        'apellidos': tarea.get('apellidos', ''),
+        'archivo': os.path.basename(ruta),
+        'sha256': hash_contenido(contenido),
+        'tamano': len(contenido),
+        'tamano_original': tamano_original or len(contenido),
+    }
+
+
+def guardar_manifiesto(carpeta_mes, pdf_path, pdf_hash, entradas, opciones):
+    """Write the manifest of the prepared payslips to the month folder.
+
+    The file is replaced atomically so an interrupted write never leaves a
+    truncated manifest.
+
+    Args:
+        carpeta_mes (str): Month folder (parent of pdfs_enviados)
+        pdf_path (str): Path to the master PDF the payslips come from
+        pdf_hash (str): Content hash of the master PDF
+        entradas (list): Entries from entrada_manifiesto()
+        opciones (dict): Options the payslips were built with (see
+            opciones_preparacion())
+
+    Returns:
+        str: Path of the manifest file
+    """
+    ruta = os.path.join(carpeta_mes, ARCHIVO_MANIFIESTO)
+    manifiesto = {
+        'pdf_maestro': os.path.basename(pdf_path),
+        'pdf_hash': pdf_hash,
+        'opciones_hash': huella_opciones(opciones),
+        'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'nominas': sorted(entradas, key=lambda entrada: entrada['pagina']),
+    }
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, indent=2, ensure_ascii=False)
+    os.replace(temporal, ruta)
+    return ruta
+
+
+def cargar_manifiesto(carpeta_mes, pdf_hash, tareas, output_dir, opciones):
+    """Return the prepared payslips that can be sent as they are.
+
+    An entry is only used when the manifest belongs to the same master PDF
+    and was built with the same options (file name template, owner password
+    and optimization), the task still has the same NIF and email, and the file is still there
+    with the same size (its hash is checked again when it is read).
+
+    Args:
+        carpeta_mes (str): Month folder (parent of pdfs_enviados)
+        pdf_hash (str): Content hash of the current master PDF
+        tareas (iterable): Tasks about to be sent
+        output_dir (str): Folder of the encrypted payslips
+        opciones (dict): Current options (see opciones_preparacion())
+
+    Returns:
+        dict: Page number -> manifest entry
+    """
+    ruta = os.path.join(carpeta_mes, ARCHIVO_MANIFIESTO)
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            manifiesto = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifiesto.get('pdf_hash') != pdf_hash:
+        return {}
+    if manifiesto.get('opciones_hash') != huella_opciones(opciones):
+        return {}
+
+    por_pagina = {entrada['pagina']: entrada for entrada in manifiesto.get('nominas', [])}
+    vigentes = {}
+    for tarea in tareas:
+        entrada = por_pagina.get(tarea['pagina'])
+        if entrada is None or entrada['nif'] != tarea['nif'] or entrada['email'] != tarea['email']:
+            continue
+        try:
+            if os.path.getsize(os.path.join(output_dir, entrada['archivo'])) != entrada['tamano']:
+                continue
+        except OSError:
+            continue
+        vigentes[tarea['pagina']] = entrada
+    return vigentes
+
+
+def leer_nomina_preparada(entrada, output_dir):
+    """Read a prepared payslip, checking it against its manifest entry.
+
+    Returns:
+        tuple: (path of the encrypted PDF, content in bytes, size in bytes
+            without optimization)
+
+    Raises:
+        ValueError: If the file changed since it was prepared
+    """
+    ruta = os.path.join(output_dir, entrada['archivo'])
+    with open(ruta, 'rb') as f:
+        contenido = f.read()
+    if hash_contenido(contenido) != entrada['sha256']:
+        raise ValueError(f"El PDF preparado ha cambiado desde su preparación: {entrada['archivo']}")
+    return ruta, contenido, entrada.get('tamano_original', len(contenido))
+
+
+def _abrir_maestro_proceso(pdf_path):
+    """Pool initializer: open the master PDF once per process."""
+    global _doc_proceso
+    _doc_proceso = fitz.open(pdf_path)
+
+
+def _preparar_en_proceso(tarea, output_dir, opciones):
+    """Prepare a payslip inside a pool process (see preparar_nomina())."""
+    return preparar_nomina(_doc_proceso, tarea, output_dir, opciones)
+
+
+def obtener_procesos_preparacion(config, num_nominas):
+    """Determine how many processes to use for preparing the payslips.
+
+    Reads ``procesos_preparacion`` from the ``[PDF]`` section, where 0 means
+    one process per CPU core and 1 prepares each payslip in the sending
+    thread right before it is sent.
+
+    Args:
+        config (ConfigParser): Application configuration, may be None
+        num_nominas (int): Number of payslips to prepare
+
+    Returns:
+        int: Number of processes to use (1 means no pool)
+    """
+    procesos = 0
+    if config is not None:
+        try:
+            procesos = int(config.get('PDF', 'procesos_preparacion', fallback='0'))
+        except ValueError:
+            procesos = 0
+
+    if procesos <= 0:
+        procesos = os.cpu_count() or 1
+
+    procesos_utiles = max(1, num_nominas // NOMINAS_MINIMAS_POR_PROCESO)
+    return max(1, min(procesos, procesos_utiles))
+
+
+def iterar_nominas_preparadas(pdf_path, tareas, output_dir, config, cancelar=None, validar=None,
+                              preparadas=None):
+    """Prepare the payslips of some tasks ahead of sending them.
+
+    Payslips are yielded in the order of ``tareas``. With a pool, a bounded
+    number of them is prepared in advance while the caller is sending the
+    previous ones. Payslips already prepared (see cargar_manifiesto()) are
+    only read from disk.
+
+    Args:
+        pdf_path (str): Path to the master PDF file
+        tareas (list): Tasks to prepare, in sending order
+        output_dir (str): Folder for the encrypted payslips
+        config (ConfigParser): Application configuration
+        cancelar (threading.Event): Stops the preparation when set (optional)
+        validar (callable): Called with each task before preparing it; if
+            it raises, that exception is yielded instead (optional)
+        preparadas (dict): Page number -> manifest entry of the payslips
+            already prepared (optional)
+
+    Yields:
+        tuple: (tarea, resultado) where resultado is (path, content, size
+            without optimization) or the exception raised while preparing
+            the payslip
+    """
+    opciones = opciones_preparacion(config)
+    preparadas = preparadas or {}
+    datos = []
+    for tarea in tareas:
+        resultado = None
+        if validar is not None:
+            try:
+                validar(tarea)
+            except Exception as e:
+                resultado = e
+        # Solo se envían a los procesos los campos necesarios, no la tarea
+        datos.append((tarea, resultado, {
+            'pagina': tarea['pagina'], 'nif': tarea['nif'],
+            'nombre': tarea['nombre'], 'apellidos': tarea.get('apellidos', '')}))
+
+    def preparar_local(doc_maestro, resultado, campos):
+        if resultado is not None:
+            return resultado
+        try:
+            entrada = preparadas.get(campos['pagina'])
+            if entrada is not None:
+                return leer_nomina_preparada(entrada, output_dir)
+            return preparar_nomina(doc_maestro, campos, output_dir, opciones)
+        except Exception as e:
+            return e
+
+    por_preparar = sum(
+        1 for _, resultado, campos in datos
+        if resultado is None and campos['pagina'] not in preparadas)
+    num_procesos = obtener_procesos_preparacion(config, por_preparar)
+    if num_procesos <= 1:
+        doc_maestro = fitz.open(pdf_path) if por_preparar else None
+        try:
+            for tarea, resultado, campos in datos:
+                if cancelar is not None and cancelar.is_set():
+                    return
+                yield tarea, preparar_local(doc_maestro, resultado, campos)
+        finally:
+            if doc_maestro is not None:
+                doc_maestro.close()
+        return
+
+    executor = ProcessPoolExecutor(
+        max_workers=num_procesos,
+        initializer=_abrir_maestro_proceso, initargs=(pdf_path,))
+    limite_cola = num_procesos * NOMINAS_EN_COLA_POR_PROCESO
+    restantes = iter(datos)
+    en_cola = deque()
+
+    def encolar():
+        """Submit the next task to the pool, if any is left."""
+        for tarea, resultado, campos in restantes:
+            futuro = None
+            if resultado is None and campos['pagina'] not in preparadas:
+                futuro = executor.submit(_preparar_en_proceso, campos, output_dir, opciones)
+            en_cola.append((tarea, resultado, campos, futuro))
+            return
+
+    try:
+        for _ in range(limite_cola):
+            encolar()
+        while en_cola:
+            tarea, resultado, campos, futuro = en_cola.popleft()
+            # Se repone la cola antes de esperar para que el pool no se pare
+            encolar()
+            if futuro is None:
+                resultado = preparar_local(None, resultado, campos)
+            else:
+                try:
+                    resultado = futuro.result()
+                except Exception as e:
+                    resultado = e
+            if cancelar is not None and cancelar.is_set():
+                if futuro is not None:
+                    _descartar(resultado)
+                return
+            yield tarea, resultado
+    finally:
+        # Al cancelar no se espera a las nóminas que aún no han empezado
+        executor.shutdown(wait=True, cancel_futures=True)
+        # Las ya preparadas que no se llegaron a entregar no se enviarán
+        for _, _, _, futuro in en_cola:
+            if futuro is not None and not futuro.cancelled() and futuro.exception() is None:
+                _descartar(futuro.result())
+
+
+def _descartar(resultado):
+    """Delete the file of a prepared payslip that won't be sent."""
+    if isinstance(resultado, tuple):
+        try:
+            os.remove(resultado[0])
+        except OSError:
+            pass
@@ -0,0 +1,154 @@
+"""
+Registro del resultado de cada tarea durante un envío.
+
+Guarda, por página, el estado del envío, el error, el nombre real del PDF
+adjunto y las horas de inicio y fin. Es la única fuente de verdad para
+saber qué nóminas se enviaron: los PDFs pendientes, las estadísticas y los
+reportes se generan a partir de él, sin contar archivos en las carpetas ni
+emparejar por nombre y email.
+"""
+from datetime import datetime
+
+
+# Estados de un resultado, en el orden en que puede pasar por ellos
+ESTADO_SIN_PROCESAR = "sin_procesar"
+ESTADO_PROCESANDO = "procesando"
+ESTADO_PREPARADO = "preparado"
+ESTADO_ENVIADO = "enviado"
+ESTADO_ERROR = "error"
+
+ESTADOS_RESULTADO = (
+    ESTADO_SIN_PROCESAR, ESTADO_PROCESANDO, ESTADO_PREPARADO, ESTADO_ENVIADO, ESTADO_ERROR
+)
+
+FORMATO_FECHA = '%Y-%m-%d %H:%M:%S'
+
+
+class ResultadoEnvio:
+    """Resultado del envío de una tarea (una página del PDF maestro)."""
+
+    __slots__ = ("pagina", "estado", "error", "archivo", "inicio", "fin")
+
+    def __init__(self, pagina):
+        self.pagina = pagina
+        self.estado = ESTADO_SIN_PROCESAR
+        self.error = ""
+        self.archivo = None
+        self.inicio = None
+        self.fin = None
+
+    def fecha_fin(self):
+        """Return when the task finished as text, or None if it didn't."""
+        return self.fin.strftime(FORMATO_FECHA) if self.fin else None
+
+    def __repr__(self):
+        return f"ResultadoEnvio(pagina={self.pagina}, estado={self.estado!r})"
+
+
+class RegistroEnvio:
+    """Resultados de las tareas de un envío, por número de página.
+
+    Todas las operaciones son O(1) y mantienen al día los contadores por
+    estado, como ``AlmacenTareas.contadores``.
+    """
+
+    def __init__(self, tareas=()):
+        self._resultados = {}
+        self.contadores = dict.fromkeys(ESTADOS_RESULTADO, 0)
+        for tarea in tareas:
+            self._resultado(tarea['pagina'])
+
+    def _resultado(self, pagina):
+        resultado = self._resultados.get(pagina)
+        if resultado is None:
+            resultado = self._resultados[pagina] = ResultadoEnvio(pagina)
+            self.contadores[ESTADO_SIN_PROCESAR] += 1
+        return resultado
+
+    def _cambiar(self, pagina, estado, fin=False, fecha=None):
+        resultado = self._resultado(pagina)
+        self.contadores[resultado.estado] -= 1
+        self.contadores[estado] += 1
+        resultado.estado = estado
+        ahora = fecha or datetime.now()
+        if resultado.inicio is None:
+            resultado.inicio = ahora
+        if fin:
+            resultado.fin = ahora
+        return resultado
+
+    def iniciar(self, pagina):
+        """Mark the task of a page as being processed."""
+        return self._cambiar(pagina, ESTADO_PROCESANDO)
+
+    def preparado(self, pagina, archivo):
+        """Record that the payslip of a page was prepared but not sent."""
+        resultado = self._cambiar(pagina, ESTADO_PREPARADO, fin=True)
+        resultado.archivo = archivo
+        resultado.error = ""
+        return resultado
+
+    def enviado(self, pagina, archivo, fecha=None):
+        """Record that the payslip of a page was sent.
+
+        Args:
+            pagina (int): Page number of the task
+            archivo (str): File name of the attached PDF
+            fecha (datetime): When it was sent, if not now (e.g. in an
+                interrupted run that is being resumed)
+        """
+        resultado = self._cambiar(pagina, ESTADO_ENVIADO, fin=True, fecha=fecha)
+        resultado.archivo = archivo
+        resultado.error = ""
+        return resultado
+
+    def fallido(self, pagina, error, archivo=None):
+        """Record that the task of a page failed.
+
+        Args:
+            pagina (int): Page number of the task
+            error (str): Error message
+            archivo (str): File name of the PDF, if it was created
+        """
+        resultado = self._cambiar(pagina, ESTADO_ERROR, fin=True)
+        resultado.error = error
+        if archivo is not None:
+            resultado.archivo = archivo
+        return resultado
+
+    def resultado(self, pagina):
+        """Return the result of a page, or None if it isn't in the run."""
+        return self._resultados.get(pagina)
+
+    def estado(self, pagina):
+        """Return the state of a page (ESTADO_SIN_PROCESAR if it isn't in the run)."""
+        resultado = self._resultados.get(pagina)
+        return resultado.estado if resultado else ESTADO_SIN_PROCESAR
+
+    def enviada(self, pagina):
+        """Check whether the payslip of a page was sent."""
+        return self.estado(pagina) == ESTADO_ENVIADO
+
+    def errores(self, tareas):
+        """Return the failed tasks as 'nombre'/'email'/'error' dicts, in task order.
+
+        Args:
+            tareas (iterable): Tasks of the run
+        """
+        errores = []
+        for tarea in tareas:
+            resultado = self._resultados.get(tarea['pagina'])
+            if resultado is not None and resultado.estado == ESTADO_ERROR:
+                errores.append({
+                    'pagina': tarea['pagina'],
+                    'nombre': tarea['nombre'],
+                    'email': tarea['email'],
+                    'error': resultado.error,
+                })
+        return errores
+
+    def __len__(self):
+        return len(self._resultados)
+
+    def __iter__(self):
+        return iter(self._resultados.values())
@@ -0,0 +1,134 @@
+"""
+Cola de reintentos aplazados para los fallos temporales de envío.
+
+Cada envío se intenta una sola vez. Si falla, el fallo se clasifica por el
+código de respuesta SMTP:
+
+- 5xx (rechazo permanente: destinatario inexistente, mensaje rechazado...):
+  la nómina falla en el acto, sin reintentos.
+- 4xx, cortes de conexión y timeouts (fallos temporales): el envío pasa a
+  esta cola y se vuelve a intentar cuando vence su espera (exponencial), sin
+  bloquear a los que vienen detrás. Los que siguen en la cola al acabar la
+  pasada principal se envían en cuanto vence su espera.
+
+Un envío se intenta como mucho ``[SMTP] max_reintentos`` veces en total.
+"""
+import heapq
+import itertools
+import random
+import time
+
+from .control_ritmo import respuesta_smtp
+
+
+class FalloEnvio(Exception):
+    """Un intento de envío falló; ``temporal`` indica si puede reintentarse."""
+
+    def __init__(self, mensaje, temporal, codigo=None):
+        super().__init__(mensaje)
+        self.temporal = temporal
+        self.codigo = codigo
+
+
+def clasificar_fallo(error):
+    """Turn the exception of a failed send into a FalloEnvio.
+
+    5xx replies are permanent; 4xx replies and errors without a reply code
+    (dropped connections, timeouts...) are temporary.
+
+    Args:
+        error (Exception): Error raised while sending
+
+    Returns:
+        FalloEnvio: Classified failure
+    """
+    if isinstance(error, FalloEnvio):
+        return error
+    codigo, mensaje = respuesta_smtp(error)
+    if codigo is None:
+        return FalloEnvio(f"{type(error).__name__}: {error}", temporal=True)
+    mensaje = ' '.join(mensaje.split())
+    return FalloEnvio(f"{codigo} {mensaje}"[:150], temporal=not 500 <= codigo < 600, codigo=codigo)
+
+
+def opciones_reintento(config):
+    """Read the retry options from the ``[SMTP]`` section.
+
+    Returns:
+        dict: 'max_intentos', 'espera_inicial' and 'espera_maxima' (seconds)
+    """
+    def leer(opcion, defecto):
+        try:
+            return float(config.get('SMTP', opcion, fallback=str(defecto)))
+        except ValueError:
+            return defecto
+
+    return {
+        'max_intentos': max(1, int(leer('max_reintentos', 3))),
+        'espera_inicial': max(0.0, leer('espera_reintento', 20)),
+        'espera_maxima': max(0.0, leer('espera_reintento_maxima', 300)),
+    }
+
+
+class ColaReintentos:
+    """Envíos con un fallo temporal, ordenados por el momento del reintento.
+
+    Los elementos son las tuplas (tarea, mensaje, ruta del PDF) que devuelve
+    preparar_envio. No es segura entre hilos: la usa solo el hilo (o la
+    corrutina) que reparte los envíos.
+    """
+
+    def __init__(self, opciones):
+        self.max_intentos = opciones['max_intentos']
+        self.espera_inicial = opciones['espera_inicial']
+        self.espera_maxima = opciones['espera_maxima']
+        self._cola = []
+        self._orden = itertools.count()
+        self._intentos = {}
+        self.aplazados = 0
+
+    def aplazar(self, envio, fallo):
+        """Queue a send that failed for another attempt.
+
+        Args:
+            envio (tuple): (tarea, message, pdf path)
+            fallo (FalloEnvio): Failure of the attempt that just ended
+
+        Returns:
+            float: Seconds until the retry, or None if the send must fail now
+                (permanent failure or no attempts left)
+        """
+        pagina = envio[0]['pagina']
+        intentos = self._intentos.get(pagina, 0) + 1
+        self._intentos[pagina] = intentos
+        if not fallo.temporal or intentos >= self.max_intentos:
+            return None
+        # Espera exponencial con algo de azar para no reintentar todos a la vez
+        espera = min(self.espera_inicial * 2 ** (intentos - 1), self.espera_maxima)
+        espera *= random.uniform(0.8, 1.2)
+        heapq.heappush(self._cola, (time.monotonic() + espera, next(self._orden), envio))
+        self.aplazados += 1
+        return espera
+
+    def listos(self):
+        """Pop and return the sends whose wait has expired, oldest first."""
+        ahora = time.monotonic()
+        listos = []
+        while self._cola and self._cola[0][0] <= ahora:
+            listos.append(heapq.heappop(self._cola)[2])
+        return listos
+
+    def espera_siguiente(self):
+        """Return the seconds until the next retry is due (None if the queue is empty)."""
+        if not self._cola:
+            return None
+        return max(0.0, self._cola[0][0] - time.monotonic())
+
+    def vaciar(self):
+        """Pop and return every queued send, due or not (used when cancelling)."""
+        envios = [elemento[2] for elemento in sorted(self._cola)]
+        self._cola = []
+        return envios
+
+    def __len__(self):
+        return len(self._cola)
@@ -0,0 +1,153 @@
+"""
+Sesión de archivos de entrada cargados.
+
+El Paso 1, el Paso 2 y el análisis trabajan con los mismos dos archivos: el
+PDF maestro y el archivo de empleados. La sesión los carga una sola vez y
+guarda el documento ``fitz`` abierto, el hash de cada archivo, el formato
+detectado, la vista previa y el índice de empleados de cada mapeo de
+columnas. Todo se descarta automáticamente cuando cambia la ruta o la fecha
+de modificación del archivo.
+"""
+import os
+import threading
+
+import fitz  # PyMuPDF
+
+from logic.cache_analisis import hash_archivo
+from logic.deteccion_cabecera import detectar_cabecera, leer_muestra
+
+
+def firma_archivo(ruta):
+    """Return what identifies a loaded version of a file.
+
+    Args:
+        ruta (str): Path to the file
+
+    Returns:
+        tuple: (absolute path, modification time in ns, size in bytes)
+
+    Raises:
+        OSError: If the file can't be accessed
+    """
+    info = os.stat(ruta)
+    return os.path.abspath(ruta), info.st_mtime_ns, info.st_size
+
+
+class SesionArchivos:
+    """Entradas cargadas de un proceso, compartidas por todos los pasos.
+
+    Cada método recibe la ruta actual del archivo y reutiliza lo ya cargado
+    si el archivo no ha cambiado. Puede usarse desde el hilo de la interfaz
+    y desde el hilo del análisis; el documento ``fitz`` abierto solo debe
+    usarse desde el hilo de la interfaz.
+    """
+
+    def __init__(self):
+        self._bloqueo_pdf = threading.Lock()
+        self._bloqueo_empleados = threading.Lock()
+        self._pdf = None
+        self._empleados = None
+
+    def _entrada_pdf(self, ruta):
+        """Return the cached entry of the PDF, reloading it if it changed."""
+        firma = firma_archivo(ruta)
+        if self._pdf is None or self._pdf["firma"] != firma:
+            self._cerrar_pdf()
+            self._pdf = {"firma": firma, "documento": None, "hash": None}
+        return self._pdf
+
+    def _entrada_empleados(self, ruta):
+        """Return the cached entry of the employee file, resetting it if it changed."""
+        firma = firma_archivo(ruta)
+        if self._empleados is None or self._empleados["firma"] != firma:
+            self._empleados = {
+                "firma": firma, "formato": None, "muestra": None, "hash": None,
+                "indices": {}
+            }
+        return self._empleados
+
+    def documento_pdf(self, ruta):
+        """Return the open master PDF document.
+
+        The document stays open for the whole session; callers must not
+        close it.
+
+        Args:
+            ruta (str): Path to the master PDF file
+
+        Returns:
+            fitz.Document: Open document
+        """
+        with self._bloqueo_pdf:
+            entrada = self._entrada_pdf(ruta)
+            if entrada["documento"] is None:
+                entrada["documento"] = fitz.open(ruta)
+            return entrada["documento"]
+
+    def hash_pdf(self, ruta):
+        """Return the content hash of the master PDF (see hash_archivo())."""
+        with self._bloqueo_pdf:
+            entrada = self._entrada_pdf(ruta)
+            if entrada["hash"] is None:
+                entrada["hash"] = hash_archivo(ruta)
+            return entrada["hash"]
+
+    def hash_empleados(self, ruta):
+        """Return the content hash of the employee file (see hash_archivo())."""
+        with self._bloqueo_empleados:
+            entrada = self._entrada_empleados(ruta)
+            if entrada["hash"] is None:
+                entrada["hash"] = hash_archivo(ruta)
+            return entrada["hash"]
+
+    def formato_empleados(self, ruta):
+        """Return the header row and format of the employee file (see detectar_cabecera())."""
+        with self._bloqueo_empleados:
+            entrada = self._entrada_empleados(ruta)
+            if entrada["formato"] is None:
+                entrada["formato"] = detectar_cabecera(ruta)
+            return entrada["formato"]
+
+    def muestra_empleados(self, ruta):
+        """Return the preview and row count of the employee file (see leer_muestra())."""
+        formato = self.formato_empleados(ruta)
+        with self._bloqueo_empleados:
+            entrada = self._entrada_empleados(ruta)
+            if entrada["muestra"] is None:
+                entrada["muestra"] = leer_muestra(ruta, formato=formato)
+            return entrada["muestra"]
+
+    def indice_empleados(self, ruta, columnas_map, cargar, nifs=None):
+        """Return the employee NIF index for a column mapping.
+
+        Args:
+            ruta (str): Path to the employee file
+            columnas_map (dict): Mapping of required fields to column names
+            cargar (callable): Builds (indice, duplicados) from the path,
+                the mapping, the detected format and ``nifs`` when not
+                loaded yet
+            nifs (frozenset): NIFs the employee rows are filtered by, None
+                for the whole file
+
+        Returns:
+            tuple: (indice, duplicados) as returned by ``cargar``
+        """
+        formato = self.formato_empleados(ruta)
+        clave = (tuple(sorted(columnas_map.items())), nifs)
+        with self._bloqueo_empleados:
+            entrada = self._entrada_empleados(ruta)
+            if clave not in entrada["indices"]:
+                entrada["indices"][clave] = cargar(ruta, columnas_map, formato, nifs)
+            return entrada["indices"][clave]
+
+    def _cerrar_pdf(self):
+        if self._pdf is not None and self._pdf["documento"] is not None:
+            self._pdf["documento"].close()
+        self._pdf = None
+
+    def cerrar(self):
+        """Close the PDF document and forget everything loaded."""
+        with self._bloqueo_pdf:
+            self._cerrar_pdf()
+        with self._bloqueo_empleados:
+            self._empleados = None
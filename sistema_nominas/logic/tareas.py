@@ -0,0 +1,198 @@
+"""
+Almacén compartido de tareas de envío.
+
+Cada página del PDF maestro produce una tarea. En vez de copiar diccionarios
+entre pasos, todas las partes de la aplicación (Paso 2, Paso 3, el envío y
+los reportes) trabajan sobre un único ``AlmacenTareas`` de registros
+compactos, que mantiene al día los contadores por estado.
+"""
+
+
+# Campos de una tarea, en el orden en que se guardan
+CAMPOS_TAREA = (
+    "pagina", "nif", "nombre", "apellidos", "email", "status",
+    "posicion_original", "fecha_procesamiento"
+)
+
+ESTADO_OK = "[OK]"
+
+CLASES_ESTADO = ("ok", "error", "advertencia", "otro")
+
+
+def clase_estado(status):
+    """Classify a task status as 'ok', 'error', 'advertencia' or 'otro'.
+
+    Only the exact ESTADO_OK status is 'ok': it's the one listas() sends.
+    """
+    if status == ESTADO_OK:
+        return "ok"
+    if status.startswith("[ERROR]"):
+        return "error"
+    if status.startswith("[ADVERTENCIA]"):
+        return "advertencia"
+    return "otro"
+
+
+class Tarea:
+    """Registro compacto de una tarea (una página del PDF maestro).
+
+    Admite el acceso tipo diccionario que usaba el resto de la aplicación
+    (``tarea['email']``, ``tarea.get('apellidos', '')``). Los campos sin
+    valor (None) se comportan como claves ausentes.
+    """
+
+    __slots__ = (
+        "pagina", "nif", "nombre", "apellidos", "email", "_status",
+        "posicion_original", "fecha_procesamiento", "corregida", "_almacen"
+    )
+
+    def __init__(self, pagina, nif="N/A", nombre="N/A", apellidos="N/A",
+                 email="N/A", status="[ADVERTENCIA] Sin NIF en PDF",
+                 posicion_original=None, fecha_procesamiento=None):
+        self._almacen = None
+        self.pagina = pagina
+        self.nif = nif
+        self.nombre = nombre
+        self.apellidos = apellidos
+        self.email = email
+        self._status = status
+        self.posicion_original = posicion_original
+        self.fecha_procesamiento = fecha_procesamiento
+        self.corregida = False
+
+    @classmethod
+    def desde_dict(cls, datos):
+        """Create a task from a dict produced by the analysis."""
+        return cls(**{campo: datos[campo] for campo in CAMPOS_TAREA if campo in datos})
+
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, valor):
+        if self._almacen is not None:
+            self._almacen._cambio_estado(self._status, valor)
+        self._status = valor
+
+    def __getitem__(self, campo):
+        if campo not in CAMPOS_TAREA:
+            raise KeyError(campo)
+        valor = getattr(self, campo)
+        if valor is None:
+            raise KeyError(campo)
+        return valor
+
+    def __setitem__(self, campo, valor):
+        if campo not in CAMPOS_TAREA:
+            raise KeyError(campo)
+        setattr(self, campo, valor)
+
+    def __contains__(self, campo):
+        return campo in CAMPOS_TAREA and getattr(self, campo) is not None
+
+    def get(self, campo, defecto=None):
+        """Return a field value, or ``defecto`` if it has no value."""
+        if campo not in CAMPOS_TAREA:
+            return defecto
+        valor = getattr(self, campo)
+        return defecto if valor is None else valor
+
+    def como_dict(self):
+        """Return the task as a dict, without the fields that have no value."""
+        return {
+            campo: getattr(self, campo) for campo in CAMPOS_TAREA
+            if getattr(self, campo) is not None
+        }
+
+    def __repr__(self):
+        return f"Tarea(pagina={self.pagina}, nif={self.nif!r}, status={self._status!r})"
+
+
+class AlmacenTareas:
+    """Almacén único de las tareas de un proceso, en orden de página.
+
+    Se comporta como una lista de solo lectura de ``Tarea`` y ofrece vistas
+    (listas para envío, pendientes, por página) y contadores por clase de
+    estado que se actualizan al cambiar el estado de cualquier tarea.
+    """
+
+    def __init__(self, tareas=()):
+        self._tareas = []
+        self._posiciones = {}
+        self.contadores = dict.fromkeys(CLASES_ESTADO, 0)
+        self.agregar(tareas)
+
+    def agregar(self, tareas):
+        """Append tasks (dicts or Tarea objects) to the store.
+
+        Args:
+            tareas (iterable): Tasks to append, in page order
+
+        Returns:
+            list: The Tarea objects appended
+        """
+        nuevas = []
+        for datos in tareas:
+            tarea = datos if isinstance(datos, Tarea) else Tarea.desde_dict(datos)
+            tarea._almacen = self
+            self._posiciones[tarea.pagina] = len(self._tareas)
+            self._tareas.append(tarea)
+            self.contadores[clase_estado(tarea.status)] += 1
+            nuevas.append(tarea)
+        return nuevas
+
+    def _cambio_estado(self, anterior, nuevo):
+        self.contadores[clase_estado(anterior)] -= 1
+        self.contadores[clase_estado(nuevo)] += 1
+
+    def __len__(self):
+        return len(self._tareas)
+
+    def __iter__(self):
+        return iter(self._tareas)
+
+    def __getitem__(self, indice):
+        return self._tareas[indice]
+
+    def __bool__(self):
+        return bool(self._tareas)
+
+    def posicion(self, pagina):
+        """Return the index of the task of a page, or None."""
+        return self._posiciones.get(pagina)
+
+    def por_pagina(self, pagina):
+        """Return the task of a page, or None."""
+        indice = self._posiciones.get(pagina)
+        return None if indice is None else self._tareas[indice]
+
+    def listas(self):
+        """Return the tasks ready to be sent, in page order."""
+        return [tarea for tarea in self._tareas if clase_estado(tarea.status) == "ok"]
+
+    def pendientes(self):
+        """Return the tasks that can't be sent, in page order."""
+        return [tarea for tarea in self._tareas if clase_estado(tarea.status) != "ok"]
+
+    def corregir(self, pagina, cambios):
+        """Apply a manual correction to the task of a page.
+
+        The task becomes ready to be sent and is flagged as corrected.
+
+        Args:
+            pagina (int): Page number of the task
+            cambios (dict): New values for nif, nombre, apellidos and email
+
+        Returns:
+            Tarea: The corrected task, None if the page has no task
+        """
+        tarea = self.por_pagina(pagina)
+        if tarea is None:
+            return None
+        for campo, valor in cambios.items():
+            if campo != "status":
+                tarea[campo] = valor
+        tarea.corregida = True
+        tarea.status = ESTADO_OK
+        return tarea
@@ -1,7 +1,12 @@
-import tkinter as tk
-from ui.main_window import GestorNominasApp
+import multiprocessing
 
 if __name__ == "__main__":
+    # Required so the PDF extraction process pool works in the frozen .exe
+    multiprocessing.freeze_support()
+
+    # Imports live here so worker processes don't load the whole UI
+    from ui.main_window import GestorNominasApp
+
     # Initialize the main payroll management application
     # The application handles its own splash screen during startup
     app = GestorNominasApp()
@@ -1,6 +1,8 @@
 import tkinter as tk
 import os
+from logic.sesion_archivos import SesionArchivos
 from logic.settings import load_settings
+from logic.tareas import AlmacenTareas
 from ui.paso1 import Paso1
 from ui.paso2 import Paso2
 from ui.paso3 import Paso3
@@ -39,7 +41,9 @@ class GestorNominasApp(tk.Tk):
             "apellidos": tk.StringVar(),
             "email": tk.StringVar()
         }
-        self.tareas_verificacion = []
+        self.tareas_verificacion = AlmacenTareas()
+        self.estado_analisis = None  # Para reverificar solo lo que cambie
+        self.sesion = SesionArchivos()  # Archivos de entrada ya cargados
         
         self.paso_actual = "Paso1"
 
@@ -166,6 +170,7 @@ class GestorNominasApp(tk.Tk):
     
     def _on_closing(self):
         """Maneja el evento de cierre de la ventana."""
+        self.sesion.cerrar()
         self.destroy()
 
     def _crear_widgets(self):
@@ -1,11 +1,6 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
-import fitz  # PyMuPDF
-from logic.file_handler import (
-    leer_cabeceras_empleados, leer_archivo_empleados, analizar_archivos
-)
-from utils.sound_manager import play_error_sound
 
 
 class Paso1(tk.Frame):
@@ -246,6 +241,8 @@ class Paso1(tk.Frame):
             self.empleados_path_entry.config(state="readonly")
             
             self.actualizar_mapeo_columnas()
+            # Mostrar el mapeo antes de recorrer el archivo para el resumen
+            self.update_idletasks()
             self.actualizar_resumen_empleados()
             self.verificar_estado()
         self.actualizar_visibilidad_detalles()
@@ -253,8 +250,11 @@ class Paso1(tk.Frame):
     def actualizar_mapeo_columnas(self):
         path = self.controller.empleados_path.get()
         if path:
-            self.controller.columnas_disponibles = \
-                leer_cabeceras_empleados(path)
+            try:
+                self.controller.columnas_disponibles = \
+                    self.controller.sesion.formato_empleados(path)["cabeceras"]
+            except Exception:
+                self.controller.columnas_disponibles = []
             for combo in self.combos.values():
                 combo['values'] = self.controller.columnas_disponibles
             
@@ -423,12 +423,11 @@ class Paso1(tk.Frame):
         pdf_path = self.controller.pdf_path.get()
         if pdf_path:
             try:
-                doc = fitz.open(pdf_path)
+                doc = self.controller.sesion.documento_pdf(pdf_path)
                 self.pdf_summary_label.config(
                     text=f"OK - Archivo válido: {doc.page_count} páginas encontradas",
                     fg="#008000"
                 )
-                doc.close()
             except Exception as e:
                 self.pdf_summary_label.config(
                     text=f"ERROR - Error al leer el archivo: {str(e)[:50]}...",
@@ -439,20 +438,20 @@ class Paso1(tk.Frame):
         empleados_path = self.controller.empleados_path.get()
         if empleados_path:
             try:
-                df = leer_archivo_empleados(empleados_path)
+                muestra = self.controller.sesion.muestra_empleados(empleados_path)
                 self.employee_summary_label.config(
-                    text=f"OK - Archivo válido: {len(df)} empleados encontrados",
+                    text=f"OK - Archivo válido: {muestra['total']} empleados encontrados",
                     fg="#008000")
-                self.actualizar_vista_previa(df)
+                self.actualizar_vista_previa(muestra)
             except Exception as e:
                 self.employee_summary_label.config(
                     text=f"ERROR - Error al leer el archivo: {str(e)[:50]}...",
                     fg="#800000")
 
-    def actualizar_vista_previa(self, df):
+    def actualizar_vista_previa(self, muestra):
         self.preview_tree.delete(*self.preview_tree.get_children())
         
-        columnas = list(df.columns)
+        columnas = muestra["cabeceras"]
         self.preview_tree["columns"] = columnas
         self.preview_tree.column("#0", width=0, stretch=tk.NO)
         self.preview_tree.heading("#0", text="")
@@ -466,13 +465,13 @@ class Paso1(tk.Frame):
         # Configurar estilo para la línea de separación
         self.preview_tree.tag_configure('separator', background='#E0E0E0', foreground='#666666')
 
-        total_rows = len(df)
+        total_rows = muestra["total"]
         row_count = 0
 
         # Mostrar los 3 primeros registros
-        for i, (index, row) in enumerate(df.head(3).iterrows()):
+        for row in muestra["primeras"]:
             row_style = 'evenrow' if row_count % 2 else 'oddrow'
-            self.preview_tree.insert("", "end", values=list(row), tags=(row_style,))
+            self.preview_tree.insert("", "end", values=row, tags=(row_style,))
             row_count += 1
 
         # Si hay más de 4 registros, mostrar separador y último registro
@@ -484,14 +483,12 @@ class Paso1(tk.Frame):
             row_count += 1
             
             # Mostrar el último registro
-            last_row = df.tail(1).iloc[0]
             row_style = 'evenrow' if row_count % 2 else 'oddrow'
-            self.preview_tree.insert("", "end", values=list(last_row), tags=(row_style,))
+            self.preview_tree.insert("", "end", values=muestra["ultima"], tags=(row_style,))
         elif total_rows == 4:
-            # Si hay exactamente 4, mostrar el 4to sin separador
-            fourth_row = df.iloc[3]
+            # Si hay exactamente 4, mostrar el 4to sin separador (es el último)
             row_style = 'evenrow' if row_count % 2 else 'oddrow'
-            self.preview_tree.insert("", "end", values=list(fourth_row), tags=(row_style,))
+            self.preview_tree.insert("", "end", values=muestra["ultima"], tags=(row_style,))
 
     def verificar_estado(self, event=None):
         pdf_ok = bool(self.controller.pdf_path.get())
@@ -510,22 +507,10 @@ class Paso1(tk.Frame):
         print(f"[DEBUG] PDF: {self.controller.pdf_path.get()}")
         print(f"[DEBUG] Empleados: {self.controller.empleados_path.get()}")
         
-        res = analizar_archivos(
+        # El Paso 2 analiza los archivos en segundo plano y va mostrando las filas
+        self.controller.frames["Paso2"].iniciar_analisis(
             self.controller.pdf_path.get(),
             self.controller.empleados_path.get(),
             mapa
         )
-        
-        print(f"[DEBUG] Resultado análisis: {type(res)} con keys: {list(res.keys()) if isinstance(res, dict) else 'No dict'}")
-        
-        if "error" in res:
-            play_error_sound()
-            print(f"[DEBUG] Error en análisis: {res['error']}")
-            self.controller.show_centered_messagebox("error", "Error de Análisis", res["error"])
-            return
-            
-        self.controller.tareas_verificacion = res["tareas"]
-        print(f"[DEBUG] Tareas creadas: {len(self.controller.tareas_verificacion) if self.controller.tareas_verificacion else 0}")
-        
-        self.controller.frames["Paso2"].actualizar_tabla()
         self.controller.ir_a_paso_siguiente("Paso2")
@@ -3,8 +3,10 @@ from tkinter import ttk, messagebox, simpledialog
 import fitz  # PyMuPDF
 import io
 import os
+import queue
 import sys
 import subprocess
+import threading
 try:
     from PIL import Image, ImageTk
     PIL_AVAILABLE = True
@@ -16,9 +18,17 @@ except Exception as e:
     PIL_AVAILABLE = False
     print(f"[DEBUG] Error cargando PIL: {e}")
 
+from logic.tareas import AlmacenTareas
 from utils.sound_manager import play_warning_sound, play_error_sound
 
 
+# Intervalo entre lotes al llenar la tabla durante el análisis
+FRECUENCIA_LLENADO_MS = 50
+
+# Filas insertadas como máximo en cada intervalo, para no congelar la ventana
+FILAS_POR_CICLO = 500
+
+
 class ToolTipButton:
     """Clase para crear tooltips activados por botón."""
     def __init__(self, button, text):
@@ -88,7 +98,8 @@ class Paso2(tk.Frame):
     def __init__(self, parent, controller):
         super().__init__(parent, bg="#f0f0f0")
         self.controller = controller
-        self.datos_corregidos = {}  # Para almacenar correcciones manuales
+        self.datos_corregidos = {}  # Correcciones manuales, para reaplicarlas al reverificar
+        self.cancelar_analisis = None  # Evento para detener el análisis en curso
         
         # --- Título y Explicación ---
         titulo_frame = tk.Frame(self, bg="#f0f0f0")
@@ -311,7 +322,7 @@ los archivos originales."""
         self.btn_anterior = tk.Button(
             buttons_container, text="< Anterior",
             font=("MS Sans Serif", 8), width=12, height=2,
-            command=lambda: self.controller.ir_a_paso_siguiente("Paso1"),
+            command=self.ir_a_paso1,
             relief="raised", bd=2, bg="#e0e0e0"
         )
         self.btn_anterior.pack(side="left", padx=(0, 8))
@@ -324,6 +335,118 @@ los archivos originales."""
         )
         self.btn_siguiente.pack(side="left")
 
+    def iniciar_analisis(self, pdf_path, empleados_path, mapa):
+        """Analiza los archivos en un hilo y va llenando la tabla por lotes."""
+        self.detener_analisis()
+        
+        self.datos_corregidos = {}
+        self.controller.tareas_verificacion = AlmacenTareas()
+        self.controller.estado_analisis = None
+        self.tree.delete(*self.tree.get_children())
+        self.actualizar_estadisticas(0, 0, 0)
+        self.btn_siguiente.config(state="disabled")
+        self.btn_actualizar.config(state="disabled")
+        
+        cola = queue.Queue()
+        self.cancelar_analisis = threading.Event()
+        threading.Thread(
+            target=self._analisis_worker,
+            args=(pdf_path, empleados_path, mapa, self.controller.config,
+                  self.controller.sesion, self.cancelar_analisis, cola),
+            daemon=True
+        ).start()
+        self.after(FRECUENCIA_LLENADO_MS, self._procesar_cola_analisis, cola, self.cancelar_analisis)
+
+    def detener_analisis(self):
+        """Detiene el análisis en curso, si lo hay."""
+        if self.cancelar_analisis is not None:
+            self.cancelar_analisis.set()
+            self.cancelar_analisis = None
+
+    @staticmethod
+    def _analisis_worker(pdf_path, empleados_path, mapa, config, sesion, cancelar, cola):
+        """Ejecuta el análisis progresivo y deja sus resultados en la cola."""
+        from logic.file_handler import iterar_analisis
+        try:
+            for parcial in iterar_analisis(
+                    pdf_path, empleados_path, mapa, config, cancelar, sesion):
+                if "tareas" not in parcial:
+                    cola.put(parcial)
+                    continue
+                # Los resultados en caché llegan de golpe: se trocean para la tabla
+                tareas = parcial["tareas"]
+                for inicio in range(0, len(tareas), FILAS_POR_CICLO):
+                    cola.put({"tareas": tareas[inicio:inicio + FILAS_POR_CICLO]})
+        except Exception as e:
+            cola.put({"error": f"Error analizando los archivos:\n{e}"})
+
+    def _procesar_cola_analisis(self, cola, cancelar):
+        """Inserta en la tabla los lotes recibidos sin bloquear la ventana."""
+        if cancelar.is_set():
+            return
+        
+        tareas = self.controller.tareas_verificacion
+        filas_insertadas = 0
+        try:
+            while filas_insertadas < FILAS_POR_CICLO:
+                parcial = cola.get_nowait()
+                
+                if "error" in parcial:
+                    self.cancelar_analisis = None
+                    self.btn_actualizar.config(state="normal")
+                    play_error_sound()
+                    self.controller.show_centered_messagebox(
+                        "error", "Error de Análisis", parcial["error"])
+                    self.controller.ir_a_paso_siguiente("Paso1")
+                    return
+                
+                if "estado" in parcial:
+                    self.cancelar_analisis = None
+                    self.controller.estado_analisis = parcial["estado"]
+                    self.btn_actualizar.config(state="normal")
+                    self._finalizar_llenado()
+                    return
+                
+                primera_fila = len(tareas)
+                for i, tarea in enumerate(tareas.agregar(parcial["tareas"]), primera_fila):
+                    valores, tags = self._datos_fila(i, tarea)
+                    self.tree.insert("", "end", values=valores, tags=tags)
+                filas_insertadas += len(parcial["tareas"])
+        except queue.Empty:
+            pass
+        
+        if filas_insertadas:
+            ok_count, problem_count = self._contar_estados()
+            self.actualizar_estadisticas(len(tareas), ok_count, problem_count)
+        self.after(FRECUENCIA_LLENADO_MS, self._procesar_cola_analisis, cola, cancelar)
+
+    def _finalizar_llenado(self):
+        """Actualiza estadísticas, sonido y navegación al terminar el análisis."""
+        total = len(self.controller.tareas_verificacion)
+        if not total:
+            messagebox.showinfo(
+                "Sin Datos",
+                "No hay datos para verificar.\n\n"
+                "Asegúrese de haber seleccionado los archivos correctos en el Paso 1."
+            )
+            return
+        
+        ok_count, problem_count = self._contar_estados()
+        self.actualizar_estadisticas(total, ok_count, problem_count)
+        
+        # Sonido de advertencia si hay problemas detectados
+        if problem_count > 0:
+            play_warning_sound()
+        
+        # Habilitar botón siguiente si hay al menos uno OK
+        self.btn_siguiente.config(state="normal" if ok_count > 0 else "disabled")
+
+    def ir_a_paso1(self):
+        """Vuelve al paso 1, deteniendo el análisis si sigue en curso."""
+        self.detener_analisis()
+        self.btn_actualizar.config(state="normal")
+        self.controller.ir_a_paso_siguiente("Paso1")
+
     def actualizar_tabla(self):
         """Actualiza la tabla de verificación con los datos procesados."""
         print("[DEBUG] Paso2.actualizar_tabla() iniciado")
@@ -347,59 +470,20 @@ los archivos originales."""
         
         # Contadores para estadísticas
         total = len(self.controller.tareas_verificacion)
-        ok_count = 0
-        error_count = 0
-        warning_count = 0
         
         # Llenar tabla con datos
         for i, tarea in enumerate(self.controller.tareas_verificacion):
-            row_style = 'evenrow' if i % 2 == 0 else 'oddrow'
-            pagina = tarea["pagina"]
-            
-            # Verificar si hay corrección manual primero
-            if pagina in self.datos_corregidos:
-                correcciones = self.datos_corregidos[pagina]
-                tarea_mostrada = tarea.copy()
-                tarea_mostrada.update(correcciones)
-                # Usar estado corregido
-                status = correcciones.get("status", tarea["status"])
-                tarea_mostrada["status"] = status
-            else:
-                tarea_mostrada = tarea
-                status = tarea["status"]
-            
-            # Determinar estilo y contar (solo UNA vez por tarea)
-            if status.startswith("[OK]"):
-                status_tag = 'ok'
-                ok_count += 1
-            elif status.startswith("[ERROR]"):
-                status_tag = 'error'
-                error_count += 1
-            elif status.startswith("[ADVERTENCIA]"):
-                status_tag = 'warning' 
-                warning_count += 1
-            else:
-                status_tag = row_style
-            
+            valores, tags = self._datos_fila(i, tarea)
             # Insertar fila con orden específico de columnas
-            self.tree.insert(
-                "", "end",
-                values=(
-                    tarea_mostrada["pagina"],
-                    tarea_mostrada["nif"], 
-                    tarea_mostrada["nombre"],
-                    tarea_mostrada.get("apellidos", "N/A"),  # Apellidos puede no existir en datos antiguos
-                    tarea_mostrada["email"],
-                    tarea_mostrada["status"]
-                ),
-                tags=(row_style, status_tag)
-            )
+            self.tree.insert("", "end", values=valores, tags=tags)
+        
+        ok_count, problem_count = self._contar_estados()
         
         # Actualizar estadísticas
-        self.actualizar_estadisticas(total, ok_count, error_count + warning_count)
+        self.actualizar_estadisticas(total, ok_count, problem_count)
         
         # Sonido de advertencia si hay problemas detectados
-        if (error_count + warning_count) > 0 and total > 0:
+        if problem_count > 0 and total > 0:
             play_warning_sound()
         
         # Habilitar botón siguiente si hay al menos uno OK
@@ -408,6 +492,55 @@ los archivos originales."""
         else:
             self.btn_siguiente.config(state="disabled")
 
+    def actualizar_filas(self, paginas):
+        """Actualiza solo las filas de las páginas indicadas."""
+        tareas = self.controller.tareas_verificacion
+        filas = self.tree.get_children()
+        if len(filas) != len(tareas):
+            self.actualizar_tabla()
+            return
+        
+        for pagina in paginas:
+            i = tareas.posicion(pagina)
+            if i is None:
+                continue
+            valores, tags = self._datos_fila(i, tareas[i])
+            self.tree.item(filas[i], values=valores, tags=tags)
+        
+        ok_count, problem_count = self._contar_estados()
+        self.actualizar_estadisticas(len(tareas), ok_count, problem_count)
+        self.btn_siguiente.config(state="normal" if ok_count > 0 else "disabled")
+
+    def _datos_fila(self, i, tarea):
+        """Calcula los valores y etiquetas de la fila de una tarea."""
+        row_style = 'evenrow' if i % 2 == 0 else 'oddrow'
+        status = tarea.status
+        
+        # Determinar estilo
+        if status.startswith("[OK]"):
+            status_tag = 'ok'
+        elif status.startswith("[ERROR]"):
+            status_tag = 'error'
+        elif status.startswith("[ADVERTENCIA]"):
+            status_tag = 'warning'
+        else:
+            status_tag = row_style
+        
+        valores = (
+            tarea.pagina,
+            tarea.nif, 
+            tarea.nombre,
+            tarea.get("apellidos", "N/A"),  # Apellidos puede no existir en datos antiguos
+            tarea.email,
+            "[OK] Corregido manualmente" if tarea.corregida else status
+        )
+        return valores, (row_style, status_tag)
+
+    def _contar_estados(self):
+        """Devuelve las tareas listas para envío y las que tienen problemas."""
+        contadores = self.controller.tareas_verificacion.contadores
+        return contadores["ok"], contadores["error"] + contadores["advertencia"]
+
     def actualizar_estadisticas(self, total, ok_count, problem_count):
         """Actualiza las etiquetas de estadísticas."""
         self.total_label.config(text=f"Total: {total}")
@@ -455,7 +588,8 @@ los archivos originales."""
                 
             print(f"[DEBUG] Creando preview de página {pagina_num}")
             
-            doc = fitz.open(pdf_path)
+            # Documento ya abierto en la sesión: no se cierra aquí
+            doc = self.controller.sesion.documento_pdf(pdf_path)
             page = doc.load_page(pagina_num - 1)  # pagina_num es 1-indexed
             
             # Renderizar página a imagen
@@ -483,7 +617,6 @@ los archivos originales."""
             photo = ImageTk.PhotoImage(pil_image)
             print("[DEBUG] PhotoImage creado exitosamente")
             
-            doc.close()
             return photo
             
         except Exception as e:
@@ -683,17 +816,18 @@ los archivos originales."""
                 messagebox.showerror("Error", "El email no tiene un formato válido.")
                 return
             
-            # Guardar corrección
+            # Guardar corrección directamente en las tareas
             self.datos_corregidos[int(pagina)] = {
                 "nif": var_nif.get().strip(),
                 "nombre": var_nombre.get().strip(),
                 "apellidos": var_apellidos.get().strip(),
-                "email": var_email.get().strip(),
-                "status": "[OK] Corregido manualmente"
+                "email": var_email.get().strip()
             }
+            self.controller.tareas_verificacion.corregir(
+                int(pagina), self.datos_corregidos[int(pagina)])
             
             ventana.destroy()
-            self.actualizar_tabla()
+            self.actualizar_filas([int(pagina)])
             messagebox.showinfo("Éxito", "Datos corregidos correctamente.")
         
         def cancelar():
@@ -707,33 +841,50 @@ los archivos originales."""
         
 
     def reverificar_datos(self):
-        """Vuelve a ejecutar el análisis de archivos."""
+        """Vuelve a analizar los archivos, actualizando solo lo que haya cambiado."""
         if messagebox.askyesno(
             "Reverificar Datos",
             "¿Desea volver a analizar los archivos?\n\n"
-            "Esto eliminará todas las correcciones manuales realizadas."
+            "Se perderán las correcciones manuales de las filas que cambien."
         ):
-            # Limpiar correcciones manuales
-            self.datos_corregidos = {}
-            
-            # Re-ejecutar análisis
-            from logic.file_handler import analizar_archivos
+            # Re-ejecutar solo las etapas del análisis cuyos archivos cambiaron
+            from logic.file_handler import reverificar_archivos
             
             mapa = {k: v.get() for k, v in self.controller.mapa_columnas.items()}
-            res = analizar_archivos(
+            res = reverificar_archivos(
                 self.controller.pdf_path.get(),
                 self.controller.empleados_path.get(),
-                mapa
+                mapa,
+                self.controller.estado_analisis,
+                self.controller.config,
+                self.controller.sesion
             )
             
             if "error" in res:
                 messagebox.showerror("Error de Análisis", res["error"])
                 return
                 
-            self.controller.tareas_verificacion = res["tareas"]
-            self.actualizar_tabla()
+            tareas = AlmacenTareas(res["tareas"])
+            self.controller.tareas_verificacion = tareas
+            self.controller.estado_analisis = res["estado"]
+            paginas = res["paginas_actualizadas"]
+            
+            if res["completa"]:
+                # El PDF cambió: las correcciones por página ya no son válidas
+                self.datos_corregidos = {}
+                self.actualizar_tabla()
+            else:
+                for pagina in paginas:
+                    self.datos_corregidos.pop(pagina, None)
+                for pagina, correcciones in self.datos_corregidos.items():
+                    tareas.corregir(pagina, correcciones)
+                self.actualizar_filas(paginas)
             
-            messagebox.showinfo("Completado", "Datos reverificados correctamente.")
+            messagebox.showinfo(
+                "Completado",
+                f"Datos reverificados correctamente.\n\n"
+                f"Filas actualizadas: {len(paginas)}"
+            )
 
     def abrir_pdf_completo(self):
         """Abre el PDF maestro con el visualizador del sistema."""
@@ -987,18 +1138,5 @@ los archivos originales."""
 
 
     def ir_a_paso3(self):
-        """Navega al paso 3 aplicando las correcciones manuales."""
-        # Aplicar correcciones a las tareas originales
-        for i, tarea in enumerate(self.controller.tareas_verificacion):
-            pagina = tarea["pagina"]
-            if pagina in self.datos_corregidos:
-                correcciones = self.datos_corregidos[pagina]
-                # Actualizar la tarea original con las correcciones
-                for key, value in correcciones.items():
-                    if key != "status":  # No sobrescribir el estado automático
-                        tarea[key] = value
-                # Si fue corregido manualmente, marcarlo como OK
-                if correcciones.get("status"):
-                    tarea["status"] = "[OK]"
-        
+        """Navega al paso 3 (las correcciones ya están aplicadas a las tareas)."""
         self.controller.ir_a_paso_siguiente("Paso3")
\ No newline at end of file
@@ -3,7 +3,10 @@ from tkinter import ttk, messagebox
 import threading
 import queue
 from datetime import datetime
-from logic.email_sender import enviar_nominas_worker
+from logic.email_sender import (
+    ejecucion_interrumpida, enviar_nominas_worker, nominas_ya_preparadas, preparar_nominas_worker
+)
+from logic.diario_envio import descartar_ejecucion, ya_enviada
 from logic.formato_archivos import generar_nombre_archivo
 from utils.sound_manager import play_success_sound, play_error_sound, play_warning_sound
 
@@ -13,7 +16,6 @@ class Paso3(tk.Frame):
         super().__init__(parent)
         self.controller = controller
         self.email_to_item_id = {}
-        self.email_to_data = {}  # Almacenar datos originales
         self.update_queue = queue.Queue()
         
         # Estadísticas para el resumen final
@@ -70,6 +72,8 @@ class Paso3(tk.Frame):
         self.tree.tag_configure('sent', background='#d4edda')
         self.tree.tag_configure('error', background='#f8d7da')
         self.tree.tag_configure('processing', background='#fff3cd')
+        self.tree.tag_configure('prepared', background='#d6eaf8')
+        self.tree.tag_configure('deferred', background='#e2e3e5')
 
         # --- Progress Bar ---
         progress_frame = ttk.Frame(self)
@@ -78,6 +82,10 @@ class Paso3(tk.Frame):
             progress_frame, orient="horizontal", mode="determinate"
         )
         self.progress_bar.pack(fill="x", expand=True)
+        
+        # Ritmo y conexiones actuales del envío (control adaptativo)
+        self.ritmo_label = tk.Label(progress_frame, text="", font=("MS Sans Serif", 8), anchor="w")
+        self.ritmo_label.pack(fill="x")
 
         # --- Botones de Acción ---
         action_frame = tk.Frame(self)
@@ -106,6 +114,15 @@ class Paso3(tk.Frame):
             relief="raised", bd=2, bg="#e0e0e0"
         )
         self.send_all_button.pack(side="right")
+        
+        # Preparar ahora los PDFs cifrados y enviarlos más tarde
+        self.prepare_button = tk.Button(
+            action_frame, text="Preparar PDFs",
+            command=self.iniciar_preparacion,
+            font=("MS Sans Serif", 8), width=15, height=2,
+            relief="raised", bd=2, bg="#e0e0e0"
+        )
+        self.prepare_button.pack(side="right", padx=(0, 5))
 
         self.controller.bind("<<ShowPaso3>>", self.actualizar_tabla_envio)
         
@@ -113,6 +130,8 @@ class Paso3(tk.Frame):
         self.enviando = False
         self.stop_event = None  # Para cancelación de envío
         self.estadisticas_finales_recibidas = False  # Flag para estadísticas
+        self.modo_preparacion = False  # True mientras solo se preparan los PDFs
+        self.reanudacion = None  # Ejecución interrumpida que se va a reanudar
 
     def ir_anterior(self):
         """Navegar al paso anterior con validación."""
@@ -147,6 +166,7 @@ class Paso3(tk.Frame):
         
         # Mostrar botón cancelar y ocultar enviar
         self.send_all_button.pack_forget()
+        self.prepare_button.pack_forget()
         self.btn_cancelar.pack(side="right", padx=(5, 0))
     
     def desbloquear_navegacion(self):
@@ -163,6 +183,7 @@ class Paso3(tk.Frame):
         # Ocultar botón cancelar y mostrar enviar
         self.btn_cancelar.pack_forget()
         self.send_all_button.pack(side="right")
+        self.prepare_button.pack(side="right", padx=(0, 5))
     
     def detener_envio(self):
         """Detiene el proceso de envío en curso."""
@@ -193,18 +214,26 @@ class Paso3(tk.Frame):
         
         self.tree.delete(*self.tree.get_children())
         self.email_to_item_id = {}
-        self.email_to_data = {}
         
-        tareas_ok = [
-            t for t in self.controller.tareas_verificacion
-            if t['status'] == '[OK]'
-        ]
-        # Ordenar por página para mostrar de arriba hacia abajo
-        tareas_ok.sort(key=lambda x: x['pagina'])
+        # Vista de las tareas listas, ya ordenadas por página
+        tareas_ok = self.controller.tareas_verificacion.listas()
         if not tareas_ok:
             self.send_all_button.config(state="disabled")
+            self.prepare_button.config(state="disabled")
         else:
             self.send_all_button.config(state="normal")
+            self.prepare_button.config(state="normal")
+        
+        # Nóminas de este PDF ya preparadas en una ejecución anterior
+        preparadas = {}
+        pdf_path = self.controller.pdf_path.get()
+        if tareas_ok and pdf_path:
+            try:
+                preparadas = nominas_ya_preparadas(
+                    pdf_path, tareas_ok, self.controller.config,
+                    pdf_hash=self.controller.sesion.hash_pdf(pdf_path))
+            except OSError:
+                preparadas = {}
 
         for i, tarea in enumerate(tareas_ok):
             # Generar nombre de archivo como se hará en el envío
@@ -222,6 +251,10 @@ class Paso3(tk.Frame):
                 nombre_empleado = nombre
             
             nombre_archivo = generar_nombre_archivo(plantilla_archivo, nombre_empleado, apellido_empleado)
+            estado, tags = "Pendiente", ()
+            preparada = preparadas.get(tarea['pagina'])
+            if preparada:
+                nombre_archivo, estado, tags = preparada['archivo'], "Preparado", ('prepared',)
             
             item_id = self.tree.insert(
                 "", "end",
@@ -230,15 +263,56 @@ class Paso3(tk.Frame):
                     tarea.get("apellidos", ""),
                     tarea["email"],
                     nombre_archivo,
-                    "Pendiente"
-                )
+                    estado
+                ),
+                tags=tags
             )
             
             # Usar un mapeo único por página en lugar de email (que puede repetirse)
             unique_key = f"pagina_{tarea['pagina']}"
             self.email_to_item_id[unique_key] = item_id
-            # Guardar los datos originales
-            self.email_to_data[unique_key] = (tarea["nombre"], tarea["email"], "[OK]")
+        
+        self.ofrecer_reanudacion(tareas_ok, pdf_path)
+
+    def ofrecer_reanudacion(self, tareas_ok, pdf_path):
+        """Ofrece reanudar un envío de este PDF que se interrumpió (caída o cierre)."""
+        self.reanudacion = None
+        self.send_all_button.config(text="Enviar a Todos")
+        if not tareas_ok or not pdf_path:
+            return
+        try:
+            ejecucion = ejecucion_interrumpida(
+                pdf_path, self.controller.config,
+                pdf_hash=self.controller.sesion.hash_pdf(pdf_path))
+        except OSError:
+            return
+        if not ejecucion:
+            return
+        
+        enviadas = [tarea for tarea in tareas_ok if ya_enviada(ejecucion, tarea)]
+        if ejecucion.get('aplazada'):
+            motivo = "se aplazó al agotarse la cuota diaria de envíos"
+        else:
+            motivo = "no llegó a terminar"
+        if messagebox.askyesno(
+            "Envío interrumpido",
+            f"El envío de este PDF iniciado el {ejecucion['fecha']} {motivo}.\n\n"
+            f"Nóminas ya enviadas: {len(enviadas)} de {len(tareas_ok)}.\n\n"
+            "¿Desea reanudarlo? Las nóminas ya enviadas no se volverán a enviar.\n"
+            "(Si responde No, un nuevo envío las enviará todas otra vez.)"
+        ):
+            self.reanudacion = ejecucion
+            for tarea in enviadas:
+                item_id = self.email_to_item_id[f"pagina_{tarea['pagina']}"]
+                self.tree.set(item_id, "Archivo PDF", ejecucion['enviadas'][tarea['pagina']]['archivo'])
+                self.tree.set(item_id, "Estado", "sent")
+                self.tree.item(item_id, tags=('sent',))
+            self.send_all_button.config(text="Reanudar Envío")
+        else:
+            try:
+                descartar_ejecucion(ejecucion)
+            except OSError:
+                pass
 
     def iniciar_envio_todos(self):
         email = self.controller.config.get('Email', 'email_origen', fallback='')
@@ -253,17 +327,20 @@ class Paso3(tk.Frame):
 
         if messagebox.askyesno(
             "Confirmar Envío",
+            "¿Desea reanudar el envío? Solo se enviarán las nóminas que aún no se enviaron."
+            if self.reanudacion else
             "¿Está seguro de que desea iniciar el envío de correos a TODOS los empleados?"
         ):
             # Inicializar estadísticas
             self.estadisticas = {
                 "enviados": 0,
                 "errores": 0, 
-                "total": len([t for t in self.controller.tareas_verificacion if t['status'] == '[OK]']),
+                "total": self.controller.tareas_verificacion.contadores["ok"],
                 "tiempo_inicio": datetime.now()
             }
             
             self.progress_bar['value'] = 0
+            self.ritmo_label.config(text="")
             self.send_all_button.config(state="disabled", text="Enviando...")
             self.bloquear_navegacion()  # Bloquear navegación durante envío
             
@@ -281,19 +358,61 @@ class Paso3(tk.Frame):
                         (email, msg, status, stats)
                     ),
                     lambda val: self.after(0, self.update_progress, val),
-                    self.stop_event  # Pasar evento de cancelación
+                    self.stop_event,  # Pasar evento de cancelación
+                    self.reanudacion  # Ejecución interrumpida a continuar, si la hay
                 ),
                 daemon=True
             ).start()
             self.after(100, self.procesar_cola_ui)
 
+    def iniciar_preparacion(self):
+        """Prepara todos los PDFs cifrados sin enviarlos."""
+        if not messagebox.askyesno(
+            "Preparar PDFs",
+            "Se generarán ahora los PDFs cifrados de todos los empleados, sin enviar "
+            "ningún correo.\n\nAl pulsar después 'Enviar a Todos' se adjuntarán "
+            "los PDFs ya preparados.\n\n¿Desea continuar?"
+        ):
+            return
+        
+        self.progress_bar['value'] = 0
+        self.prepare_button.config(state="disabled", text="Preparando...")
+        self.bloquear_navegacion()
+        
+        self.stop_event = threading.Event()
+        self.modo_preparacion = True
+        
+        threading.Thread(
+            target=preparar_nominas_worker,
+            args=(
+                self.controller.pdf_path.get(),
+                self.controller.tareas_verificacion,
+                self.controller.config,
+                lambda email, msg, status, stats=None: self.update_queue.put(
+                    (email, msg, status, stats)
+                ),
+                lambda val: self.after(0, self.update_progress, val),
+                self.stop_event
+            ),
+            daemon=True
+        ).start()
+        self.after(100, self.procesar_cola_ui)
+
     def update_progress(self, value):
         if value == -1:
             self.progress_bar['value'] = 100  # Finalizar la barra para terminar el bucle
             
             # Desbloquear navegación y restaurar botones
             self.desbloquear_navegacion()
+            self.reanudacion = None
             self.send_all_button.config(state="normal", text="Enviar a Todos")
+            self.prepare_button.config(state="normal", text="Preparar PDFs")
+            
+            if self.modo_preparacion:
+                # Solo se prepararon los PDFs: se sigue en este paso
+                self.modo_preparacion = False
+                self.procesar_cola_ui()
+                return
             
             # Esperar a que lleguen las estadísticas finales
             self.esperar_estadisticas_finales()
@@ -366,15 +485,34 @@ class Paso3(tk.Frame):
                     self.estadisticas_finales_recibidas = True  # Marcar como recibidas
                     continue
                 
-                item_id = self.email_to_item_id.get(unique_key)
-                original_data = self.email_to_data.get(unique_key)
-                if item_id and original_data:
-                    # Usar los datos originales almacenados, solo cambiar el estado
-                    self.tree.item(
-                        item_id,
-                        values=(original_data[0], original_data[1], original_data[2], msg, status),
-                        tags=(status,)
+                if unique_key == "ritmo_envio" and stats:
+                    self.ritmo_label.config(
+                        text=f"Ritmo: {stats['ritmo']:.1f} correos/s · "
+                             f"Conexiones: {stats['conexiones']} de {stats['conexiones_max']}"
+                             + ("" if stats['adaptativo'] else " (ritmo fijo)")
                     )
+                    continue
+                
+                if unique_key == "envio_aplazado":
+                    messagebox.showwarning("Envío aplazado", msg)
+                    continue
+                
+                if unique_key == "preparacion_finalizada" and stats:
+                    messagebox.showinfo(
+                        "PDFs preparados",
+                        f"PDFs cifrados preparados: {stats['preparadas']} de {stats['total']}"
+                        f" (errores: {stats['errores']}).\n\n"
+                        f"Carpeta: {stats.get('carpeta_pdfs_enviados')}\n\n"
+                        "Pulse 'Enviar a Todos' cuando quiera enviarlos."
+                    )
+                    continue
+                
+                item_id = self.email_to_item_id.get(unique_key)
+                if item_id:
+                    # Solo cambian las columnas de estado, los datos ya están en la fila
+                    self.tree.set(item_id, "Archivo PDF", msg)
+                    self.tree.set(item_id, "Estado", status)
+                    self.tree.item(item_id, tags=(status,))
         except queue.Empty:
             pass
         finally:
@@ -3,6 +3,8 @@ from tkinter import messagebox
 from datetime import datetime
 import os
 
+from logic.tareas import AlmacenTareas
+
 
 class PasoCompletado(tk.Frame):
     def __init__(self, parent, controller):
@@ -244,7 +246,8 @@ class PasoCompletado(tk.Frame):
         # Limpiar datos del proceso anterior
         self.controller.pdf_path.set("")
         self.controller.empleados_path.set("")
-        self.controller.tareas_verificacion = []
+        self.controller.tareas_verificacion = AlmacenTareas()
+        self.controller.sesion.cerrar()
         
         # Limpiar mapeo de columnas
         for var in self.controller.mapa_columnas.values():